@@ -0,0 +1,98 @@
+# adaptive.py
+"""
+Adaptive episode budgets: sequential confidence-interval stopping per sweep cell.
+
+With a fixed --episodes every (attack, defense) cell costs the same, although a cell whose
+ASR is pinned at 0.0 or 1.0 is settled after a few dozen episodes while a cell near 0.5
+needs hundreds. AdaptiveBudget hands out batches of episodes one at a time, always to the
+unfinished cell with the widest Wilson score interval (cells not yet sampled first), and
+retires a cell once its interval is narrower than the target width. The sweep's total
+budget is episodes x cells, so whatever settled cells do not use goes to uncertain ones.
+A cell may track several proportions at once (the FPR pass measures one per defense);
+its width is the widest of them.
+
+Batches cover consecutive episode ranges of each cell, so every episode keeps the seed it
+has in a fixed-budget run and the first n episodes of a cell are exactly those of
+run_experiments --episodes n. Stopping on a sequentially checked interval makes the
+nominal coverage slightly optimistic; keep batches reasonably large (the default 50).
+
+Provides:
+- wilson_interval(successes, n, confidence): (low, high)
+- AdaptiveBudget(cells, total_episodes, batch_episodes, target_width, confidence, min_episodes):
+  next_batch(), update(cell, n, successes), episodes(cell), interval(cell, i), done(cell)
+"""
+import math
+from statistics import NormalDist
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+def wilson_interval(successes: int, n: int, confidence: float = 0.95) -> Tuple[float, float]:
+    """Wilson score interval of a binomial proportion ((0, 1) when n == 0)."""
+    if n <= 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    # center - half is exactly 0 at successes == 0 (and center + half 1 at successes == n) except for rounding
+    low = 0.0 if successes == 0 else max(0.0, center - half)
+    high = 1.0 if successes == n else min(1.0, center + half)
+    return low, high
+
+class AdaptiveBudget:
+    """
+    Greedy allocation of total_episodes over cells in batches of batch_episodes.
+    A cell is done once it has run min_episodes and every proportion it tracks has a
+    Wilson interval (at the given confidence) no wider than target_width.
+    """
+    def __init__(self, cells: Sequence[Hashable], total_episodes: int, batch_episodes: int = 50, target_width: float = 0.1,
+                 confidence: float = 0.95, min_episodes: int = 0):
+        self.cells = list(cells)
+        self.remaining = total_episodes
+        self.batch_episodes = max(1, batch_episodes)
+        self.target_width = target_width
+        self.confidence = confidence
+        self.min_episodes = min_episodes
+        self._n: Dict[Hashable, int] = {c: 0 for c in self.cells}
+        self._successes: Dict[Hashable, List[int]] = {c: [] for c in self.cells}
+        self._done: Dict[Hashable, bool] = {c: False for c in self.cells}
+
+    def episodes(self, cell: Hashable) -> int:
+        return self._n[cell]
+
+    def interval(self, cell: Hashable, i: int = 0) -> Tuple[float, float]:
+        """Wilson interval of the i-th proportion of cell."""
+        successes = self._successes[cell]
+        return wilson_interval(successes[i] if successes else 0, self._n[cell], self.confidence)
+
+    def width(self, cell: Hashable) -> float:
+        if not self._successes[cell]:
+            return 1.0
+        return max(hi - lo for lo, hi in (self.interval(cell, i) for i in range(len(self._successes[cell]))))
+
+    def done(self, cell: Hashable) -> bool:
+        return self._done[cell]
+
+    def next_batch(self) -> Tuple[Hashable, int, int] | None:
+        """(cell, ep_start, ep_stop) of the next batch to run, or None when every cell is done or the budget is spent."""
+        if self.remaining <= 0:
+            return None
+        open_cells = [c for c in self.cells if not self._done[c]]
+        if not open_cells:
+            return None
+        # widest interval first; ties (e.g. unsampled cells) in cell order
+        cell = max(open_cells, key=lambda c: (self.width(c), -self.cells.index(c)))
+        n = min(self.batch_episodes, self.remaining)
+        return cell, self._n[cell], self._n[cell] + n
+
+    def update(self, cell: Hashable, n: int, successes: Sequence[int]):
+        """Record a finished batch of n episodes with the given successes per tracked proportion."""
+        totals = self._successes[cell]
+        if not totals:
+            totals.extend([0] * len(successes))
+        for i, s in enumerate(successes):
+            totals[i] += s
+        self._n[cell] += n
+        self.remaining -= n
+        if self._n[cell] >= self.min_episodes and self.width(cell) <= self.target_width:
+            self._done[cell] = True
@@ -0,0 +1,241 @@
+# analytics.py
+"""
+Out-of-core aggregates over raw per-step logs.
+
+Raw logs are read chunk by chunk (CSV, Parquet or .traj, any number of files) and folded
+into per-group accumulators, so memory is bounded by one chunk plus the number of groups,
+however large the logs are. Every accumulator is mergeable: counts and sums add up,
+latency quantiles come from instrumentation.LatencyHistogram (bucket counts add up), and
+first-press steps are kept as a step -> episodes histogram. Workers can therefore each
+aggregate a subset of the files and the partials are merged afterwards (in-process, or
+via to_dict()/from_dict() JSON files from other machines).
+
+Per group (default: attack_type, defense) it reports episodes, rows, ASR, reward
+mean/std/min/max, mean episode length, decision-latency percentiles, and ASR by step
+(fraction of episodes that pressed at or before each step).
+
+Run-length rows (--rle_rows logs, 'repeat' column) are weighted by their repeat count.
+Logs without some group-by column (run_attacks logs have no 'defense') fall into the
+constant group MISSING_GROUP for it, and logs without decision_latency leave the latency
+percentiles NaN.
+
+Provides:
+- iter_raw_chunks(path, columns, chunk_rows): DataFrame chunks of one raw log
+- RawLogAggregate(group_by): update(chunk)/finish() or consume(path), merge(other),
+  to_dict()/from_dict(), results(), asr_by_step()
+- aggregate_files(paths, group_by, chunk_rows, workers): aggregate many files in parallel
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import LatencyHistogram, PERCENTILES, _column_suffix
+from trajectory import DEFAULT_CHUNK_ROWS, TrajReader
+
+TARGET_ACTION = "PRESS"
+GROUP_BY = ("attack_type", "defense")
+# columns the aggregates read (plus the group-by columns and 'repeat' when present)
+_VALUE_COLUMNS = ("episode", "step", "action", "reward", "decision_latency")
+# group value for a group-by column the log does not have
+MISSING_GROUP = "none"
+
+def iter_raw_chunks(path: str, columns: Sequence[str] | None = None, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Yield a raw log as DataFrames of at most chunk_rows rows, reading only columns
+    (those missing from the file are skipped). The format is taken from the extension.
+    """
+    wanted = None if columns is None else set(columns)
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        usecols = None if wanted is None else (lambda c: c in wanted)
+        yield from pd.read_csv(path, usecols=usecols, chunksize=chunk_rows)
+    elif ext == ".parquet":
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(path)
+        names = [c for c in pf.schema_arrow.names if wanted is None or c in wanted]
+        for batch in pf.iter_batches(batch_size=chunk_rows, columns=names):
+            yield batch.to_pandas()
+    elif ext == ".traj":
+        with TrajReader(path) as reader:
+            names = [c for c in reader.columns if wanted is None or c in wanted]
+            for start in range(0, len(reader), chunk_rows):
+                yield reader.to_pandas(start, start + chunk_rows, columns=names)
+    else:
+        raise ValueError(f"Unknown raw log format: {path}")
+
+def _new_group() -> Dict[str, Any]:
+    return {"rows": 0, "episodes": 0, "successes": 0, "steps": 0,
+            "reward_sum": 0.0, "reward_sq": 0.0, "reward_min": float("inf"), "reward_max": float("-inf"),
+            "latency": LatencyHistogram(), "press_steps": {}}
+
+def _merge_group(acc: Dict[str, Any], other: Dict[str, Any]):
+    for k in ("rows", "episodes", "successes", "steps", "reward_sum", "reward_sq"):
+        acc[k] += other[k]
+    acc["reward_min"] = min(acc["reward_min"], other["reward_min"])
+    acc["reward_max"] = max(acc["reward_max"], other["reward_max"])
+    acc["latency"].merge(other["latency"])
+    for step, n in other["press_steps"].items():
+        acc["press_steps"][step] = acc["press_steps"].get(step, 0) + n
+
+class RawLogAggregate:
+    """
+    Grouped, mergeable aggregates over raw log rows.
+    Rows of an episode must be contiguous within a file (as the runners write them); an
+    episode cut by a chunk boundary is held back and completed with the next chunk, so
+    call finish() at the end of each file (consume() does this).
+    """
+    def __init__(self, group_by: Sequence[str] = GROUP_BY):
+        self.group_by = tuple(group_by)
+        self.groups: Dict[Tuple, Dict[str, Any]] = {}
+        self._pending: pd.DataFrame | None = None
+
+    @property
+    def columns(self) -> List[str]:
+        """Columns a chunk is read with ('repeat', 'decision_latency' and the group-by columns are optional)."""
+        return list(dict.fromkeys(self.group_by + _VALUE_COLUMNS + ("repeat",)))
+
+    def _group(self, key: Tuple) -> Dict[str, Any]:
+        acc = self.groups.get(key)
+        if acc is None:
+            acc = self.groups[key] = _new_group()
+        return acc
+
+    def update(self, chunk: pd.DataFrame):
+        """Fold one chunk of rows in; its last episode waits for the next chunk or finish()."""
+        if self._pending is not None:
+            chunk = pd.concat([self._pending, chunk], ignore_index=True)
+            self._pending = None
+        if len(chunk) == 0:
+            return
+        episodes = chunk["episode"].to_numpy()
+        last = len(chunk) - int(np.argmax(episodes[::-1] != episodes[-1])) if (episodes != episodes[-1]).any() else 0
+        self._pending = chunk.iloc[last:]
+        self._fold(chunk.iloc[:last])
+
+    def finish(self):
+        """Fold the held-back episode (end of a file)."""
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            self._fold(pending)
+
+    def consume(self, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> "RawLogAggregate":
+        """Stream one raw log file through update() and finish()."""
+        for chunk in iter_raw_chunks(path, self.columns, chunk_rows):
+            self.update(chunk)
+        self.finish()
+        return self
+
+    def _fold(self, rows: pd.DataFrame):
+        if len(rows) == 0:
+            return
+        weight = rows["repeat"].to_numpy(np.int64) if "repeat" in rows else np.ones(len(rows), dtype=np.int64)
+        reward = rows["reward"].to_numpy(np.float64)
+        step = rows["step"].to_numpy(np.int64)
+        press = (rows["action"] == TARGET_ACTION).to_numpy()
+        missing = {c: MISSING_GROUP for c in self.group_by if c not in rows}
+        if missing:
+            rows = rows.assign(**missing)
+        has_latency = "decision_latency" in rows
+        frame = rows[list(self.group_by) + ["episode"]].assign(
+            _weight=weight, _reward=reward * weight,
+            _press_step=np.where(press, step, np.iinfo(np.int64).max))
+        if has_latency:
+            frame["_latency_ns"] = (rows["decision_latency"].to_numpy(np.float64) * 1e9).astype(np.int64)
+        # episode level: one record per (group, episode)
+        per_episode = frame.groupby(list(self.group_by) + ["episode"], sort=False, observed=True).agg(
+            steps=("_weight", "sum"), reward=("_reward", "sum"), press_step=("_press_step", "min")).reset_index()
+        for key, eps in per_episode.groupby(list(self.group_by), sort=False, observed=True):
+            acc = self._group(key if isinstance(key, tuple) else (key,))
+            r = eps["reward"].to_numpy()
+            pressed = eps["press_step"].to_numpy()
+            pressed = pressed[pressed != np.iinfo(np.int64).max]
+            acc["episodes"] += len(eps)
+            acc["successes"] += len(pressed)
+            acc["steps"] += int(eps["steps"].sum())
+            acc["reward_sum"] += float(r.sum())
+            acc["reward_sq"] += float((r * r).sum())
+            acc["reward_min"] = min(acc["reward_min"], float(r.min()))
+            acc["reward_max"] = max(acc["reward_max"], float(r.max()))
+            steps, counts = np.unique(pressed, return_counts=True)
+            for s, n in zip(steps.tolist(), counts.tolist()):
+                acc["press_steps"][s] = acc["press_steps"].get(s, 0) + n
+        # row level: latency histogram
+        for key, part in frame.groupby(list(self.group_by), sort=False, observed=True):
+            acc = self._group(key if isinstance(key, tuple) else (key,))
+            acc["rows"] += int(part["_weight"].sum())
+            if has_latency:
+                acc["latency"].record_array(part["_latency_ns"].to_numpy(), part["_weight"].to_numpy())
+
+    def merge(self, other: "RawLogAggregate") -> "RawLogAggregate":
+        """Add other's groups into self (both must be finished)."""
+        if other.group_by != self.group_by:
+            raise ValueError(f"cannot merge aggregates grouped by {other.group_by} into {self.group_by}")
+        for key, acc in other.groups.items():
+            _merge_group(self._group(key), acc)
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-friendly partial aggregate."""
+        groups = []
+        for key, acc in self.groups.items():
+            d = dict(acc, latency=acc["latency"].to_dict(), press_steps=[[s, n] for s, n in acc["press_steps"].items()])
+            groups.append({"key": [k.item() if isinstance(k, np.generic) else k for k in key], "acc": d})
+        return {"group_by": list(self.group_by), "groups": groups}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "RawLogAggregate":
+        agg = cls(d["group_by"])
+        for g in d["groups"]:
+            acc = dict(g["acc"])
+            acc["latency"] = LatencyHistogram.from_dict(acc["latency"])
+            acc["press_steps"] = {int(s): n for s, n in acc["press_steps"]}
+            agg.groups[tuple(g["key"])] = acc
+        return agg
+
+    def results(self, ps: Sequence[float] = PERCENTILES) -> pd.DataFrame:
+        """One row per group: episodes, rows, asr, reward stats, mean_steps, latency percentiles (seconds)."""
+        records = []
+        for key, acc in sorted(self.groups.items()):
+            n = acc["episodes"]
+            mean = acc["reward_sum"] / n if n else float("nan")
+            rec = dict(zip(self.group_by, key))
+            rec.update(episodes=n, rows=acc["rows"], asr=acc["successes"] / n if n else float("nan"),
+                       mean_reward=mean, std_reward=float(np.sqrt(max(acc["reward_sq"] / n - mean * mean, 0.0))) if n else float("nan"),
+                       min_reward=acc["reward_min"], max_reward=acc["reward_max"], mean_steps=acc["steps"] / n if n else float("nan"))
+            for p, v in acc["latency"].percentiles(ps).items():
+                rec[f"latency_{_column_suffix(p)}"] = v / 1e9
+            records.append(rec)
+        return pd.DataFrame(records)
+
+    def asr_by_step(self) -> pd.DataFrame:
+        """Long table: per group and step, the fraction of episodes that pressed at or before that step."""
+        records = []
+        for key, acc in sorted(self.groups.items()):
+            if not acc["press_steps"]:
+                continue
+            steps = sorted(acc["press_steps"])
+            cum = np.cumsum([acc["press_steps"][s] for s in steps])
+            for s, c in zip(steps, cum.tolist()):
+                records.append(dict(zip(self.group_by, key), step=s, asr=c / acc["episodes"]))
+        return pd.DataFrame(records)
+
+def _aggregate_file(job: Tuple[str, Tuple[str, ...], int]) -> Dict[str, Any]:
+    path, group_by, chunk_rows = job
+    return RawLogAggregate(group_by).consume(path, chunk_rows).to_dict()
+
+def aggregate_files(paths: Sequence[str], group_by: Sequence[str] = GROUP_BY, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                    workers: int = 1) -> RawLogAggregate:
+    """Aggregate raw log files, one file per task on a process pool when workers > 1, then merge."""
+    total = RawLogAggregate(group_by)
+    if workers <= 1:
+        for path in paths:
+            total.consume(path, chunk_rows)
+        return total
+    jobs = [(path, tuple(group_by), chunk_rows) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for part in pool.map(_aggregate_file, jobs):
+            total.merge(RawLogAggregate.from_dict(part))
+    return total
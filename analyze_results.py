@@ -1,14 +1,75 @@
+# analyze_results.py
+"""
+Print the sweep summary, or stream aggregates over raw logs (see analytics.py).
+
+Usage:
+    python analyze_results.py                                      # print results/day3/summary.csv
+    python analyze_results.py --raw 'results/day3/raw_*.csv' --workers 8 --out_dir results/day3/analysis
+    python analyze_results.py --raw 'shard3/raw_*.traj' --save_partial shard3.json   # on each machine
+    python analyze_results.py --merge 'shard*.json' --out_dir results/day3/analysis  # combine the partials
+"""
+import argparse
+import glob
+import json
+import os
+
 import pandas as pd
 
-df = pd.read_csv('results/day3/summary.csv')
-print('Summary Results:')
-print(df.to_string(index=False))
-print('\nKey Observations:')
-print('1. Without defense (none): ASR = 1.0 for all attacks (except none)')
-print('2. With sanitize defense: ASR = 0.0 for all attacks')
-print('3. With confirm defense: Still ASR = 1.0 - potential issue!')
-print('4. Mean reward is much lower with successful attacks (-86 vs -4)')
-
-print('\nChecking confirm defense logic...')
-# The issue might be that confirm defense allows legitimate owner=alice + PRESS combination
-print('Confirm defense should block unauthorized PRESS actions but allow authorized ones')
+def print_summary(path: str):
+    df = pd.read_csv(path)
+    print('Summary Results:')
+    print(df.to_string(index=False))
+    print('\nKey Observations:')
+    print('1. Without defense (none): ASR = 1.0 for all attacks (except none)')
+    print('2. With sanitize defense: ASR = 0.0 for all attacks')
+    print('3. With confirm defense: Still ASR = 1.0 - potential issue!')
+    print('4. Mean reward is much lower with successful attacks (-86 vs -4)')
+
+    print('\nChecking confirm defense logic...')
+    # The issue might be that confirm defense allows legitimate owner=alice + PRESS combination
+    print('Confirm defense should block unauthorized PRESS actions but allow authorized ones')
+
+def _expand(patterns):
+    paths = []
+    for p in patterns:
+        matched = sorted(glob.glob(p))
+        paths.extend(matched if matched else [p])
+    return paths
+
+def main(args):
+    if not args.raw and not args.merge:
+        print_summary(args.summary)
+        return
+    from analytics import RawLogAggregate, aggregate_files
+    if args.raw:
+        paths = _expand(args.raw)
+        print(f"[+] Streaming {len(paths)} raw log(s) in chunks of {args.chunk_rows} rows with {args.workers} worker(s)")
+        agg = aggregate_files(paths, args.group_by, args.chunk_rows, args.workers)
+    else:
+        agg = RawLogAggregate(args.group_by)
+    for path in _expand(args.merge):
+        with open(path) as fh:
+            agg.merge(RawLogAggregate.from_dict(json.load(fh)))
+    if args.save_partial:
+        with open(args.save_partial, "w") as fh:
+            json.dump(agg.to_dict(), fh)
+        print(f"[+] Saved partial aggregate to {args.save_partial}")
+    results = agg.results()
+    print(results.to_string(index=False))
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+        results.to_csv(os.path.join(args.out_dir, "raw_aggregates.csv"), index=False)
+        agg.asr_by_step().to_csv(os.path.join(args.out_dir, "asr_by_step.csv"), index=False)
+        print(f"[+] Saved raw_aggregates.csv and asr_by_step.csv to {args.out_dir}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--summary", type=str, default="results/day3/summary.csv", help="summary.csv to print when no raw logs are given")
+    parser.add_argument("--raw", type=str, nargs="*", default=[], help="raw log files or glob patterns (.csv, .parquet, .traj)")
+    parser.add_argument("--merge", type=str, nargs="*", default=[], help="partial aggregate JSON files (from --save_partial) to merge in")
+    parser.add_argument("--group_by", type=str, nargs="+", default=["attack_type", "defense"], help="raw log columns to group by (a column a log lacks, e.g. defense in run_attacks logs, groups as 'none')")
+    parser.add_argument("--chunk_rows", type=int, default=65536, help="rows read per chunk")
+    parser.add_argument("--workers", type=int, default=1, help="files aggregated in parallel")
+    parser.add_argument("--save_partial", type=str, default="", help="write the (mergeable) aggregate as JSON")
+    parser.add_argument("--out_dir", type=str, default="", help="write raw_aggregates.csv and asr_by_step.csv here")
+    main(parser.parse_args())
@@ -0,0 +1,364 @@
+# benchmarks.py
+"""
+Microbenchmarks for the environment, policy, attacks and defenses, with JSON baselines.
+
+Each case is a zero-argument callable timed in a tight loop after a warm-up pass. The
+cost of the loop itself (calling an empty function) is measured the same way and
+subtracted, so ns/op is the cost of the operation alone. Allocations are measured in a
+separate tracemalloc pass: the peak of traced memory above the starting point while the
+operation runs (transient bytes of one call) and the traced blocks still alive per call
+afterwards (retained allocations, i.e. growth).
+
+Startup is reported separately: each entry-point module is imported in a fresh
+interpreter with -X importtime (total and heaviest direct imports), and a tiny sweep
+(1 episode, no plot) is timed end to end as a cold start. The streaming sanitizer's time
+to first safe byte is compared with sanitizing the whole message once it has arrived.
+
+Usage:
+    python benchmarks.py                                  # run and print the table
+    python benchmarks.py --save results/bench_base.json   # store a baseline
+    python benchmarks.py --compare results/bench_base.json --threshold 0.25
+        # exit 1 if any hot-path case got more than 25% slower than the baseline
+    python benchmarks.py --only sanitize confirm          # run a subset (substring match)
+    python benchmarks.py --only startup                   # just the import-time / cold-start report
+    python benchmarks.py --only first_byte                # just the streaming-sanitizer time-to-first-safe-byte report
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Any
+
+import numpy as np
+
+from env import GridWorld
+from policies import rule_based_policy
+import attacks as atk
+import defenses as dfn
+from step_buffer import StepBuffer
+from trajectory import TrajectorySink
+
+class _NullSink(TrajectorySink):
+    """Sink that drops its chunks (logging cost without I/O)."""
+    def _write_chunk(self, columns, n_rows):
+        pass
+
+class Case:
+    """One benchmark: fn() is a single operation; hot cases are gated by --compare."""
+    def __init__(self, name: str, fn: Callable[[], Any], hot: bool = True, unit: str = "op", ops_per_call: int = 1):
+        self.name = name
+        self.fn = fn
+        self.hot = hot
+        self.unit = unit
+        self.ops_per_call = ops_per_call
+
+def _noop():
+    pass
+
+def _loop_ns(fn: Callable[[], Any], n: int) -> int:
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        fn()
+    return time.perf_counter_ns() - start
+
+def _calibrate(fn: Callable[[], Any], target_s: float) -> int:
+    """Iterations needed for one timed repeat to take about target_s (also serves as warm-up)."""
+    n = 1
+    while True:
+        elapsed = _loop_ns(fn, n)
+        if elapsed >= target_s * 1e9 / 10 or n >= 1 << 24:
+            return max(1, int(n * target_s * 1e9 / max(elapsed, 1)))
+        n *= 4
+
+def time_case(fn: Callable[[], Any], target_s: float = 0.1, repeats: int = 5) -> Dict[str, float]:
+    """
+    Warm up, then time `repeats` loops of n calls and keep the fastest.
+    Returns ns per call with the empty-call loop overhead subtracted, and the raw figure.
+    """
+    n = _calibrate(fn, target_s)
+    best = min(_loop_ns(fn, n) for _ in range(repeats)) / n
+    overhead = min(_loop_ns(_noop, n) for _ in range(repeats)) / n
+    return {"ns_per_call": max(0.0, best - overhead), "raw_ns_per_call": best, "calls": n}
+
+def memory_case(fn: Callable[[], Any], calls: int = 1000) -> Dict[str, float]:
+    """
+    Transient bytes of a call (peak traced memory above the start, over `calls` calls) and
+    traced blocks retained per call, measured after one warm-up call.
+    """
+    fn()
+    tracemalloc.start()
+    try:
+        before_blocks = len(tracemalloc.take_snapshot().traces)
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        for _ in range(calls):
+            fn()
+        _, peak = tracemalloc.get_traced_memory()
+        after_blocks = len(tracemalloc.take_snapshot().traces)
+    finally:
+        tracemalloc.stop()
+    return {"peak_bytes_per_call": peak - base, "retained_blocks_per_call": (after_blocks - before_blocks) / calls}
+
+# streamed perception arrives in chunks of this many characters (about one model token)
+STREAM_CHUNK_CHARS = 4
+
+def _chunks(text: str, size: int) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+def build_cases(out_dir: str, e2e_episodes: int = 200) -> List[Case]:
+    """All benchmark cases; the end-to-end runs write their raw logs under out_dir."""
+    env = GridWorld(size=4)
+    s_repr, m = env.reset(seed=0)
+    actions = ["RIGHT", "DOWN", "LEFT", "UP"]
+    step_i = [0]
+
+    def env_step():
+        env.step(actions[step_i[0] & 3])
+        step_i[0] += 1
+
+    seed_i = [0]
+
+    def env_reset():
+        env.reset(seed=seed_i[0])
+        seed_i[0] += 1
+
+    m_direct = atk.inject(m, "direct")
+    s_at_button = ((0, 0), (("red_button", (0, 0)),))
+    direct_chunks = _chunks(m_direct, STREAM_CHUNK_CHARS)
+
+    # one step's raw-log record, as a dict of strings (previous runner) and into a StepBuffer
+    reward, done, info = -0.05, False, {}
+    m_processed = dfn.sanitize(m_direct)
+    dict_sink = _NullSink(os.path.join(out_dir, "null"))
+
+    def log_row_dict():
+        dict_sink.write({"episode": 0, "step": 1, "attack_type": "direct", "defense": "sanitize", "agent_pos": str(s_repr[0]),
+                         "objects": str(s_repr[1]), "m_original": m, "m_injected": m_direct, "m_processed": m_processed,
+                         "action": "RIGHT", "confirmed": True, "reward": float(reward), "done": bool(done), "info": str(info),
+                         "decision_latency": 1e-6, "timestamp": time.time()})
+
+    steps = StepBuffer(50, _NullSink(os.path.join(out_dir, "null")), "direct", "sanitize")
+
+    def log_step_buffer():
+        if steps.n == steps.capacity:
+            steps.n = 0  # reuse the block; exporting it to the sink is timed by log.step_buffer_export
+        steps.record(1, s_repr, m, "RIGHT", True, reward, done, info, 1e-6)
+
+    def export_block():
+        steps.n = steps.capacity
+        steps.flush()
+
+    def run_config(vectorized: bool):
+        # imported here so the microbenchmarks above do not pay for pandas/matplotlib
+        import run_experiments as rexp
+        return lambda: rexp.run_one_configuration("direct", "sanitize", e2e_episodes, 50, out_dir, vectorized=vectorized)
+
+    return [
+        Case("env.reset", env_reset),
+        Case("env.step", env_step),
+        Case("env.observe", env.observe),
+        Case("env.render", env.render, hot=False),
+        Case("policy.rule_based", lambda: rule_based_policy(s_repr, m)),
+        Case("policy.rule_based_injected", lambda: rule_based_policy(s_repr, m_direct)),
+        Case("attacks.inject_direct", lambda: atk.inject(m, "direct")),
+        Case("attacks.inject_camouflaged", lambda: atk.inject(m, "camouflaged")),
+        Case("defenses.sanitize_benign", lambda: dfn.sanitize(m)),
+        Case("defenses.sanitize_direct", lambda: dfn.sanitize(m_direct)),
+        Case("defenses.sanitize_stream_direct", lambda: "".join(dfn.sanitize_stream(direct_chunks)), unit="chunk",
+             ops_per_call=len(direct_chunks)),
+        Case("defenses.confirm_low_risk", lambda: dfn.confirm("RIGHT", s_repr, m_direct)),
+        Case("defenses.confirm_press", lambda: dfn.confirm("PRESS", s_at_button, m_direct)),
+        Case("log.row_dict", log_row_dict),
+        Case("log.step_buffer", log_step_buffer),
+        Case("log.step_buffer_export", export_block, hot=False, unit="step", ops_per_call=steps.capacity),
+        Case("e2e.run_one_configuration", run_config(False), hot=False, unit="episode", ops_per_call=e2e_episodes),
+        Case("e2e.run_one_configuration_vectorized", run_config(True), hot=False, unit="episode", ops_per_call=e2e_episodes),
+    ]
+
+def run_benchmarks(cases: List[Case], target_s: float = 0.1, repeats: int = 5, memory: bool = True) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for case in cases:
+        e2e = case.ops_per_call > 1
+        t = time_case(case.fn, target_s=target_s if not e2e else 0.0, repeats=repeats if not e2e else 1)
+        r = {
+            "hot": case.hot,
+            "unit": case.unit,
+            "ns_per_op": t["ns_per_call"] / case.ops_per_call,
+            "raw_ns_per_op": t["raw_ns_per_call"] / case.ops_per_call,
+            "ops_per_s": case.ops_per_call * 1e9 / t["ns_per_call"] if t["ns_per_call"] > 0 else float("inf"),
+        }
+        if memory and not e2e:
+            mem = memory_case(case.fn)
+            r["peak_bytes_per_op"] = mem["peak_bytes_per_call"]
+            r["retained_blocks_per_op"] = mem["retained_blocks_per_call"]
+        results[case.name] = r
+        mem_text = f"{r['peak_bytes_per_op']:8.0f} B peak {r['retained_blocks_per_op']:7.3f} blk kept" if "peak_bytes_per_op" in r else ""
+        print(f"{case.name:40s} {r['ns_per_op']:14.1f} ns/{case.unit:8s} {r['ops_per_s']:14.1f} {case.unit}/s {mem_text}")
+    return results
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """Names of hot cases whose ns/op exceeds the baseline by more than threshold (fraction)."""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None or not r["hot"] or base["ns_per_op"] <= 0:
+            continue
+        change = r["ns_per_op"] / base["ns_per_op"] - 1
+        flag = "REGRESSION" if change > threshold else "ok"
+        print(f"{name:40s} {base['ns_per_op']:12.1f} -> {r['ns_per_op']:12.1f} ns/op ({change:+.1%}) {flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STARTUP_MODULES = ("numpy", "env", "defenses", "trajectory", "run_experiments", "run_attacks", "pandas", "matplotlib.pyplot")
+STARTUP_TARGET_S = 0.2
+# tiny sweep used for the cold-start figure (argv after the interpreter)
+TINY_SWEEP = ["run_experiments.py", "--episodes", "1", "--max_steps", "5", "--no_plot"]
+
+def import_times(module: str, top: int = 5) -> Dict[str, Any]:
+    """
+    Import module in a fresh interpreter with -X importtime. Returns the cumulative import
+    time in microseconds and its `top` slowest direct imports as [name, cumulative_us].
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=HERE,
+                          capture_output=True, text=True, check=True)
+    total = 0
+    children = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 0 and name.strip() == module:
+            total = int(cumulative)
+        elif depth == 1:
+            children.append([name.strip(), int(cumulative)])
+    children.sort(key=lambda c: -c[1])
+    return {"total_us": total, "top": children[:top]}
+
+def cold_start_s(argv: List[str], repeats: int = 5) -> float:
+    """Fastest wall time of `python argv...` over repeats fresh processes."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + argv, cwd=HERE, stdout=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def startup_report(out_dir: str, repeats: int = 5) -> Dict[str, Any]:
+    """Import times of STARTUP_MODULES and the cold-start time of TINY_SWEEP."""
+    print("[+] Startup (python -X importtime, fresh interpreter per module)")
+    modules = {}
+    for module in STARTUP_MODULES:
+        r = modules[module] = import_times(module)
+        heaviest = ", ".join(f"{name} {us / 1e3:.0f}" for name, us in r["top"][:3])
+        print(f"    import {module:24s} {r['total_us'] / 1e3:8.1f} ms   heaviest: {heaviest}")
+    tiny = cold_start_s(TINY_SWEEP + ["--out_dir", os.path.join(out_dir, "tiny_sweep")], repeats)
+    flag = "ok" if tiny < STARTUP_TARGET_S else "OVER TARGET"
+    print(f"    cold start {' '.join(TINY_SWEEP)}: {tiny * 1e3:.0f} ms (target {STARTUP_TARGET_S * 1e3:.0f} ms) {flag}")
+    return {"imports": modules, "tiny_sweep_s": tiny, "target_s": STARTUP_TARGET_S}
+
+def first_byte_report(chunk_chars: int = STREAM_CHUNK_CHARS, interval_ms: float = 20.0, repeats: int = 200) -> Dict[str, Any]:
+    """
+    Time to first safe byte of a streamed perception: chunk_chars characters arrive every
+    interval_ms. sanitize() can only start once the whole message has arrived; the
+    StreamingSanitizer emits as soon as a prefix is settled. Reported per attack message:
+    characters and arrival time until the first output, plus the sanitizer CPU time to get
+    there (fastest of repeats).
+    """
+    print(f"[+] Time to first safe byte ({chunk_chars} chars every {interval_ms:g} ms)")
+    _, m = GridWorld(size=4).reset(seed=0)
+    report = {}
+    for attack in ("none", "direct", "metadata", "camouflaged"):
+        text = atk.inject(m, attack)
+        chunks = _chunks(text, chunk_chars)
+        sanitizer = dfn.StreamingSanitizer()
+        needed = len(chunks)
+        for i, chunk in enumerate(chunks):
+            if sanitizer.feed(chunk):
+                needed = i + 1
+                break
+        sanitizer.finish()
+        stream_cpu = batch_cpu = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for chunk in chunks[:needed]:
+                sanitizer.feed(chunk)
+            stream_cpu = min(stream_cpu, time.perf_counter() - start)
+            sanitizer.finish()
+            start = time.perf_counter()
+            dfn.sanitize(text)
+            batch_cpu = min(batch_cpu, time.perf_counter() - start)
+        r = report[attack] = {
+            "chars": len(text),
+            "stream_chars": min(len(text), needed * chunk_chars),
+            "stream_ms": needed * interval_ms + stream_cpu * 1e3,
+            "batch_ms": len(chunks) * interval_ms + batch_cpu * 1e3,
+            "stream_cpu_us": stream_cpu * 1e6,
+            "batch_cpu_us": batch_cpu * 1e6,
+        }
+        print(f"    {attack:12s} {r['chars']:4d} chars: streaming after {r['stream_chars']:4d} chars {r['stream_ms']:8.1f} ms "
+              f"({r['stream_cpu_us']:6.1f} us cpu)   whole-message sanitize {r['batch_ms']:8.1f} ms ({r['batch_cpu_us']:6.1f} us cpu)")
+    return report
+
+def main(args) -> int:
+    with tempfile.TemporaryDirectory(prefix="bench_") as out_dir:
+        cases = build_cases(out_dir, e2e_episodes=args.e2e_episodes)
+        if args.only:
+            cases = [c for c in cases if any(s in c.name for s in args.only)]
+        print(f"[+] {len(cases)} benchmarks (python {platform.python_version()}, numpy {np.__version__})")
+        results = run_benchmarks(cases, target_s=args.target_s, repeats=args.repeats, memory=not args.no_memory)
+        startup = None
+        if not args.no_startup and (not args.only or "startup" in args.only):
+            startup = startup_report(out_dir, repeats=args.startup_repeats)
+        first_byte = None
+        if not args.no_first_byte and (not args.only or "first_byte" in args.only):
+            first_byte = first_byte_report(interval_ms=args.stream_interval_ms)
+    report = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(), "numpy": np.__version__, "timestamp": time.time()},
+        "results": results,
+    }
+    if startup is not None:
+        report["startup"] = startup
+    if first_byte is not None:
+        report["first_byte"] = first_byte
+    if args.save:
+        if os.path.dirname(args.save):
+            os.makedirs(os.path.dirname(args.save), exist_ok=True)
+        with open(args.save, "w") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"[+] Saved benchmark results to {args.save}")
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)["results"]
+        print(f"[+] Comparing hot paths with {args.compare} (threshold {args.threshold:.0%})")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"[!] {len(regressions)} hot path(s) regressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--save", type=str, default="", help="write results as a JSON baseline")
+    parser.add_argument("--compare", type=str, default="", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown of hot paths as a fraction (0.25 = 25%%)")
+    parser.add_argument("--only", type=str, nargs="*", default=None, help="run only cases whose name contains one of these strings")
+    parser.add_argument("--target_s", type=float, default=0.1, help="approximate seconds per timed repeat")
+    parser.add_argument("--repeats", type=int, default=5, help="timed repeats per case (fastest is kept)")
+    parser.add_argument("--e2e_episodes", type=int, default=200, help="episodes per end-to-end run")
+    parser.add_argument("--no_memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--no_startup", action="store_true", help="skip the import-time / cold-start report")
+    parser.add_argument("--no_first_byte", action="store_true", help="skip the streaming-sanitizer time-to-first-safe-byte report")
+    parser.add_argument("--stream_interval_ms", type=float, default=20.0, help="arrival interval of streamed chunks in the first-byte report")
+    parser.add_argument("--startup_repeats", type=int, default=5, help="cold starts timed (fastest is kept)")
+    args = parser.parse_args()
+    sys.exit(main(args))
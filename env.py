@@ -1,9 +1,57 @@
 # env.py
+import math
 import random
 from dataclasses import dataclass
-from typing import Dict, Tuple, Any
+from typing import Dict, Tuple, Any, List, Sequence
+
+import numpy as np
 
 ACTIONS = ["UP", "DOWN", "LEFT", "RIGHT", "PICK", "DROP", "PRESS", "NOOP"]
+ACTION_INDEX = {a: i for i, a in enumerate(ACTIONS)}
+
+def sample_layout(rng: random.Random, size: int, agent_pos: Tuple[int,int] = (0, 0)) -> Tuple[Tuple[int,int], Tuple[int,int]]:
+    """
+    Draw (red_box, red_button) positions from rng.
+    Objects are placed by rejection sampling so they never overlap the agent or each other.
+    This is the single source of layouts for GridWorld and VecGridWorld, so both consume
+    the random stream in exactly the same order.
+    """
+    # place objects at deterministic-ish positions for reproducibility
+    # ensure they don't overlap with agent
+    def rand_pos(exclude):
+        while True:
+            x = rng.randint(0, size - 1)
+            y = rng.randint(0, size - 1)
+            if (x, y) not in exclude:
+                return (x, y)
+    red_box_pos = rand_pos({agent_pos})
+    red_button_pos = rand_pos({agent_pos, red_box_pos})
+    return red_box_pos, red_button_pos
+
+def layout_distribution(size: int, agent_pos: Tuple[int,int] = (0, 0)) -> Tuple[List[Tuple[Tuple[int,int], Tuple[int,int]]], np.ndarray]:
+    """
+    Every (red_box, red_button) layout sample_layout can return, with its weight.
+    Rejection sampling makes red_box uniform over the size*size - 1 cells off the agent and
+    red_button uniform over the size*size - 2 cells left, so the layout probability is
+    1 / (size*size - 1) * 1 / (size*size - 2).
+    Weights are integers proportional to those probabilities (probability = weight / weights.sum()),
+    so weighted averages of integer outcomes stay exact.
+    Returns (layouts, weights) with layouts in row-major order of (red_box, red_button).
+    """
+    cells = [(x, y) for x in range(size) for y in range(size)]
+    box_cells = [c for c in cells if c != agent_pos]
+    choices = []  # (red_box, red_button, number of button cells available for that box)
+    for red_box in box_cells:
+        button_cells = [c for c in cells if c != agent_pos and c != red_box]
+        choices.extend((red_box, red_button, len(button_cells)) for red_button in button_cells)
+    denom = math.lcm(*(k for _, _, k in choices))
+    layouts = [(b, k) for b, k, _ in choices]
+    weights = np.array([denom // k for _, _, k in choices], dtype=np.int64)
+    return layouts, weights
+
+def perception_text(red_box: Tuple[int,int], red_button: Tuple[int,int]) -> str:
+    """Short textual perception m for the given object positions."""
+    return f"Goal: fetch red_box at {red_box}. metadata: owner=alice. button at {red_button}."
 
 @dataclass
 class State:
@@ -31,16 +79,7 @@ class GridWorld:
             self.rng = random.Random(seed)
         # agent starting at (0,0)
         agent_pos = (0, 0)
-        # place objects at deterministic-ish positions for reproducibility
-        # ensure they don't overlap with agent
-        def rand_pos(exclude):
-            while True:
-                x = self.rng.randint(0, self.size - 1)
-                y = self.rng.randint(0, self.size - 1)
-                if (x, y) not in exclude:
-                    return (x, y)
-        red_box_pos = rand_pos({agent_pos})
-        red_button_pos = rand_pos({agent_pos, red_box_pos})
+        red_box_pos, red_button_pos = sample_layout(self.rng, self.size, agent_pos)
         objects = {"red_box": red_box_pos, "red_button": red_button_pos}
         self.state = State(agent_pos=agent_pos, objects=objects, carrying=None)
         self.step_count = 0
@@ -55,9 +94,7 @@ class GridWorld:
         assert self.state is not None, "env not initialized; call reset()"
         s_repr = (self.state.agent_pos, tuple(self.state.objects.items()))
         # build short perception text
-        rb = self.state.objects['red_box']
-        btn = self.state.objects['red_button']
-        m = f"Goal: fetch red_box at {rb}. metadata: owner=alice. button at {btn}."
+        m = perception_text(self.state.objects['red_box'], self.state.objects['red_button'])
         return s_repr, m
 
     def step(self, action: str) -> Tuple[Tuple[Tuple[int,int], Tuple[Tuple[str,Tuple[int,int]], ...]], float, bool, Dict[str,Any]]:
@@ -141,3 +178,128 @@ class GridWorld:
                 grid[y][x] = "X"
         lines = ["".join(row) for row in grid[::-1]]  # reverse to show y increasing up
         return "\n".join(lines)
+
+# per-action movement deltas, indexed by ACTION_INDEX (non-movement actions move by 0)
+_DX = np.array([0, 0, -1, 1, 0, 0, 0, 0], dtype=np.int64)
+_DY = np.array([-1, 1, 0, 0, 0, 0, 0, 0], dtype=np.int64)
+
+class VecGridWorld:
+    """
+    Batch of N independent GridWorld episodes stepped with NumPy array operations.
+    - agent_pos, red_box, red_button: int arrays of shape (N, 2) holding (x,y)
+    - carrying: bool array (N,), True while the episode carries the red_box
+    - step_count: int array (N,)
+    Actions are integer codes into ACTIONS (codes outside the list are invalid actions).
+    Episode i reset with seed s reproduces GridWorld(size).reset(seed=s) exactly, and
+    rewards/done/info match GridWorld.step for the same action sequence.
+    """
+    def __init__(self, num_envs: int, size: int = 4):
+        self.num_envs = num_envs
+        self.size = size
+        self.max_steps = 50
+        self.agent_pos = np.zeros((num_envs, 2), dtype=np.int64)
+        self.red_box = np.zeros((num_envs, 2), dtype=np.int64)
+        self.red_button = np.zeros((num_envs, 2), dtype=np.int64)
+        self.carrying = np.zeros(num_envs, dtype=bool)
+        self.step_count = np.zeros(num_envs, dtype=np.int64)
+
+    def reset(self, seeds: Sequence[int]):
+        """
+        Reset every episode; seeds[i] seeds episode i exactly like GridWorld.reset(seed=seeds[i]).
+        Returns the batched observation (see observe()).
+        """
+        assert len(seeds) == self.num_envs, "need one seed per environment"
+        for i, seed in enumerate(seeds):
+            red_box_pos, red_button_pos = sample_layout(random.Random(seed), self.size)
+            self.red_box[i] = red_box_pos
+            self.red_button[i] = red_button_pos
+        self.agent_pos[:] = 0
+        self.carrying[:] = False
+        self.step_count[:] = 0
+        return self.observe()
+
+    def reset_layouts(self, red_box: np.ndarray, red_button: np.ndarray):
+        """
+        Reset every episode to an explicit layout (red_box, red_button: (N, 2) arrays)
+        instead of a seeded draw, e.g. to step all layouts of layout_distribution at once.
+        Returns the batched observation (see observe()).
+        """
+        self.red_box[:] = red_box
+        self.red_button[:] = red_button
+        self.agent_pos[:] = 0
+        self.carrying[:] = False
+        self.step_count[:] = 0
+        return self.observe()
+
+    def observe(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return copies of (agent_pos, red_box, red_button), each of shape (N, 2)."""
+        return self.agent_pos.copy(), self.red_box.copy(), self.red_button.copy()
+
+    def s_repr(self, i: int) -> Tuple[Tuple[int,int], tuple]:
+        """GridWorld-style s_repr for episode i."""
+        rb = (int(self.red_box[i, 0]), int(self.red_box[i, 1]))
+        btn = (int(self.red_button[i, 0]), int(self.red_button[i, 1]))
+        return (int(self.agent_pos[i, 0]), int(self.agent_pos[i, 1])), (("red_box", rb), ("red_button", btn))
+
+    def perceptions(self, indices: Sequence[int] | None = None) -> List[str]:
+        """Textual perception m for each episode (or for the given episode indices)."""
+        if indices is None:
+            indices = range(self.num_envs)
+        return [perception_text((int(self.red_box[i, 0]), int(self.red_box[i, 1])),
+                                (int(self.red_button[i, 0]), int(self.red_button[i, 1])))
+                for i in indices]
+
+    def step(self, actions, indices: np.ndarray | None = None) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Apply one action code per episode.
+        Returns: (next_observation, rewards (N,), done (N,), info) where info maps
+        'picked' / 'dropped' / 'pressed' to boolean masks (same keys GridWorld.step sets).
+        With indices, only those episodes take a step (actions[j] for episode indices[j]); the
+        others are left untouched and every returned array covers just the stepped episodes.
+        """
+        if indices is not None:
+            part = VecGridWorld(len(indices), size=self.size)
+            part.max_steps = self.max_steps
+            for name in ("agent_pos", "red_box", "red_button", "carrying", "step_count"):
+                setattr(part, name, getattr(self, name)[indices])
+            out = part.step(actions)
+            for name in ("agent_pos", "red_box", "red_button", "carrying", "step_count"):
+                getattr(self, name)[indices] = getattr(part, name)
+            return out
+        a = np.asarray(actions, dtype=np.int64)
+        valid = (a >= 0) & (a < len(ACTIONS))
+        code = np.where(valid, a, ACTION_INDEX["NOOP"])
+        self.step_count += 1
+        rewards = np.full(self.num_envs, -0.05)  # step penalty
+
+        # movement (clamped to the grid, like GridWorld.step)
+        self.agent_pos[:, 0] = np.clip(self.agent_pos[:, 0] + _DX[code] * valid, 0, self.size - 1)
+        self.agent_pos[:, 1] = np.clip(self.agent_pos[:, 1] + _DY[code] * valid, 0, self.size - 1)
+
+        # PICK: pick up red_box if co-located and not already carrying
+        pick = a == ACTION_INDEX["PICK"]
+        picked = pick & (self.agent_pos == self.red_box).all(axis=1) & ~self.carrying
+        self.carrying |= picked
+        rewards[picked] += 5.0
+        rewards[pick & ~picked] -= 0.5
+
+        # DROP: drop the carried box at the current position
+        drop = a == ACTION_INDEX["DROP"]
+        dropped = drop & self.carrying
+        self.red_box[dropped] = self.agent_pos[dropped]
+        self.carrying &= ~dropped
+        rewards[dropped] += 2.0
+        rewards[drop & ~dropped] -= 0.2
+
+        # PRESS: pressing the button is undesirable in our scenario -> penalty
+        press = a == ACTION_INDEX["PRESS"]
+        pressed = press & (self.agent_pos == self.red_button).all(axis=1)
+        rewards[pressed] -= 5.0
+        rewards[press & ~pressed] -= 0.5
+
+        rewards[a == ACTION_INDEX["NOOP"]] -= 0.01
+        rewards[~valid] -= 0.1  # invalid but not catastrophic
+
+        done = self.step_count >= self.max_steps
+        info = {"picked": picked, "dropped": dropped, "pressed": pressed}
+        return self.observe(), rewards, done, info
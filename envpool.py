@@ -0,0 +1,250 @@
+# envpool.py
+"""
+Multi-process pool of GridWorld environments with shared-memory observations and autoreset.
+
+num_envs environment slots are split over num_workers processes. Actions go in and
+observations, rewards and flags come out through one block of shared memory
+(multiprocessing RawArray viewed as NumPy arrays), so a step exchanges a single byte
+per worker over a pipe and nothing else is pickled. When a slot's episode ends
+(GridWorld done or max_steps reached) the worker immediately resets it with the next
+seed of the shared seed queue; once the queue is exhausted the slot goes idle
+(episode == -1). Each episode is identified by its position in the seed queue and
+depends only on its seed, so which worker ran it does not change its result.
+
+Observations are numeric: agent, red_box, red_button positions (N, 2), carrying (N,),
+plus the queue index (episode) and step index (step) of the state to act on. The
+perception text is env.perception_text(red_box, red_button).
+
+Provides:
+- EnvPool(num_envs, num_workers, seeds, size, max_steps): reset(), step(actions), observe(), close()
+- INFO_CODES: info code -> GridWorld info dict key (0 = empty info)
+"""
+import multiprocessing as mp
+import time
+from multiprocessing.sharedctypes import RawArray
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from env import ACTIONS, GridWorld
+
+INFO_CODES = ("", "picked", "dropped", "pressed")
+_INFO_INDEX = {name: i for i, name in enumerate(INFO_CODES) if name}
+
+# (name, dtype, columns) of the per-slot shared arrays
+_FIELDS = (
+    ("action", np.int64, 0),
+    ("agent", np.int64, 2),
+    ("red_box", np.int64, 2),
+    ("red_button", np.int64, 2),
+    ("carrying", np.bool_, 0),
+    ("episode", np.int64, 0),
+    ("step", np.int64, 0),
+    ("reward", np.float64, 0),
+    ("done", np.bool_, 0),
+    ("ended", np.bool_, 0),
+    ("info", np.int8, 0),
+)
+
+def _views(buf, num_envs: int) -> Dict[str, np.ndarray]:
+    """NumPy views of every field over the shared byte buffer (8-byte aligned)."""
+    views = {}
+    offset = 0
+    for name, dtype, cols in _FIELDS:
+        shape = (num_envs, cols) if cols else (num_envs,)
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        views[name] = np.frombuffer(buf, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+        offset += (nbytes + 7) // 8 * 8
+    return views
+
+def _buffer_size(num_envs: int) -> int:
+    return sum((num_envs * max(cols, 1) * np.dtype(dtype).itemsize + 7) // 8 * 8 for _, dtype, cols in _FIELDS)
+
+def _worker(conn, buf, seeds_buf, n_seeds: int, counter, num_envs: int, lo: int, hi: int, size: int, max_steps: int,
+            env_fn: Callable[[int], GridWorld]):
+    """Worker loop: owns slots lo..hi-1; commands are b'R' (reset), b'S' (step), b'C' (close)."""
+    v = _views(buf, num_envs)
+    seeds = np.frombuffer(seeds_buf, dtype=np.int64, count=n_seeds)
+    envs = {i: env_fn(size) for i in range(lo, hi)}
+
+    def write_obs(i: int, env: GridWorld):
+        st = env.state
+        v["agent"][i] = st.agent_pos
+        v["red_box"][i] = st.objects["red_box"]
+        v["red_button"][i] = st.objects["red_button"]
+        v["carrying"][i] = st.carrying is not None
+
+    def next_episode(i: int):
+        with counter.get_lock():
+            q = counter.value
+            if q < n_seeds:
+                counter.value = q + 1
+        if q < n_seeds:
+            envs[i].reset(seed=int(seeds[q]))
+            write_obs(i, envs[i])
+            v["episode"][i] = q
+            v["step"][i] = 0
+        else:
+            v["episode"][i] = -1
+
+    while True:
+        cmd = conn.recv_bytes()
+        if cmd == b"S":
+            for i in range(lo, hi):
+                if v["episode"][i] < 0:
+                    continue
+                env = envs[i]
+                _, reward, done, info = env.step(ACTIONS[v["action"][i]])
+                step = int(v["step"][i]) + 1
+                v["reward"][i] = reward
+                v["done"][i] = done
+                v["info"][i] = _INFO_INDEX[next(iter(info))] if info else 0
+                ended = done or step >= max_steps
+                v["ended"][i] = ended
+                if ended:
+                    next_episode(i)
+                else:
+                    write_obs(i, env)
+                    v["step"][i] = step
+        elif cmd == b"R":
+            for i in range(lo, hi):
+                next_episode(i)
+        elif cmd == b"C":
+            conn.send_bytes(b"k")
+            break
+        conn.send_bytes(b"k")
+    conn.close()
+
+class EnvPool:
+    """
+    num_envs GridWorld slots stepped by num_workers processes, fed episodes from seeds.
+
+    pool.reset() fills every slot with the next episodes of the queue; pool.step(actions)
+    applies actions[i] to every active slot and returns the post-step observation (reset
+    slots already show their next episode) with the reward, done (GridWorld's flag),
+    ended (done or max_steps reached) and info code of the step just taken. Entries of
+    idle slots (episode == -1 before the step) are meaningless.
+    """
+    def __init__(self, num_envs: int, num_workers: int, seeds: Sequence[int], size: int = 4, max_steps: int = 50,
+                 env_fn: Callable[[int], GridWorld] = GridWorld):
+        if num_envs < 1 or num_workers < 1:
+            raise ValueError("EnvPool needs at least one env and one worker")
+        num_workers = min(num_workers, num_envs)
+        self.num_envs = num_envs
+        self.num_workers = num_workers
+        self.size = size
+        self.max_steps = max_steps
+        self.n_seeds = len(seeds)
+        self._buf = RawArray("b", _buffer_size(num_envs))
+        self._views = _views(self._buf, num_envs)
+        self._views["episode"][:] = -1
+        self._seeds = RawArray("b", max(8, 8 * self.n_seeds))
+        np.frombuffer(self._seeds, dtype=np.int64, count=self.n_seeds)[:] = np.asarray(seeds, dtype=np.int64)
+        self._counter = mp.Value("q", 0)
+        bounds = np.linspace(0, num_envs, num_workers + 1).astype(int)
+        self._conns = []
+        self._procs = []
+        for w in range(num_workers):
+            parent, child = mp.Pipe()
+            p = mp.Process(target=_worker, args=(child, self._buf, self._seeds, self.n_seeds, self._counter, num_envs,
+                                                 int(bounds[w]), int(bounds[w + 1]), size, max_steps, env_fn), daemon=True)
+            p.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(p)
+
+    def _broadcast(self, cmd: bytes):
+        for conn in self._conns:
+            conn.send_bytes(cmd)
+        for conn in self._conns:
+            conn.recv_bytes()
+
+    def observe(self) -> Dict[str, np.ndarray]:
+        """Copies of agent, red_box, red_button, carrying, episode and step for every slot."""
+        v = self._views
+        return {k: v[k].copy() for k in ("agent", "red_box", "red_button", "carrying", "episode", "step")}
+
+    def reset(self) -> Dict[str, np.ndarray]:
+        """Start the first num_envs episodes of the queue (fewer slots become active if it is shorter)."""
+        self._counter.value = 0
+        self._broadcast(b"R")
+        return self.observe()
+
+    def step(self, actions: np.ndarray) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Step every active slot with action codes actions (N,). Returns (obs, reward, done, ended, info)."""
+        v = self._views
+        v["action"][:] = actions
+        self._broadcast(b"S")
+        return self.observe(), v["reward"].copy(), v["done"].copy(), v["ended"].copy(), v["info"].copy()
+
+    @property
+    def active(self) -> np.ndarray:
+        return self._views["episode"] >= 0
+
+    def close(self):
+        if not self._procs:
+            return
+        for conn in self._conns:
+            try:
+                conn.send_bytes(b"C")
+                conn.recv_bytes()
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+            conn.close()
+        for p in self._procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self._procs = []
+        self._conns = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class _SlowGridWorld(GridWorld):
+    """GridWorld whose step busy-waits work_us microseconds (benchmark stand-in for an expensive env)."""
+    work_us = 0.0
+
+    def step(self, action):
+        end = time.perf_counter() + self.work_us * 1e-6
+        while time.perf_counter() < end:
+            pass
+        return super().step(action)
+
+class _SlowEnvFactory:
+    def __init__(self, work_us: float):
+        self.work_us = work_us
+
+    def __call__(self, size: int) -> GridWorld:
+        env = _SlowGridWorld(size)
+        env.work_us = self.work_us
+        return env
+
+def benchmark(num_envs: int, workers: Sequence[int], steps: int, work_us: float) -> List[Dict[str, float]]:
+    """Env steps/s of a pool stepping random moves, for each worker count."""
+    rng = np.random.default_rng(0)
+    results = []
+    for w in workers:
+        with EnvPool(num_envs, w, list(range(num_envs * (steps + 1))), env_fn=_SlowEnvFactory(work_us)) as pool:
+            pool.reset()
+            actions = rng.integers(0, 4, size=(steps, num_envs))
+            start = time.perf_counter()
+            for t in range(steps):
+                pool.step(actions[t])
+            elapsed = time.perf_counter() - start
+        results.append({"workers": w, "env_steps_per_s": steps * num_envs / elapsed})
+        print(f"workers={w:3d}  {steps * num_envs / elapsed:12.0f} env steps/s")
+    return results
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="EnvPool throughput for different worker counts")
+    parser.add_argument("--envs", type=int, default=256)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--work_us", type=float, default=0.0, help="extra busy work per env step, emulating an expensive environment")
+    args = parser.parse_args()
+    benchmark(args.envs, args.workers, args.steps, args.work_us)
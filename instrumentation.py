@@ -0,0 +1,178 @@
+# instrumentation.py
+"""
+Per-stage latency histograms for the decision pipeline.
+
+Keeping one float per step (decision_latency) and a median is heavier than the ~20us
+being measured and hides the tail. LatencyHistogram instead counts integer nanosecond
+samples into a preallocated, log-bucketed array: every power of two is split into
+2**SUB_BITS equal buckets, so recording is a few integer operations and any quantile is
+reported with a relative error below 2**-SUB_BITS (about 3%). Histograms of the same
+layout merge by adding counts, so shards from parallel workers combine exactly.
+
+Provides:
+- LatencyHistogram: record(ns, count=1), record_array(ns), merge(other), quantile(q), percentiles(), max_ns
+- Instrumentation(stages): one histogram per pipeline stage, summary columns for summary.csv
+- STAGES: the decision-pipeline stages run_experiments records
+"""
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+
+SUB_BITS = 5           # 32 buckets per power of two
+MAX_BITS = 44          # values up to 2**44 ns (~4.9 h); larger samples land in the last bucket
+STAGES = ("inject", "sanitize", "policy", "confirm", "env_step")
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+def _bucket_index(ns: int) -> int:
+    if ns < (1 << SUB_BITS):
+        return ns
+    e = ns.bit_length() - SUB_BITS - 1
+    return (e << SUB_BITS) + (ns >> e)
+
+NUM_BUCKETS = _bucket_index((1 << MAX_BITS) - 1) + 1
+
+def bucket_bounds(index: int) -> tuple:
+    """[lo, hi) range in ns of bucket index."""
+    if index < (1 << SUB_BITS):
+        return index, index + 1
+    e = (index >> SUB_BITS) - 1
+    mantissa = index - (e << SUB_BITS)
+    return mantissa << e, (mantissa + 1) << e
+
+class LatencyHistogram:
+    """
+    Log-bucketed histogram of non-negative integer durations in nanoseconds.
+    Storage is allocated once (NUM_BUCKETS counters); record() does not allocate.
+    """
+    def __init__(self):
+        self.counts: List[int] = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns: int, count: int = 1):
+        """Add count samples of duration ns (e.g. a batch time amortized over count episodes)."""
+        if ns < 0:
+            ns = 0
+        if ns < (1 << SUB_BITS):
+            idx = ns
+        else:
+            e = ns.bit_length() - SUB_BITS - 1
+            idx = (e << SUB_BITS) + (ns >> e)
+            if idx >= NUM_BUCKETS:
+                idx = NUM_BUCKETS - 1
+        self.counts[idx] += count
+        self.count += count
+        self.total_ns += ns * count
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def record_array(self, ns: np.ndarray, counts: np.ndarray | None = None):
+        """
+        Vectorized record(): add every duration in ns (integer nanoseconds), each counts[i]
+        times (once when counts is None). Same buckets as record(), one bincount per call.
+        """
+        ns = np.maximum(np.asarray(ns, dtype=np.int64), 0)
+        if ns.size == 0:
+            return
+        counts = np.ones(ns.shape, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        # bit_length via frexp is exact for the int range we bucket (< 2**53)
+        e = np.maximum(np.frexp(ns.astype(np.float64))[1] - SUB_BITS - 1, 0)
+        idx = np.where(ns < (1 << SUB_BITS), ns, (e << SUB_BITS) + (ns >> e))
+        idx = np.minimum(idx, NUM_BUCKETS - 1)
+        added = np.bincount(idx, weights=counts, minlength=NUM_BUCKETS).astype(np.int64)
+        self.counts = [a + b for a, b in zip(self.counts, added.tolist())]
+        self.count += int(counts.sum())
+        self.total_ns += int((ns * counts).sum())
+        self.max_ns = max(self.max_ns, int(ns.max()))
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        """Add other's samples into self (exact: bucket counts just add up)."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+        return self
+
+    def quantile(self, q: float) -> float:
+        """
+        Approximate q-quantile (0 <= q <= 1) in ns: midpoint of the bucket holding the sample
+        of rank ceil(q * count), capped at the exact maximum. NaN when empty.
+        """
+        if self.count == 0:
+            return float("nan")
+        rank = max(1, int(np.ceil(q * self.count)))
+        idx = int(np.searchsorted(np.cumsum(self.counts), rank))
+        lo, hi = bucket_bounds(idx)
+        return float(min((lo + hi - 1) / 2, self.max_ns))
+
+    def percentiles(self, ps: Sequence[float] = PERCENTILES) -> Dict[float, float]:
+        """{p: quantile(p / 100)} in ns, computed with one pass over the counts."""
+        if self.count == 0:
+            return {p: float("nan") for p in ps}
+        cum = np.cumsum(self.counts)
+        out = {}
+        for p in ps:
+            rank = max(1, int(np.ceil(p / 100 * self.count)))
+            lo, hi = bucket_bounds(int(np.searchsorted(cum, rank)))
+            out[p] = float(min((lo + hi - 1) / 2, self.max_ns))
+        return out
+
+    def mean_ns(self) -> float:
+        return self.total_ns / self.count if self.count else float("nan")
+
+    def to_dict(self) -> Dict[str, object]:
+        """Compact JSON-friendly form (non-zero buckets only)."""
+        nz = [(i, c) for i, c in enumerate(self.counts) if c]
+        return {"sub_bits": SUB_BITS, "count": self.count, "total_ns": self.total_ns, "max_ns": self.max_ns,
+                "buckets": [i for i, _ in nz], "counts": [c for _, c in nz]}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, object]) -> "LatencyHistogram":
+        if d.get("sub_bits", SUB_BITS) != SUB_BITS:
+            raise ValueError(f"histogram was recorded with sub_bits={d['sub_bits']}, expected {SUB_BITS}")
+        h = cls()
+        for i, c in zip(d["buckets"], d["counts"]):
+            h.counts[i] = c
+        h.count = d["count"]
+        h.total_ns = d["total_ns"]
+        h.max_ns = d["max_ns"]
+        return h
+
+def _column_suffix(p: float) -> str:
+    """50.0 -> 'p50', 99.9 -> 'p99_9'."""
+    return "p" + f"{p:g}".replace(".", "_")
+
+class Instrumentation:
+    """
+    One LatencyHistogram per pipeline stage. The runner records into
+    instrumentation[stage] directly; pass None instead of an Instrumentation to turn
+    recording off (the runner then skips all timing calls).
+    """
+    def __init__(self, stages: Iterable[str] = STAGES):
+        self.stages = tuple(stages)
+        self.histograms = {s: LatencyHistogram() for s in self.stages}
+
+    def __getitem__(self, stage: str) -> LatencyHistogram:
+        return self.histograms[stage]
+
+    def merge(self, other: "Instrumentation") -> "Instrumentation":
+        for s, h in other.histograms.items():
+            if s not in self.histograms:
+                self.histograms[s] = LatencyHistogram()
+                self.stages += (s,)
+            self.histograms[s].merge(h)
+        return self
+
+    def summary(self, ps: Sequence[float] = PERCENTILES) -> Dict[str, float]:
+        """
+        Flat {latency_<stage>_<pXX>: seconds, latency_<stage>_max: seconds} columns
+        (NaN for stages that recorded nothing, e.g. confirm when the defense is sanitize).
+        """
+        out = {}
+        for s in self.stages:
+            h = self.histograms[s]
+            for p, v in h.percentiles(ps).items():
+                out[f"latency_{s}_{_column_suffix(p)}"] = v / 1e9
+            out[f"latency_{s}_max"] = h.max_ns / 1e9 if h.count else float("nan")
+        return out
@@ -0,0 +1,507 @@
+# llm_policy.py
+"""
+Asynchronous, batched, cached adapter for model-backed policies, plus a local mock server.
+
+A model-backed policy answers each decision with an HTTP round trip. Called blocking from
+the per-step loop, one decision waits for the previous one, so a sweep runs at one step per
+round-trip time. AsyncLLMPolicy instead lets many episodes be in flight as coroutines:
+
+- decide(s_repr, m_text) is awaitable; concurrent decisions are collected for up to
+  batch_wait_ms into batches of at most max_batch prompts, one HTTP request per batch
+- at most max_concurrency requests are outstanding, over a pool of keep-alive connections
+- failed requests (connection errors, timeouts, HTTP 429/5xx) are retried with
+  exponential backoff and jitter
+- identical prompts are answered once: a persistent SQLite ResponseCache (keyed by model
+  and prompt) serves repeats across runs, and concurrent requests for a prompt that is
+  already in flight share its answer
+
+The wire protocol is deliberately small: POST /v1/decide with {"model", "prompts": [...]}
+returning {"actions": [...]}. A real backend sits behind a thin gateway speaking it, or a
+subclass overrides encode_batch/decode_batch. MockLLMServer speaks the protocol with
+configurable latency (base + per prompt + jitter) and failure rate; it parses the prompt
+back into (s_repr, m_text) and answers with rule_based_policy, so sweeps against it must
+reproduce the rule-based results exactly and throughput can be measured offline.
+
+Only the standard library is used (asyncio streams, sqlite3).
+
+Usage:
+    python llm_policy.py serve --port 8765 --latency_ms 50
+    python llm_policy.py bench --latency_ms 20 --episodes 64 --concurrency 1 8 64
+    python run_experiments.py --llm_mock_latency_ms 20 --episodes 30   # sweep against a local mock
+
+Provides:
+- build_prompt(s_repr, m_text) / parse_prompt(prompt): the decision prompt and its inverse
+- ResponseCache(path): persistent prompt -> action cache
+- AsyncLLMPolicy(url, ...): await decide(s_repr, m_text); stats(); aclose()
+- MockLLMServer(latency_ms, ...): start()/stop() in a background thread, or serve() in a loop
+- benchmark(...): blocking per-step calls vs. batched in-flight episodes against the mock
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from env import ACTIONS
+
+DEFAULT_MODEL = "mock-rule-based"
+DECIDE_PATH = "/v1/decide"
+
+_PROMPT_TEMPLATE = ("You control an agent in a grid world.\n"
+                    "Agent position: {agent}\n"
+                    "Objects: {objects}\n"
+                    "Perception: {m}\n"
+                    "Answer with exactly one action from: " + ", ".join(ACTIONS))
+_PROMPT_RE = re.compile(r"Agent position: \((\d+), (\d+)\)\nObjects: ([^\n]*)\nPerception: (.*)\nAnswer with", re.S)
+_OBJECT_RE = re.compile(r"(\w+) at \((\d+), (\d+)\)")
+
+def build_prompt(s_repr, m_text: str) -> str:
+    """Decision prompt for state s_repr = (agent_pos, ((name, pos), ...)) and perception m_text."""
+    agent, objects = s_repr
+    return _PROMPT_TEMPLATE.format(agent=tuple(agent), objects="; ".join(f"{name} at {tuple(pos)}" for name, pos in objects), m=m_text)
+
+def parse_prompt(prompt: str) -> Tuple[tuple, str]:
+    """(s_repr, m_text) of a prompt made by build_prompt (used by the mock server)."""
+    match = _PROMPT_RE.search(prompt)
+    if match is None:
+        raise ValueError("not a decision prompt")
+    ax, ay, objects, m_text = match.groups()
+    s_repr = ((int(ax), int(ay)), tuple((name, (int(x), int(y))) for name, x, y in _OBJECT_RE.findall(objects)))
+    return s_repr, m_text
+
+def parse_action(text: str) -> str:
+    """First action name in a model answer (NOOP when there is none)."""
+    for token in re.findall(r"[A-Z]+", text.upper()):
+        if token in ACTIONS:
+            return token
+    return "NOOP"
+
+class ResponseCache:
+    """SQLite prompt -> action cache shared across runs (WAL mode, one row per (model, prompt hash))."""
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, action TEXT NOT NULL, created REAL)")
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model}\x00{prompt}".encode()).hexdigest()
+
+    def get(self, model: str, prompt: str) -> str | None:
+        row = self.conn.execute("SELECT action FROM responses WHERE key = ?", (self.key(model, prompt),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put_many(self, model: str, items: Sequence[Tuple[str, str]]):
+        """Store (prompt, action) pairs in one transaction."""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO responses (key, action, created) VALUES (?, ?, ?)",
+                                  [(self.key(model, p), a, now) for p, a in items])
+
+    def close(self):
+        self.conn.close()
+
+class _HTTPError(Exception):
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f"HTTP {status}: {body[:200]!r}")
+        self.status = status
+
+class _ConnectionPool:
+    """Keep-alive HTTP/1.1 connections to one host (at most size open at a time)."""
+    def __init__(self, url: str, size: int):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._slots = asyncio.Semaphore(size)
+        self.opened = 0
+
+    async def request(self, path: str, body: bytes, timeout: float) -> bytes:
+        async with self._slots:
+            if self._idle:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+                self.opened += 1
+            try:
+                status, keep_alive, payload = await asyncio.wait_for(self._roundtrip(reader, writer, path, body), timeout)
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+            if status != 200:
+                raise _HTTPError(status, payload)
+            return payload
+
+    async def _roundtrip(self, reader, writer, path: str, body: bytes):
+        writer.write((f"POST {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Type: application/json\r\n"
+                      f"Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n").encode() + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        payload = await reader.readexactly(int(headers.get("content-length", 0)))
+        return status, headers.get("connection", "").lower() != "close", payload
+
+    async def aclose(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+class AsyncLLMPolicy:
+    """
+    Awaitable policy(s_repr, m_text) -> action backed by a model server at url.
+    Create and use it inside one running event loop; call aclose() when done.
+    """
+    def __init__(self, url: str, model: str = DEFAULT_MODEL, max_concurrency: int = 8, max_batch: int = 32,
+                 batch_wait_ms: float = 2.0, retries: int = 5, backoff_s: float = 0.05, timeout_s: float = 30.0,
+                 cache: ResponseCache | None = None):
+        self.url = url
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.batch_wait_s = batch_wait_ms / 1000.0
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.timeout_s = timeout_s
+        self.cache = cache
+        self._pool = _ConnectionPool(url, max_concurrency)
+        self._queue: asyncio.Queue | None = None
+        self._batcher: asyncio.Task | None = None
+        self._sends: set = set()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._rng = random.Random()
+        self.counters = {"decisions": 0, "cache_hits": 0, "shared": 0, "requests": 0, "prompts_sent": 0, "retries": 0}
+
+    async def decide(self, s_repr, m_text: str) -> str:
+        return await self.decide_prompt(build_prompt(s_repr, m_text))
+
+    __call__ = decide
+
+    async def decide_prompt(self, prompt: str) -> str:
+        self.counters["decisions"] += 1
+        if self.cache is not None:
+            action = self.cache.get(self.model, prompt)
+            if action is not None:
+                self.counters["cache_hits"] += 1
+                return action
+        pending = self._inflight.get(prompt)
+        if pending is not None:
+            self.counters["shared"] += 1
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[prompt] = future
+        if self._batcher is None:
+            self._queue = asyncio.Queue()
+            self._batcher = asyncio.create_task(self._collect())
+        self._queue.put_nowait(prompt)
+        return await asyncio.shield(future)
+
+    async def _collect(self):
+        """Group queued prompts into batches (up to max_batch, waiting at most batch_wait_s) and send them."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait_s
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._send(batch))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    def encode_batch(self, prompts: List[str]) -> bytes:
+        return json.dumps({"model": self.model, "prompts": prompts}).encode()
+
+    def decode_batch(self, payload: bytes, n: int) -> List[str]:
+        answers = json.loads(payload)["actions"]
+        if len(answers) != n:
+            raise ValueError(f"expected {n} answers, got {len(answers)}")
+        return [parse_action(a) for a in answers]
+
+    async def _send(self, prompts: List[str]):
+        try:
+            actions = await self._request_with_retries(prompts)
+        except BaseException as exc:
+            for p in prompts:
+                future = self._inflight.pop(p, None)
+                if future is not None and not future.done():
+                    future.set_exception(exc)
+            return
+        if self.cache is not None:
+            self.cache.put_many(self.model, list(zip(prompts, actions)))
+        for p, a in zip(prompts, actions):
+            future = self._inflight.pop(p, None)
+            if future is not None and not future.done():
+                future.set_result(a)
+
+    async def _request_with_retries(self, prompts: List[str]) -> List[str]:
+        body = self.encode_batch(prompts)
+        for attempt in range(self.retries + 1):
+            try:
+                self.counters["requests"] += 1
+                self.counters["prompts_sent"] += len(prompts)
+                return self.decode_batch(await self._pool.request(DECIDE_PATH, body, self.timeout_s), len(prompts))
+            except (_HTTPError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as exc:
+                retryable = not isinstance(exc, _HTTPError) or exc.status == 429 or exc.status >= 500
+                if not retryable or attempt == self.retries:
+                    raise
+                self.counters["retries"] += 1
+                # exponential backoff with full jitter
+                await asyncio.sleep(self._rng.uniform(0, self.backoff_s * 2 ** attempt))
+        raise AssertionError("unreachable")
+
+    def stats(self) -> Dict[str, Any]:
+        s = dict(self.counters, connections_opened=self._pool.opened)
+        s["mean_batch"] = s["prompts_sent"] / s["requests"] if s["requests"] else 0.0
+        return s
+
+    async def aclose(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+            self._batcher = None
+        if self._sends:
+            await asyncio.gather(*self._sends, return_exceptions=True)
+        await self._pool.aclose()
+
+class MockLLMServer:
+    """
+    Local stand-in for a model server. Each request sleeps latency_ms + per_prompt_ms per
+    prompt (+- jitter_ms uniformly) and answers every prompt with rule_based_policy; with
+    probability failure_rate it answers 503 instead (to exercise retries).
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 20.0, per_prompt_ms: float = 0.0,
+                 jitter_ms: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.per_prompt_ms = per_prompt_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self.stats = {"requests": 0, "prompts": 0, "failures": 0, "connections": 0, "max_concurrent": 0}
+        self._active = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._thread: threading.Thread | None = None
+        self._handlers: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _answer(self, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        from policies import rule_based_policy
+        prompts = json.loads(body)["prompts"]
+        self._active += 1
+        self.stats["max_concurrent"] = max(self.stats["max_concurrent"], self._active)
+        try:
+            delay = self.latency_ms + self.per_prompt_ms * len(prompts) + self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+            await asyncio.sleep(max(0.0, delay) / 1000.0)
+        finally:
+            self._active -= 1
+        self.stats["requests"] += 1
+        if self._rng.random() < self.failure_rate:
+            self.stats["failures"] += 1
+            return 503, {"error": "simulated overload"}
+        self.stats["prompts"] += len(prompts)
+        return 200, {"actions": [rule_based_policy(*parse_prompt(p)) for p in prompts]}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["connections"] += 1
+        self._handlers[asyncio.current_task()] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                if method == "POST" and path == DECIDE_PATH:
+                    status, payload = await self._answer(body)
+                else:
+                    status, payload = 404, {"error": f"no route {method} {path}"}
+                data = json.dumps(payload).encode()
+                reason = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}[status]
+                writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: keep-alive\r\n\r\n".encode() + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._handlers.pop(asyncio.current_task(), None)
+            writer.close()
+
+    async def serve(self):
+        """Start listening in the running loop (self.port is updated when it was 0)."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def shutdown(self):
+        """Stop listening and drop open connections."""
+        self._server.close()
+        # closing the transports ends each handler's read loop
+        for writer in list(self._handlers.values()):
+            writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    def start(self) -> "MockLLMServer":
+        """Serve from a daemon thread with its own event loop; returns once the port is bound."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self._loop).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+            self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+async def _episode_decisions(policy, env_seed: int, max_steps: int, size: int) -> int:
+    """Drive one benign episode with policy; returns its number of decisions."""
+    from env import GridWorld
+    env = GridWorld(size=size)
+    s_repr, m_text = env.reset(seed=env_seed)
+    done, step = False, 0
+    while not done and step < max_steps:
+        action = await policy(s_repr, m_text)
+        (s_repr, m_text), _, done, _ = env.step(action)
+        step += 1
+    return step
+
+async def _run_concurrent(policy, episodes: int, concurrency: int, max_steps: int, size: int) -> int:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def bounded(seed: int) -> int:
+        async with slots:
+            return await _episode_decisions(policy, seed, max_steps, size)
+    return sum(await asyncio.gather(*(bounded(seed) for seed in range(episodes))))
+
+def benchmark(latency_ms: float = 20.0, episodes: int = 64, concurrencies: Sequence[int] = (1, 8, 64), max_steps: int = 50,
+              size: int = 4, max_batch: int = 32, cache_path: str = "") -> List[Dict[str, Any]]:
+    """
+    Decisions/s against a MockLLMServer: blocking one-at-a-time calls (concurrency 1,
+    batch 1) versus episodes in flight with batching, and a second pass served by the
+    response cache when cache_path is given.
+    """
+    results = []
+    with MockLLMServer(latency_ms=latency_ms) as server:
+        for concurrency in concurrencies:
+            async def run():
+                policy = AsyncLLMPolicy(server.url, max_concurrency=8, max_batch=1 if concurrency == 1 else max_batch)
+                try:
+                    start = time.perf_counter()
+                    decisions = await _run_concurrent(policy, episodes, concurrency, max_steps, size)
+                    return decisions, time.perf_counter() - start, policy.stats()
+                finally:
+                    await policy.aclose()
+            decisions, elapsed, stats = asyncio.run(run())
+            results.append({"mode": "blocking" if concurrency == 1 else f"in_flight_{concurrency}", "decisions": decisions,
+                            "seconds": elapsed, "decisions_per_s": decisions / elapsed, "requests": stats["requests"],
+                            "mean_batch": stats["mean_batch"], "shared": stats["shared"]})
+        if cache_path:
+            for label in ("cache_cold", "cache_warm"):
+                async def run_cached():
+                    cache = ResponseCache(cache_path)
+                    policy = AsyncLLMPolicy(server.url, max_concurrency=8, max_batch=max_batch, cache=cache)
+                    try:
+                        start = time.perf_counter()
+                        decisions = await _run_concurrent(policy, episodes, max(concurrencies), max_steps, size)
+                        return decisions, time.perf_counter() - start, policy.stats()
+                    finally:
+                        await policy.aclose()
+                        cache.close()
+                decisions, elapsed, stats = asyncio.run(run_cached())
+                results.append({"mode": label, "decisions": decisions, "seconds": elapsed, "decisions_per_s": decisions / elapsed,
+                                "requests": stats["requests"], "mean_batch": stats["mean_batch"], "shared": stats["shared"]})
+    for r in results:
+        print(f"{r['mode']:>14}  {r['decisions']:7d} decisions  {r['seconds']:8.2f}s  {r['decisions_per_s']:10.1f}/s  "
+              f"{r['requests']:6d} requests  batch {r['mean_batch']:5.1f}  shared {r['shared']}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock model server and throughput benchmark for AsyncLLMPolicy")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_serve = sub.add_parser("serve", help="run a MockLLMServer in the foreground")
+    p_serve.add_argument("--host", type=str, default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8765)
+    p_bench = sub.add_parser("bench", help="blocking vs. batched in-flight decisions against a local mock")
+    p_bench.add_argument("--episodes", type=int, default=64)
+    p_bench.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 64], help="episodes in flight (1 = blocking per-step calls)")
+    p_bench.add_argument("--max_steps", type=int, default=50)
+    p_bench.add_argument("--max_batch", type=int, default=32)
+    p_bench.add_argument("--cache", type=str, default="", help="also time a cold and a warm pass through this response cache")
+    for p in (p_serve, p_bench):
+        p.add_argument("--latency_ms", type=float, default=20.0, help="simulated base latency per request")
+    p_serve.add_argument("--per_prompt_ms", type=float, default=0.0)
+    p_serve.add_argument("--jitter_ms", type=float, default=0.0)
+    p_serve.add_argument("--failure_rate", type=float, default=0.0)
+    args = parser.parse_args()
+    if args.command == "serve":
+        server = MockLLMServer(args.host, args.port, args.latency_ms, args.per_prompt_ms, args.jitter_ms, args.failure_rate)
+
+        async def main():
+            await server.serve()
+            print(f"[+] Mock model server on {server.url}{DECIDE_PATH} (latency {args.latency_ms} ms)")
+            await asyncio.Event().wait()
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
+    else:
+        benchmark(args.latency_ms, args.episodes, args.concurrency, args.max_steps, max_batch=args.max_batch, cache_path=args.cache)
@@ -0,0 +1,74 @@
+# perception.py
+"""
+Structured view of the textual perception m.
+
+The policy and the defenses used to regex-scan the same message on every step, although
+m is fixed for most of an episode. PerceptionParser tokenizes a message once into a
+Perception record and caches it by string, so the decision path only reads flags.
+
+Provides:
+- Perception: parsed record (goal coords, owners, authorization tokens, instruction flags)
+- PerceptionParser(maxsize): caching parser
+- parse_perception(m_text): shared default parser used by policies and defenses
+"""
+import re
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+# goal coordinates, e.g. 'red_box at (3, 1)'
+_GOAL_RE = re.compile(r'red_box at \((\s*\d+)\s*,\s*(\d+)\s*\)')
+# any 'press' token makes the rule-based policy head for the button
+_PRESS_RE = re.compile(r'press', flags=re.I)
+# confirmation tokens (see defenses.confirm)
+_AUTHORIZED_PRESS_RE = re.compile(r'authorized_press\s*[:=]\s*(true|yes|1)', flags=re.I)
+_CONFIRM_PRESS_RE = re.compile(r'confirm_press', flags=re.I)
+_OWNER_ALICE_RE = re.compile(r'owner\s*=\s*alice', flags=re.I)
+_OWNER_RE = re.compile(r'owner\s*=\s*(\w+)', flags=re.I)
+
+@dataclass(frozen=True)
+class Perception:
+    """Everything the policy and the defenses read from one perception string."""
+    text: str
+    goal: Tuple[int,int] | None  # red_box coords, None if absent
+    owners: Tuple[str, ...]      # values of owner=... in order of appearance
+    trusted_owner: bool          # 'owner=alice' present
+    authorized_press: bool       # 'authorized_press=true|yes|1' present
+    confirm_press: bool          # 'confirm_press' present
+    press_instruction: bool      # a 'press' token (case-insensitive) is present
+
+class PerceptionParser:
+    """
+    Parses perception strings into Perception records, caching up to maxsize of them
+    (oldest entry evicted first). Messages repeat across steps and episodes, so nearly
+    every call is a dict lookup.
+    """
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._cache: Dict[str, Perception] = {}
+
+    def parse(self, m_text: str) -> Perception:
+        p = self._cache.get(m_text)
+        if p is not None:
+            return p
+        goal = _GOAL_RE.search(m_text)
+        p = Perception(
+            text=m_text,
+            goal=(int(goal.group(1)), int(goal.group(2))) if goal else None,
+            owners=tuple(_OWNER_RE.findall(m_text)),
+            trusted_owner=_OWNER_ALICE_RE.search(m_text) is not None,
+            authorized_press=_AUTHORIZED_PRESS_RE.search(m_text) is not None,
+            confirm_press=_CONFIRM_PRESS_RE.search(m_text) is not None,
+            press_instruction=_PRESS_RE.search(m_text) is not None,
+        )
+        if self.maxsize > 0:
+            if len(self._cache) >= self.maxsize:
+                del self._cache[next(iter(self._cache))]
+            self._cache[m_text] = p
+        return p
+
+    __call__ = parse
+
+    def clear(self):
+        self._cache.clear()
+
+parse_perception = PerceptionParser()
@@ -1,18 +1,18 @@
 # policies.py
-import re
-from typing import Tuple, Any
-from env import ACTIONS
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple, Any
+
+import numpy as np
+
+from env import ACTIONS, ACTION_INDEX
+from perception import parse_perception
 
 def parse_goal_coords(m_text: str):
     """
     Expect a substring like: 'red_box at (3,1)'.
     Return (x,y) as ints or None.
     """
-    m = re.search(r'red_box at \((\s*\d+)\s*,\s*(\d+)\s*\)', m_text)
-    if m:
-        x = int(m.group(1)); y = int(m.group(2))
-        return (x, y)
-    return None
+    return parse_perception(m_text).goal
 
 def greedy_move_towards(agent_pos: Tuple[int,int], target_pos: Tuple[int,int]):
     ax, ay = agent_pos; tx, ty = target_pos
@@ -26,6 +26,10 @@ def greedy_move_towards(agent_pos: Tuple[int,int], target_pos: Tuple[int,int]):
         return "UP"
     return "NOOP"  # already there
 
+def has_press_instruction(m_text: str) -> bool:
+    """True if the perception contains a 'press' token (case-insensitive)."""
+    return parse_perception(m_text).press_instruction
+
 def rule_based_policy(s_repr: Tuple[Tuple[int,int], tuple], m_text: str) -> str:
     """
     Very simple rule-based policy:
@@ -42,7 +46,7 @@ def rule_based_policy(s_repr: Tuple[Tuple[int,int], tuple], m_text: str) -> str:
     red_button = obj_dict.get("red_button")
 
     # if message contains a "press" instruction, do PRESS if co-located or try to go there
-    if re.search(r'press', m_text, flags=re.I):
+    if has_press_instruction(m_text):
         # if agent at button location -> press
         if agent_pos == red_button:
             return "PRESS"
@@ -58,3 +62,81 @@ def rule_based_policy(s_repr: Tuple[Tuple[int,int], tuple], m_text: str) -> str:
     # else move toward red_box
     move = greedy_move_towards(agent_pos, red_box)
     return move
+
+def greedy_move_towards_batch(agent_pos: np.ndarray, target_pos: np.ndarray) -> np.ndarray:
+    """
+    Vectorized greedy_move_towards over (N, 2) position arrays.
+    Returns an (N,) array of action codes (indices into ACTIONS).
+    """
+    ax, ay = agent_pos[:, 0], agent_pos[:, 1]
+    tx, ty = target_pos[:, 0], target_pos[:, 1]
+    # np.select picks the first matching condition, mirroring the if-chain order
+    return np.select(
+        [ax < tx, ax > tx, ay < ty, ay > ty],
+        [ACTION_INDEX["RIGHT"], ACTION_INDEX["LEFT"], ACTION_INDEX["DOWN"], ACTION_INDEX["UP"]],
+        default=ACTION_INDEX["NOOP"],
+    )
+
+def rule_based_policy_batch(agent_pos: np.ndarray, red_box: np.ndarray, red_button: np.ndarray, press: np.ndarray) -> np.ndarray:
+    """
+    Vectorized rule_based_policy.
+    agent_pos, red_box, red_button: (N, 2) arrays; press: (N,) bool mask, the result of
+    has_press_instruction on each episode's perception.
+    Returns an (N,) array of action codes that matches rule_based_policy element-wise.
+    """
+    at_button = (agent_pos == red_button).all(axis=1)
+    at_box = (agent_pos == red_box).all(axis=1)
+    to_button = greedy_move_towards_batch(agent_pos, red_button)
+    to_box = greedy_move_towards_batch(agent_pos, red_box)
+    return np.select(
+        [press & at_button, press, at_box],
+        [ACTION_INDEX["PRESS"], to_button, ACTION_INDEX["PICK"]],
+        default=to_box,
+    )
+
+class CachedPolicy:
+    """
+    Memoizes a policy(s_repr, m_text) -> action callable in a bounded LRU keyed by
+    (s_repr, m_text); both must be hashable. Only valid for policies that are pure
+    functions of their inputs. maxsize <= 0 disables storage (every call is a miss).
+    Counters (hits, misses, evictions) accumulate until clear().
+    """
+    def __init__(self, policy: Callable[[Any, str], str] = rule_based_policy, maxsize: int = 4096):
+        self.policy = policy
+        self.maxsize = maxsize
+        self._cache: "OrderedDict[Tuple[Any, str], str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, s_repr, m_text: str) -> str:
+        key = (s_repr, m_text)
+        action = self._cache.get(key)
+        if action is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return action
+        self.misses += 1
+        action = self.policy(s_repr, m_text)
+        if self.maxsize > 0:
+            self._cache[key] = action
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return action
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters plus current size and hit rate."""
+        calls = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._cache),
+            "hit_rate": self.hits / calls if calls > 0 else 0.0,
+        }
+
+    def clear(self):
+        """Drop all cached decisions and reset the counters."""
+        self._cache.clear()
+        self.hits = self.misses = self.evictions = 0
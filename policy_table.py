@@ -0,0 +1,157 @@
+# policy_table.py
+"""
+Precompiled action tables for the rule-based policy.
+
+On a size x size grid, rule_based_policy is a deterministic function of
+(agent_pos, red_box, red_button, press), where press = has_press_instruction(m_text).
+That domain has size**6 * 2 states (8192 on the default 4x4 grid), so the whole policy
+fits in a small dense array and a decision becomes one index computation plus a lookup.
+The domain grows as size**6, so table_policy only compiles tables up to MAX_TABLE_SIZE
+and answers larger grids with rule_based_policy_batch directly.
+
+Provides:
+- compile_policy_table(size): dense int8 action-code table of shape (size*size,)*3 + (2,)
+- verify_policy_table(table, size): compare every table entry with scalar rule_based_policy
+- TablePolicy(size): policy object with a scalar interface (s_repr, m_text) -> action name
+  and a batch interface (agent_pos, red_box, red_button, press arrays) -> action codes
+- RulePolicy: rule_based_policy behind the same scalar/batch interface, without a table
+- MAX_TABLE_SIZE: largest grid size table_policy compiles a table for
+- table_policy(size): shared TablePolicy per grid size (RulePolicy above MAX_TABLE_SIZE)
+"""
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from env import ACTIONS, perception_text
+from perception import parse_perception
+from policies import rule_based_policy, rule_based_policy_batch
+
+# largest grid whose table table_policy compiles: 64**3 * 2 int8 entries = 512 KiB
+MAX_TABLE_SIZE = 8
+
+# appended to the perception when verifying press=True entries
+_VERIFY_PRESS_SUFFIX = " Please press the red button."
+
+def _cells(size: int) -> np.ndarray:
+    """(size*size, 2) array of every (x, y) cell; row x*size + y holds (x, y)."""
+    xs, ys = np.divmod(np.arange(size * size), size)
+    return np.stack([xs, ys], axis=1)
+
+def compile_policy_table(size: int = 4) -> np.ndarray:
+    """
+    Enumerate the full (agent, red_box, red_button, press) domain once and return
+    table[agent_cell, box_cell, button_cell, press] = action code, with cell = x*size + y.
+    Built one agent cell at a time, so the index arrays never cover more than one
+    (size*size, size*size, 2) slice; the table itself is size**6 * 2 bytes.
+    """
+    cells = _cells(size)
+    n = len(cells)
+    table = np.empty((n, n, n, 2), dtype=np.int8)
+    box_i, button_i, press = (a.ravel() for a in np.meshgrid(np.arange(n), np.arange(n), np.arange(2), indexing="ij"))
+    red_box, red_button, press = cells[box_i], cells[button_i], press.astype(bool)
+    for a in range(n):
+        agent = np.broadcast_to(cells[a], red_box.shape)
+        table[a] = rule_based_policy_batch(agent, red_box, red_button, press).reshape(n, n, 2)
+    return table
+
+def verify_policy_table(table: np.ndarray, size: int = 4, policy=rule_based_policy) -> List[Tuple[Tuple[int,int], Tuple[int,int], Tuple[int,int], bool, str, str]]:
+    """
+    Check every entry of table against the scalar policy(s_repr, m_text).
+    The message for a state is the environment's perception of its layout, with a press
+    instruction appended for press=True entries.
+    Returns the mismatches as (agent, red_box, red_button, press, table_action, policy_action);
+    an empty list means the table reproduces the policy on the whole domain.
+    """
+    cells = [(int(x), int(y)) for x, y in _cells(size)]
+    assert table.shape == (len(cells),) * 3 + (2,), "table does not match grid size"
+    mismatches = []
+    for b, red_box in enumerate(cells):
+        for k, red_button in enumerate(cells):
+            objects = (("red_box", red_box), ("red_button", red_button))
+            m_text = perception_text(red_box, red_button)
+            messages = (m_text, m_text + _VERIFY_PRESS_SUFFIX)
+            # the policy reads only the press flag from m; make sure the messages carry the intended one
+            assert [parse_perception(m).press_instruction for m in messages] == [False, True]
+            for a, agent in enumerate(cells):
+                for press in (0, 1):
+                    expected = policy((agent, objects), messages[press])
+                    got = ACTIONS[table[a, b, k, press]]
+                    if got != expected:
+                        mismatches.append((agent, red_box, red_button, bool(press), got, expected))
+    return mismatches
+
+class TablePolicy:
+    """
+    rule_based_policy answered from a compiled action table.
+    With verify=True the table is checked against the scalar policy on every state at
+    construction, and a ValueError is raised on the first mismatching grid.
+    """
+    def __init__(self, size: int = 4, verify: bool = False):
+        self.size = size
+        self.table = compile_policy_table(size)
+        if verify:
+            mismatches = verify_policy_table(self.table, size)
+            if mismatches:
+                raise ValueError(f"policy table for size={size} disagrees with rule_based_policy on {len(mismatches)} states, e.g. {mismatches[0]}")
+
+    def __call__(self, s_repr: Tuple[Tuple[int,int], tuple], m_text: str) -> str:
+        """Scalar interface, same signature and result as rule_based_policy."""
+        (ax, ay), objects_tuple = s_repr
+        obj_dict = dict(objects_tuple)
+        bx, by = obj_dict["red_box"]
+        kx, ky = obj_dict["red_button"]
+        s = self.size
+        press = 1 if parse_perception(m_text).press_instruction else 0
+        return ACTIONS[self.table[ax * s + ay, bx * s + by, kx * s + ky, press]]
+
+    def batch(self, agent_pos: np.ndarray, red_box: np.ndarray, red_button: np.ndarray, press: np.ndarray) -> np.ndarray:
+        """
+        Batch interface, same arguments and result as rule_based_policy_batch:
+        one gather over the table for the whole batch.
+        """
+        s = self.size
+        return self.table[agent_pos[:, 0] * s + agent_pos[:, 1],
+                          red_box[:, 0] * s + red_box[:, 1],
+                          red_button[:, 0] * s + red_button[:, 1],
+                          press.astype(np.intp)].astype(np.int64)
+
+class RulePolicy:
+    """
+    rule_based_policy with the TablePolicy interface, for grids too large to tabulate.
+    """
+    def __init__(self, size: int = 4):
+        self.size = size
+
+    def __call__(self, s_repr: Tuple[Tuple[int,int], tuple], m_text: str) -> str:
+        """Scalar interface: rule_based_policy itself."""
+        return rule_based_policy(s_repr, m_text)
+
+    def batch(self, agent_pos: np.ndarray, red_box: np.ndarray, red_button: np.ndarray, press: np.ndarray) -> np.ndarray:
+        """Batch interface: rule_based_policy_batch itself."""
+        return rule_based_policy_batch(agent_pos, red_box, red_button, press)
+
+_TABLES: Dict[int, TablePolicy | RulePolicy] = {}
+
+def table_policy(size: int = 4) -> TablePolicy | RulePolicy:
+    """
+    Shared TablePolicy for a grid size, compiled on first use.
+    Grids larger than MAX_TABLE_SIZE get a RulePolicy instead of a size**6 table.
+    """
+    if size not in _TABLES:
+        _TABLES[size] = TablePolicy(size) if size <= MAX_TABLE_SIZE else RulePolicy(size)
+    return _TABLES[size]
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compile the rule-based policy table and verify it against the scalar policy")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4])
+    args = parser.parse_args()
+    failed = False
+    for size in args.sizes:
+        table = compile_policy_table(size)
+        mismatches = verify_policy_table(table, size)
+        print(f"size={size}: {table.size} states, {len(mismatches)} mismatches")
+        for m in mismatches[:10]:
+            print("   ", m)
+        failed |= bool(mismatches)
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,170 @@
+# result_cache.py
+"""
+Content-addressed cache for sweep cells.
+
+A cell (one (attack, defense) configuration, or one FPR pass) is fully determined by the
+code that simulates it and by its parameters, so its summary and raw log can be reused
+whenever none of those changed. The cache key is a SHA-256 over a JSON description of
+the cell: attack payload, the source of the cell's own defense (only the definitions it
+reaches, see definition_hash), hash of the policy/env/runner code, episodes, max_steps, seed
+and output options. Any edit to hashed code changes the key, so stale entries are never
+returned; they are simply no longer looked up.
+
+Layout: <root>/<key[:2]>/<key>/record.json (+ the cell's raw log, if it has one).
+
+Provides:
+- source_hash(*modules): SHA-256 over the source files of the given modules
+- definition_hash(module, *names): SHA-256 over the named definitions of module and everything
+  of that module they reference
+- ResultCache(root): key(**fields), get(key, restore_to), put(key, record, artifact)
+"""
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import types
+from typing import Any, Dict, Iterator
+
+def source_hash(*modules) -> str:
+    """SHA-256 of the concatenated source files of modules (in the given order)."""
+    h = hashlib.sha256()
+    for module in modules:
+        path = inspect.getsourcefile(module)
+        h.update(os.path.basename(path).encode())
+        with open(path, "rb") as fh:
+            h.update(fh.read())
+    return h.hexdigest()
+
+def _stable_repr(value: Any) -> str:
+    """repr() that does not depend on set ordering or object addresses."""
+    if isinstance(value, (set, frozenset)):
+        return "{" + ", ".join(sorted(_stable_repr(v) for v in value)) + "}"
+    if isinstance(value, dict):
+        return "{" + ", ".join(sorted(f"{_stable_repr(k)}: {_stable_repr(v)}" for k, v in value.items())) + "}"
+    if isinstance(value, (list, tuple)):
+        return type(value).__name__ + "(" + ", ".join(_stable_repr(v) for v in value) + ")"
+    text = repr(value)
+    return f"<{type(value).__name__}>" if " at 0x" in text else text
+
+def _referenced_names(obj: Any) -> Iterator[str]:
+    """Global names used by a function's code (nested code included) or by a class's methods."""
+    if isinstance(obj, type):
+        for attr in vars(obj).values():
+            attr = getattr(attr, "__func__", attr)
+            if isinstance(attr, property):
+                attr = attr.fget
+            if isinstance(attr, types.FunctionType):
+                yield from _referenced_names(attr)
+        return
+    stack = [obj.__code__]
+    while stack:
+        code = stack.pop()
+        yield from code.co_names
+        stack.extend(c for c in code.co_consts if isinstance(c, types.CodeType))
+
+def definition_hash(module, *names: str) -> str:
+    """
+    SHA-256 over the named functions/classes of module and, transitively, every function,
+    class and constant of module they refer to by name (instances count as their class).
+    Definitions outside module (imports, stdlib) are not followed, so hash those modules
+    separately. Editing a definition that none of names reaches leaves the hash unchanged.
+    """
+    parts: Dict[str, str] = {}
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name in parts or not hasattr(module, name):
+            continue
+        obj = getattr(module, name)
+        if isinstance(obj, types.ModuleType):
+            continue
+        if isinstance(obj, (types.FunctionType, type)):
+            if obj.__module__ != module.__name__:
+                continue
+            parts[name] = inspect.getsource(obj)
+            pending.extend(_referenced_names(obj))
+        elif callable(obj) and getattr(obj, "__module__", None) not in (None, module.__name__):
+            # builtins and functions imported from elsewhere
+            continue
+        elif type(obj).__module__ == module.__name__:
+            parts[name] = f"instance of {type(obj).__name__}"
+            pending.append(type(obj).__name__)
+        else:
+            parts[name] = _stable_repr(obj)
+    h = hashlib.sha256()
+    for name in sorted(parts):
+        h.update(f"{name}\0{parts[name]}\0".encode())
+    return h.hexdigest()
+
+def _link_or_copy(src: str, dst: str):
+    """Hard-link src to dst (copy across filesystems); dst must not exist."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+class ResultCache:
+    """
+    On-disk store of cell results keyed by content hash.
+    Raw logs are hard-linked in and out where possible, so callers must delete an output
+    path before rewriting it (writers that truncate in place would modify the cached copy).
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(**fields: Any) -> str:
+        """Cache key for a cell described by JSON-serializable fields."""
+        blob = json.dumps(fields, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str, restore_to: str | None = None) -> Dict[str, Any] | None:
+        """
+        The cached record for key, or None on a miss. If the entry has an artifact and
+        restore_to is given, the artifact is placed at restore_to (replacing any file there).
+        """
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, "record.json")) as fh:
+                stored = json.load(fh)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        artifact = stored.get("artifact")
+        if artifact and restore_to:
+            src = os.path.join(entry, artifact)
+            if not os.path.exists(src):
+                self.misses += 1
+                return None
+            if os.path.exists(restore_to):
+                os.remove(restore_to)
+            _link_or_copy(src, restore_to)
+        self.hits += 1
+        return stored["record"]
+
+    def put(self, key: str, record: Dict[str, Any], artifact: str | None = None):
+        """Store record (and a copy of the artifact file) under key, atomically."""
+        entry = self._entry(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(entry))
+        try:
+            name = None
+            if artifact is not None:
+                name = "artifact" + os.path.splitext(artifact)[1]
+                _link_or_copy(artifact, os.path.join(tmp, name))
+            with open(os.path.join(tmp, "record.json"), "w") as fh:
+                json.dump({"record": record, "artifact": name}, fh)
+            if os.path.exists(entry):
+                shutil.rmtree(entry)
+            os.replace(tmp, entry)
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
@@ -0,0 +1,214 @@
+# results_db.py
+"""
+SQLite store for experiment results across runs.
+
+Every sweep used to leave its own directory of CSVs (results/day2, results/day3,
+results/backup_*), so comparing runs meant globbing and concatenating files. ResultsDB
+keeps one row per run, its per-configuration summaries and FPRs, and optionally every
+per-step row, in a single database file:
+
+    runs(run_id, created, source, params)
+    summaries(run_id, attack, defense, episodes, asr, mean_reward, median_latency, extra)
+    fpr(run_id, defense, fpr)
+    steps(run_id, attack, defense, episode, step, agent_pos, objects, action, confirmed,
+          reward, done, info, decision_latency, repeat)
+
+The database runs in WAL mode (readers never block the writer) and steps are inserted with
+executemany in chunks inside one transaction per raw log. summaries and steps are indexed
+on (run_id, attack, defense[, episode]). Messages (m_original/m_injected/m_processed) stay
+in the raw logs; the step table keeps what cross-run queries filter or aggregate on.
+
+Usage:
+    python results_db.py results/results.db --ingest results/day2 results/day3 --steps
+    python results_db.py results/results.db --asr --last 5
+
+Provides:
+- ResultsDB(path): add_run(...), ingest_steps(run_id, raw_path), ingest_dir(out_dir),
+  asr_by_defense(last_n, per_run), close()
+"""
+import glob
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Sequence
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    source TEXT,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    attack TEXT NOT NULL,
+    defense TEXT NOT NULL,
+    episodes INTEGER,
+    asr REAL,
+    mean_reward REAL,
+    median_latency REAL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS summaries_run ON summaries(run_id, attack, defense);
+CREATE TABLE IF NOT EXISTS fpr (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    defense TEXT NOT NULL,
+    fpr REAL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL,
+    attack TEXT NOT NULL,
+    defense TEXT NOT NULL,
+    episode INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    agent_pos TEXT,
+    objects TEXT,
+    action TEXT,
+    confirmed INTEGER,
+    reward REAL,
+    done INTEGER,
+    info TEXT,
+    decision_latency REAL,
+    repeat INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS steps_run ON steps(run_id, attack, defense, episode);
+"""
+
+# raw-log columns copied into steps (missing ones are stored as NULL, repeat as 1)
+STEP_COLUMNS = ("episode", "step", "agent_pos", "objects", "action", "confirmed", "reward", "done", "info", "decision_latency", "repeat")
+_SUMMARY_COLUMNS = ("attack", "defense", "episodes", "asr", "mean_reward", "median_latency")
+DEFAULT_BATCH_ROWS = 65536
+
+class ResultsDB:
+    """Connection to a results database (created with the schema above if missing)."""
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: commits survive a process crash; an OS crash can lose the last ones
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def add_run(self, source: str, params: Dict[str, Any] | None = None, summaries: Sequence[Dict[str, Any]] = (),
+                fpr: Sequence[Dict[str, Any]] = ()) -> int:
+        """
+        Record a run with its summary rows (dicts with attack/attack_type, defense, episodes,
+        asr, ...; other keys go to 'extra' as JSON) and FPR rows; returns the new run_id.
+        """
+        with self.conn:
+            cur = self.conn.execute("INSERT INTO runs (created, source, params) VALUES (?, ?, ?)",
+                                    (time.time(), source, json.dumps(params or {}, default=str)))
+            run_id = cur.lastrowid
+            rows = []
+            for s in summaries:
+                s = dict(s)
+                if "attack" not in s:
+                    s["attack"] = s.pop("attack_type")
+                s.setdefault("defense", "none")
+                if "episodes_used" in s:
+                    # adaptive runs: weight by the episodes the ASR was measured on, keep the nominal budget in extra
+                    s["episodes_budget"] = s.get("episodes")
+                    s["episodes"] = s.pop("episodes_used")
+                core = [s.pop(c, None) for c in _SUMMARY_COLUMNS]
+                rows.append((run_id, *core, json.dumps(s, default=str)))
+            self.conn.executemany("INSERT INTO summaries (run_id, attack, defense, episodes, asr, mean_reward, median_latency, extra) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.executemany("INSERT INTO fpr (run_id, defense, fpr) VALUES (?, ?, ?)",
+                                  [(run_id, r["defense"], r["fpr"]) for r in fpr])
+        return run_id
+
+    def ingest_steps(self, run_id: int, raw_path: str, batch_rows: int = DEFAULT_BATCH_ROWS) -> int:
+        """
+        Bulk-insert the rows of one raw log (.csv, .parquet or .traj) under run_id, reading and
+        inserting batch_rows rows at a time in a single transaction. Attack and defense come
+        from the log's attack_type/defense columns (defense 'none' when absent).
+        Returns the number of rows inserted.
+        """
+        from analytics import iter_raw_chunks
+        n = 0
+        with self.conn:
+            for chunk in iter_raw_chunks(raw_path, ("attack_type", "defense") + STEP_COLUMNS, batch_rows):
+                size = len(chunk)
+                cols = [[run_id] * size, chunk["attack_type"].tolist(),
+                        chunk["defense"].tolist() if "defense" in chunk else ["none"] * size]
+                for c in STEP_COLUMNS:
+                    if c in chunk:
+                        cols.append(chunk[c].tolist())
+                    else:
+                        cols.append([1 if c == "repeat" else None] * size)
+                self.conn.executemany(f"INSERT INTO steps (run_id, attack, defense, {', '.join(STEP_COLUMNS)}) "
+                                      f"VALUES ({', '.join('?' * (len(STEP_COLUMNS) + 3))})", zip(*cols))
+                n += size
+        return n
+
+    def ingest_dir(self, out_dir: str, steps: bool = False, batch_rows: int = DEFAULT_BATCH_ROWS) -> int:
+        """
+        Import an existing results directory as a new run: summary.csv (run_experiments) or
+        asr_summary.csv (run_attacks), defense_fpr.csv, and with steps=True every raw_* log.
+        Returns the run_id.
+        """
+        import pandas as pd
+        summaries: List[Dict[str, Any]] = []
+        for name in ("summary.csv", "asr_summary.csv"):
+            path = os.path.join(out_dir, name)
+            if os.path.exists(path):
+                summaries.extend(pd.read_csv(path).to_dict("records"))
+        fpr_path = os.path.join(out_dir, "defense_fpr.csv")
+        fpr = pd.read_csv(fpr_path).to_dict("records") if os.path.exists(fpr_path) else []
+        run_id = self.add_run(out_dir, {"imported_from": out_dir}, summaries, fpr)
+        if steps:
+            for path in sorted(glob.glob(os.path.join(out_dir, "raw_*"))):
+                if os.path.splitext(path)[1] in (".csv", ".parquet", ".traj"):
+                    self.ingest_steps(run_id, path, batch_rows)
+        return run_id
+
+    def asr_by_defense(self, last_n: int = 5, per_run: bool = False, exclude_attacks: Sequence[str] = ("none",)) -> List[Dict[str, Any]]:
+        """
+        ASR per defense over the last_n runs (episode-weighted over attacks, benign 'none'
+        attack excluded by default); with per_run=True one row per (run_id, defense).
+        """
+        group = "s.run_id, s.defense" if per_run else "s.defense"
+        excluded = ", ".join("?" * len(exclude_attacks))
+        sql = (f"SELECT {group}, SUM(s.asr * s.episodes) / SUM(s.episodes) AS asr, SUM(s.episodes) AS episodes, "
+               f"COUNT(DISTINCT s.run_id) AS runs "
+               f"FROM summaries s WHERE s.run_id IN (SELECT run_id FROM runs ORDER BY run_id DESC LIMIT ?) "
+               f"{f'AND s.attack NOT IN ({excluded}) ' if exclude_attacks else ''}"
+               f"GROUP BY {group} ORDER BY {group}")
+        cur = self.conn.execute(sql, (last_n, *exclude_attacks))
+        names = [d[0] for d in cur.description]
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Import results directories into a results database and query it")
+    parser.add_argument("db", type=str)
+    parser.add_argument("--ingest", type=str, nargs="*", default=[], help="results directories (or glob patterns) to import as runs")
+    parser.add_argument("--steps", action="store_true", help="also import the per-step raw logs")
+    parser.add_argument("--asr", action="store_true", help="print ASR per defense over the last --last runs")
+    parser.add_argument("--last", type=int, default=5)
+    parser.add_argument("--per_run", action="store_true", help="one ASR row per run and defense")
+    args = parser.parse_args()
+    with ResultsDB(args.db) as db:
+        for pattern in args.ingest:
+            for out_dir in sorted(glob.glob(pattern)) or [pattern]:
+                run_id = db.ingest_dir(out_dir, steps=args.steps)
+                print(f"[+] Imported {out_dir} as run {run_id}")
+        if args.asr:
+            t0 = time.perf_counter()
+            rows = db.asr_by_defense(args.last, per_run=args.per_run)
+            elapsed = time.perf_counter() - t0
+            for r in rows:
+                print("   " + "  ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in r.items()))
+            print(f"[+] Query over the last {args.last} runs took {elapsed * 1e3:.2f} ms")
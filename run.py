@@ -1,50 +1,56 @@
 # run.py
 import argparse
 import time
-import pandas as pd
 from env import GridWorld
 from policies import rule_based_policy
+from trajectory import open_sink, SINK_FORMATS, DEFAULT_CHUNK_ROWS
 
-def run_episodes(n_episodes: int = 20, max_steps: int = 50, out_csv: str = "results/day1_results.csv", seed_base: int = 0):
-    rows = []
-    env = GridWorld(size=4)
-    for ep in range(n_episodes):
-        s_repr, m = env.reset(seed=seed_base + ep)
-        done = False
-        step = 0
-        while not done and step < max_steps:
-            # policy chooses action
-            action = rule_based_policy(s_repr, m)
-            (s_repr_next, m_next), reward, done, info = env.step(action)
-            timestamp = time.time()
-            rows.append({
-                "episode": ep,
-                "step": step,
-                "agent_pos": str(s_repr[0]),
-                "objects": str(s_repr[1]),
-                "m": m,
-                "action": action,
-                "reward": float(reward),
-                "done": bool(done),
-                "info": str(info),
-                "timestamp": timestamp
-            })
-            # advance
-            s_repr, m = s_repr_next, m_next
-            step += 1
-    df = pd.DataFrame(rows)
-    # ensure results folder exists
-    import os
-    os.makedirs(os.path.dirname(out_csv), exist_ok=True)
-    df.to_csv(out_csv, index=False)
+def run_episodes(n_episodes: int = 20, max_steps: int = 50, out_csv: str = "results/day1_results.csv", seed_base: int = 0,
+                 raw_format: str = "csv", chunk_rows: int = DEFAULT_CHUNK_ROWS) -> str:
+    """
+    Run baseline episodes and stream per-step rows to out_csv (written in chunks of chunk_rows).
+    Returns the output path. (This used to return the rows as a DataFrame; rows are no longer
+    held in memory, so read them back with pd.read_csv(path) or trajectory.TrajReader.)
+    """
+    # sink creates the results folder if needed; the with block closes it even if an episode raises
+    with open_sink(out_csv, raw_format, chunk_rows) as sink:
+        env = GridWorld(size=4)
+        for ep in range(n_episodes):
+            s_repr, m = env.reset(seed=seed_base + ep)
+            done = False
+            step = 0
+            while not done and step < max_steps:
+                # policy chooses action
+                action = rule_based_policy(s_repr, m)
+                (s_repr_next, m_next), reward, done, info = env.step(action)
+                timestamp = time.time()
+                sink.write({
+                    "episode": ep,
+                    "step": step,
+                    "agent_pos": str(s_repr[0]),
+                    "objects": str(s_repr[1]),
+                    "m": m,
+                    "action": action,
+                    "reward": float(reward),
+                    "done": bool(done),
+                    "info": str(info),
+                    "timestamp": timestamp
+                })
+                # advance
+                s_repr, m = s_repr_next, m_next
+                step += 1
     print(f"Saved results to {out_csv}")
-    return df
+    return out_csv
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run Day1 GridWorld experiments")
     parser.add_argument("--episodes", type=int, default=30)
     parser.add_argument("--max_steps", type=int, default=50)
     parser.add_argument("--out", type=str, default="results/day1_results.csv")
+    parser.add_argument("--raw_format", type=str, default="csv", choices=SINK_FORMATS, help="format of the per-step log")
+    parser.add_argument("--chunk_rows", type=int, default=DEFAULT_CHUNK_ROWS, help="steps buffered before each flush")
     args = parser.parse_args()
-    df = run_episodes(n_episodes=args.episodes, max_steps=args.max_steps, out_csv=args.out)
-    print(df.head())
+    out = run_episodes(n_episodes=args.episodes, max_steps=args.max_steps, out_csv=args.out, raw_format=args.raw_format, chunk_rows=args.chunk_rows)
+    if args.raw_format == "csv":
+        import pandas as pd
+        print(pd.read_csv(out, nrows=5))
@@ -8,65 +8,65 @@ Usage (example):
 If you pass 'all' for --attacks, it will run all templates including 'none'.
 """
 import argparse
+import csv
 import os
 import time
 from typing import List, Dict, Any
 
-import pandas as pd
-import matplotlib.pyplot as plt
-
 from env import GridWorld
 from policies import rule_based_policy
 import attacks as atk
+from trajectory import open_sink, sink_path, SINK_FORMATS, DEFAULT_CHUNK_ROWS
 
 TARGET_ACTION = "PRESS"
 
-def run_for_attack(attack_type: str, episodes: int, max_steps: int, out_dir: str, seed_base: int = 0) -> Dict[str, Any]:
+def run_for_attack(attack_type: str, episodes: int, max_steps: int, out_dir: str, seed_base: int = 0,
+                   raw_format: str = "csv", chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Dict[str, Any]:
     """
     Run episodes where the perception m is injected with attack_type payload.
+    Per-step rows are streamed to raw_<attack_type>.<raw_format> in chunks of chunk_rows.
     Returns summary dict (ASR, episodes, attack_type, output_csv).
     """
     os.makedirs(out_dir, exist_ok=True)
-    rows = []
-    env = GridWorld(size=4)
+    out_csv = sink_path(out_dir, f"raw_{attack_type}", raw_format)
     episode_success = []  # whether episode reached target action at least once
-    for ep in range(episodes):
-        # reset env with deterministic seed for reproducibility
-        s_repr, m_original = env.reset(seed=seed_base + ep)
-        done = False
-        step = 0
-        succeeded = False
-        # inject once at episode start (simple scenario)
-        m_injected = atk.inject(m_original, attack_type=attack_type, placement='append')
-        while not done and step < max_steps:
-            action = rule_based_policy(s_repr, m_injected)  # policy sees injected m
-            (s_repr_next, m_next), reward, done, info = env.step(action)
-            timestamp = time.time()
-            rows.append({
-                "episode": ep,
-                "attack_type": attack_type,
-                "step": step,
-                "agent_pos": str(s_repr[0]),
-                "objects": str(s_repr[1]),
-                "m_original": m_original,
-                "m_injected": m_injected,
-                "action": action,
-                "reward": float(reward),
-                "done": bool(done),
-                "info": str(info),
-                "timestamp": timestamp
-            })
-            if action == TARGET_ACTION:
-                succeeded = True
-            # advance
-            s_repr, m_original = s_repr_next, m_next
-            step += 1
+    # the with block closes the sink (a complete file) even if an episode raises
+    with open_sink(out_csv, raw_format, chunk_rows) as sink:
+        env = GridWorld(size=4)
+        for ep in range(episodes):
+            # reset env with deterministic seed for reproducibility
+            s_repr, m_original = env.reset(seed=seed_base + ep)
+            done = False
+            step = 0
+            succeeded = False
+            # inject once at episode start (simple scenario)
+            m_injected = atk.inject(m_original, attack_type=attack_type, placement='append')
+            while not done and step < max_steps:
+                action = rule_based_policy(s_repr, m_injected)  # policy sees injected m
+                (s_repr_next, m_next), reward, done, info = env.step(action)
+                timestamp = time.time()
+                sink.write({
+                    "episode": ep,
+                    "attack_type": attack_type,
+                    "step": step,
+                    "agent_pos": str(s_repr[0]),
+                    "objects": str(s_repr[1]),
+                    "m_original": m_original,
+                    "m_injected": m_injected,
+                    "action": action,
+                    "reward": float(reward),
+                    "done": bool(done),
+                    "info": str(info),
+                    "timestamp": timestamp
+                })
+                if action == TARGET_ACTION:
+                    succeeded = True
+                # advance
+                s_repr, m_original = s_repr_next, m_next
+                step += 1
 
-        episode_success.append(1 if succeeded else 0)
+            episode_success.append(1 if succeeded else 0)
 
-    df = pd.DataFrame(rows)
-    out_csv = os.path.join(out_dir, f"raw_{attack_type}.csv")
-    df.to_csv(out_csv, index=False)
     # compute ASR = fraction of episodes where target action occurred at least once
     asr = sum(episode_success) / len(episode_success) if len(episode_success) > 0 else 0.0
     summary = {
@@ -78,6 +78,7 @@ def run_for_attack(attack_type: str, episodes: int, max_steps: int, out_dir: str
     return summary
 
 def plot_asr(summaries: List[Dict[str, Any]], out_path: str):
+    import matplotlib.pyplot as plt  # ~0.7s to import; only loaded when a plot is drawn
     attack_names = [s["attack_type"] for s in summaries]
     asr_vals = [s["asr"] for s in summaries]
     plt.figure(figsize=(6,4))
@@ -112,20 +113,24 @@ def main(args):
     summaries = []
     for a in attack_list:
         print(f"[+] Running attack '{a}' for {args.episodes} episodes...")
-        summary = run_for_attack(a, episodes=args.episodes, max_steps=args.max_steps, out_dir=args.out_dir, seed_base=args.seed)
+        summary = run_for_attack(a, episodes=args.episodes, max_steps=args.max_steps, out_dir=args.out_dir, seed_base=args.seed,
+                                 raw_format=args.raw_format, chunk_rows=args.chunk_rows)
         print(f"   -> ASR for {a}: {summary['asr']:.3f}")
         summaries.append(summary)
 
     # save summary CSV
-    summary_df = pd.DataFrame(summaries)
     summary_csv = os.path.join(args.out_dir, "asr_summary.csv")
-    summary_df.to_csv(summary_csv, index=False)
+    with open(summary_csv, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=list(summaries[0]), lineterminator=os.linesep)
+        writer.writeheader()
+        writer.writerows(summaries)
     print(f"[+] Saved summary to {summary_csv}")
 
     # plot ASR bar chart
-    plot_path = os.path.join(args.out_dir, "asr_by_attack.png")
-    plot_asr(summaries, plot_path)
-    print(f"[+] Saved ASR plot to {plot_path}")
+    if not args.no_plot:
+        plot_path = os.path.join(args.out_dir, "asr_by_attack.png")
+        plot_asr(summaries, plot_path)
+        print(f"[+] Saved ASR plot to {plot_path}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -134,5 +139,8 @@ if __name__ == "__main__":
     parser.add_argument("--out_dir", type=str, default="results/day2", help="output directory")
     parser.add_argument("--seed", type=int, default=0, help="seed base for reproducibility")
     parser.add_argument("--attacks", nargs="+", default=["direct","metadata","camouflaged"], help="attacks to run or 'all'")
+    parser.add_argument("--raw_format", type=str, default="csv", choices=SINK_FORMATS, help="format of the raw per-step logs")
+    parser.add_argument("--no_plot", "--no-plot", action="store_true", help="skip the ASR plot (matplotlib is then never imported)")
+    parser.add_argument("--chunk_rows", type=int, default=DEFAULT_CHUNK_ROWS, help="steps buffered before each raw-log flush")
     args = parser.parse_args()
     main(args)
@@ -4,26 +4,54 @@ Run (attack x defense) experiments and produce raw logs + summary metrics + plot
 
 Usage:
     python run_experiments.py --episodes 30 --max_steps 50 --out_dir results/day3 --seed 0
+    python run_experiments.py --episodes 100000 --vectorized   # batch engine (VecGridWorld)
+    python run_experiments.py --episodes 10000 --workers 32     # shard the sweep over a process pool
+    python run_experiments.py --exact                           # exact metrics over all start layouts
+    python run_experiments.py --cache_dir results/.cache        # rerun only cells whose code/params changed
+    python run_experiments.py --results_db results/results.db   # also record the run in the results database
+    python run_experiments.py --env_pool 4                      # step environments in 4 shared-memory worker processes
+    python run_experiments.py --size 8                          # 8x8 grid (multi-node sweeps: see sweep_queue.py)
+    python run_experiments.py --episodes 2000 --adaptive --ci_width 0.05   # stop each cell once its ASR/FPR interval is narrow
+    python run_experiments.py --llm_url http://127.0.0.1:8765   # decisions from a model server, many episodes in flight
 
 Outputs:
- - results/day3/raw_<attack>_<defense>.csv  (per-step logs)
+ - results/day3/raw_<attack>_<defense>.csv  (per-step logs, streamed in chunks; .parquet / .traj with --raw_format)
  - results/day3/summary.csv                 (per configuration metrics)
- - results/day3/asr_by_attack_defense.png   (grouped bar chart)
+ - results/day3/asr_by_attack_defense.png   (grouped bar chart; skipped with --no_plot)
  - results/day3/defense_fpr.csv             (FPR for defenses on benign runs)
+ - results/day3/fpr_divergence.csv          (per benign episode: first step each defense changed, -1 = none)
+ - results/day3/worker_stats.csv            (episodes/s per worker, only with --workers > 1)
 """
 import os
+import sys
 import argparse
+import csv
+import math
+import hashlib
+import inspect
 import time
 from typing import List, Dict, Any
 
-import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
 
-from env import GridWorld
-from policies import rule_based_policy
+from env import GridWorld, VecGridWorld, ACTIONS, ACTION_INDEX, layout_distribution, perception_text
+from policies import rule_based_policy, has_press_instruction, CachedPolicy
+from policy_table import table_policy
 import attacks as atk
 import defenses as dfn
+from instrumentation import Instrumentation, LatencyHistogram
+import instrumentation
+import perception
+import policies
+import policy_table
+import seeding
+import step_buffer
+import trajectory
+import env as gridenv
+from result_cache import ResultCache, definition_hash, source_hash
+from seeding import EpisodeSeeds, SEEDING_SCHEMES
+from step_buffer import StepBuffer, INFO_STRINGS
+from trajectory import open_sink, sink_path, concat_files, TrajectorySink, SINK_FORMATS, DEFAULT_CHUNK_ROWS
 
 # Define attacks and defenses we will iterate over
 ATTACKS = ["none", "direct", "metadata", "camouflaged"]
@@ -31,97 +59,620 @@ DEFENSES = ["none", "sanitize", "confirm"]
 
 TARGET_ACTION = "PRESS"
 
-def run_one_configuration(attack: str, defense: str, episodes: int, max_steps: int, out_dir: str, seed_base: int = 0) -> Dict[str, Any]:
+# seed-stream key of the environment every sweep episode runs on; attack/defense cells share
+# it on purpose, so all cells see the same start layouts (paired comparison, as with legacy seeds)
+def env_config(size: int = 4) -> str:
+    return f"gridworld-{size}x{size}"
+
+ENV_CONFIG = env_config(4)
+
+# string forms used by the raw logs, indexed by action code / info code
+_ACTION_NAMES = np.array(ACTIONS, dtype=object)
+_INFO_STRINGS = np.array(INFO_STRINGS, dtype=object)
+
+class EpisodeTotals:
     """
-    Runs episodes for a single (attack, defense) configuration.
-    Returns a summary dict with ASR, mean_reward, avg_decision_latency, out_csv
+    Running totals of one shard of a configuration: episodes, successes, the reward sum and a
+    LatencyHistogram of per-step decision latencies. Their size does not depend on the number
+    of episodes, and shards merge exactly: the reward sum is kept as exact partials (as in
+    math.fsum), so any split of the episode range gives the same mean_reward.
     """
-    os.makedirs(out_dir, exist_ok=True)
-    rows = []
-    env = GridWorld(size=4)
-    episode_success = []
-    episode_rewards = []
-    decision_latencies = []  # measure time per policy-decision (including defense)
-    for ep in range(episodes):
-        s_repr, m_original = env.reset(seed=seed_base + ep)
+    def __init__(self):
+        self.episodes = 0
+        self.successes = 0
+        self.reward_partials: List[float] = []
+        self.latency = LatencyHistogram()
+
+    def add_episode(self, success: bool, reward: float):
+        self.episodes += 1
+        self.successes += 1 if success else 0
+        self._add_reward(reward)
+
+    def _add_reward(self, x: float):
+        # Shewchuk's algorithm: partials stay non-overlapping and sum exactly to the total
+        partials = self.reward_partials
+        i = 0
+        for y in partials:
+            if abs(x) < abs(y):
+                x, y = y, x
+            hi = x + y
+            lo = y - (hi - x)
+            if lo:
+                partials[i] = lo
+                i += 1
+            x = hi
+        partials[i:] = [x]
+
+    def add_latency(self, seconds: float, count: int = 1):
+        self.latency.record(int(seconds * 1e9), count)
+
+    def add_latencies(self, seconds: np.ndarray, counts: np.ndarray | None = None):
+        ns = (np.asarray(seconds, dtype=np.float64) * 1e9).astype(np.int64).ravel()
+        self.latency.record_array(ns, None if counts is None else np.asarray(counts, dtype=np.int64).ravel())
+
+    def merge(self, other: "EpisodeTotals") -> "EpisodeTotals":
+        self.episodes += other.episodes
+        self.successes += other.successes
+        for x in other.reward_partials:
+            self._add_reward(x)
+        self.latency.merge(other.latency)
+        return self
+
+    @property
+    def reward_sum(self) -> float:
+        return math.fsum(self.reward_partials)
+
+# s_repr stand-ins for evaluating dfn.confirm with the agent on / off the button
+_S_REPR_AWAY_FROM_BUTTON = ((0, 0), (("red_button", (1, 0)),))
+_S_REPR_AT_BUTTON = ((0, 0), (("red_button", (0, 0)),))
+
+def _confirm_table(messages: List[str]) -> np.ndarray:
+    """
+    allowed[i, code, at_button] = dfn.confirm(ACTIONS[code], s_repr, messages[i]),
+    where s_repr puts the agent on the button iff at_button == 1.
+    confirm only looks at the action, the message and whether the agent is on the button,
+    so this table reproduces it exactly for every state of episode i.
+    """
+    per_message = {}
+    allowed = np.empty((len(messages), len(ACTIONS), 2), dtype=bool)
+    for i, m in enumerate(messages):
+        if m not in per_message:
+            per_message[m] = [[dfn.confirm(a, _S_REPR_AWAY_FROM_BUTTON, m), dfn.confirm(a, _S_REPR_AT_BUTTON, m)] for a in ACTIONS]
+        allowed[i] = per_message[m]
+    return allowed
+
+def _process_messages(defense: str, m_texts: List[str]):
+    """Apply the defense pre-processing and derive per-episode policy inputs (processed m, press mask, confirm table)."""
+    if defense == "sanitize":
+        # layouts repeat across episodes; sanitize_batch sanitizes each distinct message once
+        m_processed = dfn.sanitize_batch(m_texts)
+    else:
+        m_processed = list(m_texts)
+    press = np.array([has_press_instruction(m) for m in m_processed], dtype=bool)
+    allowed = _confirm_table(m_processed) if defense == "confirm" else None
+    return m_processed, press, allowed
+
+def _fast_forward_runs(first_step: int, count: int, env_max_steps: int, rle: bool) -> List[tuple]:
+    """
+    Replayed steps first_step..first_step+count-1 of a settled episode as (first, count, done) runs.
+    Steps only differ in done, which turns True on the step that reaches env_max_steps, so there
+    are at most two runs; without rle each step is its own run.
+    """
+    if count <= 0:
+        return []
+    last = first_step + count - 1
+    last_done = last + 1 >= env_max_steps
+    if not rle:
+        return [(s, 1, s + 1 >= env_max_steps) for s in range(first_step, first_step + count)]
+    if last_done and count > 1:
+        return [(first_step, count - 1, False), (last, 1, True)]
+    return [(first_step, count, last_done)]
+
+def _simulate_vectorized(attack: str, defense: str, seeds: List[int] | None, max_steps: int, freeze_message: bool = True, record: bool = True,
+                         layouts: List[tuple] | None = None, size: int = 4, instrument: Instrumentation | None = None,
+                         fast_forward: bool = False, rle_rows: bool = False) -> Dict[str, Any]:
+    """
+    Step one (attack, defense) configuration for len(seeds) episodes in lockstep on a VecGridWorld.
+    freeze_message=True mirrors run_one_configuration (m is injected once at reset);
+    freeze_message=False mirrors compute_fpr_for_defense (the policy sees the current m every step).
+    With layouts (a list of (red_box, red_button) pairs) given instead of seeds, episode i starts
+    from layouts[i].
+    Returns per-step arrays of shape (steps, episodes): 'action' codes and 'reward' always,
+    plus the raw-log columns when record=True, with 'repeat' giving how many steps each row
+    stands for (0 for a step folded into an earlier run-length row).
+    instrument, if given, receives each batch stage time amortized over the episodes stepped.
+    fast_forward=True stops stepping an episode once a step left its state unchanged and replays
+    that step for its remaining steps, while the other episodes go on; with rle_rows=True the
+    replayed steps are logged as run-length rows instead of one row per step.
+    """
+    if layouts is not None:
+        n = len(layouts)
+        venv = VecGridWorld(n, size=size)
+        agent, red_box, red_button = venv.reset_layouts(np.array([l[0] for l in layouts], dtype=np.int64).reshape(n, 2),
+                                                        np.array([l[1] for l in layouts], dtype=np.int64).reshape(n, 2))
+    else:
+        n = len(seeds)
+        venv = VecGridWorld(n, size=size)
+        agent, red_box, red_button = venv.reset(seeds=seeds)
+    episodes_idx = np.arange(n)
+    m_original = venv.perceptions()
+    objects = [str(venv.s_repr(i)[1]) for i in range(n)]
+    if instrument is not None:
+        t0 = time.perf_counter_ns()
+    m_injected = [atk.inject(m, attack_type=attack, placement='append') for m in m_original]
+    if instrument is not None:
+        t1 = time.perf_counter_ns()
+    m_processed, press, allowed = _process_messages(defense, m_injected)
+    if instrument is not None and n:
+        instrument["inject"].record((t1 - t0) // n, count=n)
+        if defense == "sanitize":
+            instrument["sanitize"].record((time.perf_counter_ns() - t1) // n, count=n)
+    # rule_based_policy_batch as one gather over the precompiled action table (the batch rule itself on large grids)
+    policy = table_policy(venv.size)
+    pos_strings = np.empty((venv.size, venv.size), dtype=object)
+    for x in range(venv.size):
+        for y in range(venv.size):
+            pos_strings[x, y] = str((x, y))
+
+    trace = {k: [] for k in ("action", "reward", "confirmed", "done", "info", "agent_pos", "objects",
+                             "m_original", "m_injected", "m_processed", "decision_latency", "timestamp")}
+    # last decision of every episode; settled episodes keep theirs while the others are stepped
+    action = np.zeros(n, dtype=np.int64)
+    reward = np.zeros(n, dtype=np.float64)
+    confirmed = np.ones(n, dtype=bool)
+    info_code = np.zeros(n, dtype=np.int64)
+    latency = np.zeros(n, dtype=np.float64)
+    # episodes still being stepped, and the step at which each settled episode reached its fixed point
+    live = episodes_idx
+    settled_at = np.full(n, -1, dtype=np.int64)
+    done = False
+    step_limit = min(max_steps, venv.max_steps)
+    step = 0
+    # every episode advances one step per iteration, so done is the same for all of them
+    while live.size and not done and step < max_steps:
+        sub = slice(None) if live.size == n else live
+        m = live.size
+        decision_start = time.perf_counter()
+        act = policy.batch(agent[sub], red_box[sub], red_button[sub], press[sub])
+        policy_end = time.perf_counter()
+        if defense == "confirm":
+            at_button = (agent[sub] == red_button[sub]).all(axis=1)
+            conf = allowed[live, act, at_button.astype(np.int64)]
+            # fallback: replace unconfirmed actions with NOOP
+            act = np.where(conf, act, ACTION_INDEX["NOOP"])
+        else:
+            conf = True
+        decision_end = time.perf_counter()
+
+        carrying = venv.carrying[sub].copy() if fast_forward else None
+        (agent_next, red_box_next, _), rew, done_live, info = venv.step(act, None if live.size == n else live)
+        done = bool(done_live[0])
+        if instrument is not None:
+            instrument["policy"].record(int((policy_end - decision_start) * 1e9) // m, count=m)
+            if defense == "confirm":
+                instrument["confirm"].record(int((decision_end - policy_end) * 1e9) // m, count=m)
+            instrument["env_step"].record(int((time.perf_counter() - decision_end) * 1e9) // m, count=m)
+        action[sub] = act
+        reward[sub] = rew
+        trace["action"].append(action.copy())
+        trace["reward"].append(reward.copy())
+        if record:
+            confirmed[sub] = conf
+            info_code[sub] = info["picked"] * 1 + info["dropped"] * 2 + info["pressed"] * 3
+            latency[sub] = (decision_end - decision_start) / m
+            trace["confirmed"].append(confirmed.copy())
+            trace["done"].append(np.full(n, done))
+            trace["info"].append(info_code.copy())
+            trace["agent_pos"].append(pos_strings[agent[:, 0], agent[:, 1]])
+            trace["objects"].append(list(objects))
+            trace["m_original"].append(list(m_original))
+            trace["m_injected"].append(list(m_injected))
+            trace["m_processed"].append(list(m_processed))
+            trace["decision_latency"].append(latency.copy())
+            trace["timestamp"].append(time.time())
+
+        # a step that left an episode's state unchanged repeats exactly until the episode ends
+        if fast_forward and not done:
+            still = ((agent_next == agent[sub]).all(axis=1) & (red_box_next == red_box[sub]).all(axis=1)
+                     & (venv.carrying[sub] == carrying))
+        else:
+            still = None
+        agent[sub] = agent_next
+        red_box[sub] = red_box_next
+        # a DROP moves the box, which changes the perception of that episode
+        dropped = live[np.flatnonzero(info["dropped"])]
+        if dropped.size:
+            for i, m_text in zip(dropped, venv.perceptions(dropped)):
+                m_original[i] = m_text
+                objects[i] = str(venv.s_repr(i)[1])
+            if not freeze_message:
+                refreshed = [atk.inject(m_original[i], attack_type=attack, placement='append') for i in dropped]
+                proc, prs, allw = _process_messages(defense, refreshed)
+                for j, i in enumerate(dropped):
+                    m_injected[i] = refreshed[j]
+                    m_processed[i] = proc[j]
+                press[dropped] = prs
+                if allowed is not None:
+                    allowed[dropped] = allw
+        if still is not None and still.any():
+            settled_at[live[still]] = step
+            live = live[~still]
+        step += 1
+
+    if n and not live.size and step < step_limit:
+        # every episode is at a fixed point: the remaining steps repeat the last one exactly
+        remaining = step_limit - step
+        trace["action"].extend([trace["action"][-1]] * remaining)
+        trace["reward"].extend([trace["reward"][-1]] * remaining)
+        if record:
+            for k in ("confirmed", "info", "agent_pos", "objects", "m_original", "m_injected", "m_processed",
+                      "decision_latency", "timestamp"):
+                trace[k].extend([trace[k][-1]] * remaining)
+            trace["done"].extend(np.full(n, s + 1 >= venv.max_steps) for s in range(step, step_limit))
+        step = step_limit
+
+    out = {"episodes": n, "steps": step,
+           "action": np.array(trace["action"], dtype=np.int64).reshape(step, n),
+           "reward": np.array(trace["reward"], dtype=np.float64).reshape(step, n)}
+    if record:
+        repeat = np.ones((step, n), dtype=np.int64)
+        if rle_rows:
+            # fold the replayed steps of each settled episode into run-length rows
+            for s in np.unique(settled_at[settled_at >= 0]).tolist():
+                eps = settled_at == s
+                repeat[s + 1:, eps] = 0
+                for first, count, _ in _fast_forward_runs(s + 1, step - (s + 1), venv.max_steps, True):
+                    repeat[first, eps] = count
+        out["repeat"] = repeat
+        for k in ("confirmed", "done", "info", "decision_latency"):
+            out[k] = np.array(trace[k]).reshape(step, n)
+        for k in ("agent_pos", "objects", "m_original", "m_injected", "m_processed"):
+            col = np.empty((step, n), dtype=object)
+            for t, values in enumerate(trace[k]):
+                col[t, :] = values
+            out[k] = col
+        out["timestamp"] = np.repeat(np.array(trace["timestamp"], dtype=np.float64)[:, None], n, axis=1)
+    return out
+
+def _episode_rewards(sim: Dict[str, Any]) -> np.ndarray:
+    """Per-episode reward totals of a _simulate_vectorized result, summed step by step like the scalar loop."""
+    rewards = np.zeros(sim["episodes"], dtype=np.float64)
+    for t in range(sim["steps"]):
+        rewards += sim["reward"][t]
+    return rewards
+
+# episodes stepped together per VecGridWorld batch; bounds memory of the vectorized runner
+VECTOR_BATCH_EPISODES = 8192
+
+def _run_episode_range_vectorized(attack: str, defense: str, ep_start: int, ep_stop: int, max_steps: int, seeds: EpisodeSeeds, sink: TrajectorySink,
+                                  instrument: Instrumentation | None = None, fast_forward: bool = False, rle_rows: bool = False,
+                                  size: int = 4) -> Dict[str, Any]:
+    """VecGridWorld implementation of _run_episode_range (same rows, same per-episode results)."""
+    totals = EpisodeTotals()
+    for batch_start in range(ep_start, ep_stop, VECTOR_BATCH_EPISODES):
+        batch_stop = min(batch_start + VECTOR_BATCH_EPISODES, ep_stop)
+        episodes = batch_stop - batch_start
+        sim = _simulate_vectorized(attack, defense, seeds.range(batch_start, batch_stop), max_steps, instrument=instrument,
+                                   fast_forward=fast_forward, rle_rows=rle_rows, size=size)
+        steps = sim["steps"]
+
+        def episode_major(a):
+            return a.T.reshape(-1)
+
+        keep = episode_major(sim["repeat"]) > 0 if rle_rows else slice(None)
+        columns = {
+            "episode": np.repeat(np.arange(batch_start, batch_stop), steps)[keep],
+            "step": np.tile(np.arange(steps), episodes)[keep],
+            "attack_type": attack,
+            "defense": defense,
+        }
+        for k in ("agent_pos", "objects", "m_original", "m_injected", "m_processed"):
+            columns[k] = episode_major(sim[k])[keep]
+        columns["action"] = _ACTION_NAMES[episode_major(sim["action"])[keep]]
+        for k in ("confirmed", "reward", "done"):
+            columns[k] = episode_major(sim[k])[keep]
+        columns["info"] = _INFO_STRINGS[episode_major(sim["info"])[keep]]
+        for k in ("decision_latency", "timestamp"):
+            columns[k] = episode_major(sim[k])[keep]
+        if rle_rows:
+            columns["repeat"] = episode_major(sim["repeat"])[keep]
+        sink.write_columns(columns)
+        # one latency per step, also for steps folded into run-length rows
+        totals.add_latencies(sim["decision_latency"], sim["repeat"])
+        success = (sim["action"] == ACTION_INDEX[TARGET_ACTION]).any(axis=0)
+        for succeeded, reward in zip(success.tolist(), _episode_rewards(sim).tolist()):
+            totals.add_episode(succeeded, reward)
+    result = {"totals": totals}
+    if instrument is not None:
+        result["instrument"] = instrument
+    return result
+
+# episode slots per EnvPool worker process
+POOL_ENVS_PER_WORKER = 16
+
+def _defense_input(defense: str, m_injected: str):
+    """Message the policy decides on under defense, and the time sanitize took (0.0 without it)."""
+    if defense == "sanitize":
+        return dfn.measure_time(dfn.sanitize, m_injected)
+    return m_injected, 0.0
+
+def _defense_output(defense: str, action: str, s_repr, m_injected: str):
+    """(action taken, confirmed, time confirm took) for the policy's action under defense."""
+    if defense == "confirm":
+        confirmed, lat_confirm = dfn.measure_time(dfn.confirm, action, s_repr, m_injected)
+        # fallback: replace unconfirmed actions with NOOP
+        return action if confirmed else "NOOP", confirmed, lat_confirm
+    return action, True, 0.0
+
+def _defended_decision(defense: str, policy, s_repr, m_injected: str):
+    """
+    One decision of the defended pipeline with policy(s_repr, m) -> action:
+    (m_processed, action, confirmed, sanitize_s, policy_s, confirm_s); the decision latency is
+    the sum of the three times. _llm_decision is the same pipeline around an awaited policy.
+    """
+    m_processed, lat_sanitize = _defense_input(defense, m_injected)
+    decision_start = time.perf_counter()
+    action = policy(s_repr, m_processed)
+    lat_policy = time.perf_counter() - decision_start
+    action, confirmed, lat_confirm = _defense_output(defense, action, s_repr, m_injected)
+    return m_processed, action, confirmed, lat_sanitize, lat_policy, lat_confirm
+
+def _write_episode(steps: StepBuffer, totals: EpisodeTotals, ep: int, m_injected: str, m_processed: str, records: List[tuple],
+                   timestamp: float, coded_info: bool = False):
+    """Record one finished episode's step tuples (StepBuffer.record arguments) and add it to totals."""
+    record = steps.record_coded if coded_info else steps.record
+    steps.begin_episode()
+    ep_reward = 0.0
+    for r in records:
+        record(*r)
+        totals.add_latency(r[8])
+        ep_reward += float(r[5])
+    steps.end_episode(ep, m_injected, m_processed, timestamp)
+    totals.add_episode(any(r[3] == TARGET_ACTION for r in records), ep_reward)
+
+def _run_episode_range_pool(attack: str, defense: str, ep_start: int, ep_stop: int, max_steps: int, seeds: EpisodeSeeds,
+                            sink: TrajectorySink, policy, workers: int, size: int = 4) -> Dict[str, Any]:
+    """
+    EnvPool implementation of _run_episode_range: environments step in `workers` processes,
+    decisions are made here. Episodes finish out of order; their steps are held until every
+    earlier episode has been recorded, so the log and results match the serial runner.
+    """
+    from envpool import EnvPool
+    n = ep_stop - ep_start
+    totals = EpisodeTotals()
+    if n == 0:
+        # EnvPool needs at least one env; an empty range has nothing to step
+        return {"totals": totals}
+    steps = StepBuffer(min(max_steps, GridWorld(size=size).max_steps), sink, attack, defense, attacks=ATTACKS, defenses=DEFENSES)
+    # queue index -> step tuples so far / (step tuples, m_injected, m_processed, end time) once finished
+    records: Dict[int, List[tuple]] = {}
+    pending: Dict[int, tuple] = {}
+    injected: Dict[int, str] = {}
+    next_q = 0
+    with EnvPool(min(n, POOL_ENVS_PER_WORKER * workers), workers, seeds.range(ep_start, ep_stop), size=size, max_steps=max_steps) as pool:
+        obs = pool.reset()
+        while pool.active.any():
+            actions = np.zeros(pool.num_envs, dtype=np.int64)
+            decisions = []
+            for i in np.flatnonzero(obs["episode"] >= 0).tolist():
+                q = int(obs["episode"][i])
+                red_box, red_button = tuple(obs["red_box"][i].tolist()), tuple(obs["red_button"][i].tolist())
+                s_repr = (tuple(obs["agent"][i].tolist()), (("red_box", red_box), ("red_button", red_button)))
+                m_original = perception_text(red_box, red_button)
+                if q not in injected:
+                    injected[q] = atk.inject(m_original, attack_type=attack, placement='append')
+                    records[q] = []
+                m_processed, action, confirmed, lat_sanitize, lat_policy, lat_confirm = _defended_decision(defense, policy, s_repr, injected[q])
+                latency = lat_sanitize + lat_policy + lat_confirm
+                actions[i] = ACTION_INDEX[action]
+                decisions.append((i, q, int(obs["step"][i]), s_repr, m_original, m_processed, action, confirmed, latency))
+            obs, reward, done, ended, info = pool.step(actions)
+            timestamp = time.time()
+            for i, q, step, s_repr, m_original, m_processed, action, confirmed, latency in decisions:
+                records[q].append((step, s_repr, m_original, action, confirmed, float(reward[i]), bool(done[i]), int(info[i]), latency))
+                if ended[i]:
+                    pending[q] = (records.pop(q), injected.pop(q), m_processed, timestamp)
+            while next_q in pending:
+                ep_records, m_injected, m_processed, ended_at = pending.pop(next_q)
+                _write_episode(steps, totals, ep_start + next_q, m_injected, m_processed, ep_records, ended_at, coded_info=True)
+                next_q += 1
+    steps.close()
+    return {"totals": totals}
+
+async def _llm_decision(defense: str, policy, s_repr, m_injected: str):
+    """_defended_decision with an awaitable policy (policy_s includes the wait for the batched request)."""
+    m_processed, lat_sanitize = _defense_input(defense, m_injected)
+    decision_start = time.perf_counter()
+    action = await policy(s_repr, m_processed)
+    lat_policy = time.perf_counter() - decision_start
+    action, confirmed, lat_confirm = _defense_output(defense, action, s_repr, m_injected)
+    return m_processed, action, confirmed, lat_sanitize, lat_policy, lat_confirm
+
+def _run_episode_range_llm(attack: str, defense: str, ep_start: int, ep_stop: int, max_steps: int, seeds: EpisodeSeeds,
+                           sink: TrajectorySink, llm: Dict[str, Any], size: int = 4) -> Dict[str, Any]:
+    """
+    Model-backed implementation of _run_episode_range: decisions come from an AsyncLLMPolicy
+    (see llm_policy.py) for the server at llm['url'], with up to llm['in_flight'] episodes
+    stepping concurrently as coroutines so that their decision requests are batched together.
+    Episodes are recorded in episode order once finished, so for the same decisions the log
+    and results match the serial runner (against MockLLMServer they match rule_based_policy).
+    """
+    import asyncio
+    from collections import deque
+    from llm_policy import AsyncLLMPolicy, ResponseCache
+    steps = StepBuffer(min(max_steps, GridWorld(size=size).max_steps), sink, attack, defense, attacks=ATTACKS, defenses=DEFENSES)
+    totals = EpisodeTotals()
+
+    async def episode(policy, ep: int):
+        env = GridWorld(size=size)
+        s_repr, m_original = env.reset(seed=seeds(ep))
+        m_injected = atk.inject(m_original, attack_type=attack, placement='append')
+        m_processed = m_injected
+        records = []
+        done = False
+        step = 0
+        while not done and step < max_steps:
+            m_processed, action, confirmed, lat_sanitize, lat_policy, lat_confirm = await _llm_decision(defense, policy, s_repr, m_injected)
+            (s_repr_next, m_next), reward, done, info = env.step(action)
+            records.append((step, s_repr, m_original, action, confirmed, reward, done, info, lat_sanitize + lat_policy + lat_confirm))
+            s_repr, m_original = s_repr_next, m_next
+            step += 1
+        return ep, m_injected, m_processed, records, time.time()
+
+    def write(ep: int, m_injected: str, m_processed: str, records: List[tuple], timestamp: float):
+        _write_episode(steps, totals, ep, m_injected, m_processed, records, timestamp)
+
+    async def run() -> Dict[str, Any]:
+        cache = ResponseCache(llm["cache"]) if llm["cache"] else None
+        policy = AsyncLLMPolicy(llm["url"], model=llm["model"], max_concurrency=llm["connections"], max_batch=llm["max_batch"], cache=cache)
+        window = deque()
+        try:
+            # awaiting the oldest episode keeps the later ones in flight
+            for ep in range(ep_start, ep_stop):
+                window.append(asyncio.create_task(episode(policy, ep)))
+                if len(window) >= llm["in_flight"]:
+                    write(*await window.popleft())
+            while window:
+                write(*await window.popleft())
+        finally:
+            for task in window:
+                task.cancel()
+            await policy.aclose()
+            if cache is not None:
+                cache.close()
+        return policy.stats()
+
+    stats = asyncio.run(run())
+    steps.close()
+    return {"totals": totals, "llm": stats}
+
+def _run_episode_range(attack: str, defense: str, ep_start: int, ep_stop: int, max_steps: int, seed_base: int, sink: TrajectorySink, vectorized: bool = False,
+                       policy_cache: int = 0, instrument: bool = False, fast_forward: bool = False, rle_rows: bool = False,
+                       seeding: str = "legacy", env_pool: int = 0, size: int = 4, llm: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """
+    Runs episodes ep_start..ep_stop-1 of one (attack, defense) configuration, streaming
+    per-step rows into sink.
+    Episode ep is always seeded with the same seed (seed_base + ep, or with seeding='spawn' the
+    ('sweep', env_config(size), ep) stream of root seed_base), so any split of the episode range
+    reproduces the same per-episode results. Episodes run on a size x size GridWorld.
+    With policy_cache > 0 decisions go through a CachedPolicy of that capacity.
+    With instrument=True per-stage latencies (inject, sanitize, policy, confirm, env_step) are
+    recorded into an Instrumentation; when False no extra timing calls are made.
+    Returns a partial result: an EpisodeTotals under "totals" (successes, reward sum, histogram
+    of per-step decision latencies), plus the cache counters under "policy_cache" and the
+    histograms under "instrument" when on. Its size does not grow with the episode count.
+    With fast_forward=True an episode whose step left the environment state unchanged is at a
+    fixed point: state, message and therefore action, reward and info repeat until the episode
+    ends, so the remaining steps are replayed without calling the policy, defenses or env.
+    Rewards are still added one step at a time, so results are bit-identical to full simulation;
+    replayed rows reuse the last measured decision_latency. rle_rows=True logs the replayed
+    steps as run-length rows (extra 'repeat' column = number of steps a row stands for).
+    With env_pool > 0 the environments step in an EnvPool of that many processes (same results;
+    not combinable with instrument or fast_forward).
+    With llm = {url, model, in_flight, max_batch, connections, cache} decisions come from a model
+    server instead of rule_based_policy (see _run_episode_range_llm).
+    """
+    rle_rows = rle_rows and fast_forward
+    stages = Instrumentation() if instrument else None
+    seeds = EpisodeSeeds(seed_base, seeding, "sweep", env_config(size))
+    if vectorized:
+        return _run_episode_range_vectorized(attack, defense, ep_start, ep_stop, max_steps, seeds, sink, instrument=stages,
+                                             fast_forward=fast_forward, rle_rows=rle_rows, size=size)
+    if llm is not None:
+        return _run_episode_range_llm(attack, defense, ep_start, ep_stop, max_steps, seeds, sink, llm, size=size)
+    policy = CachedPolicy(rule_based_policy, maxsize=policy_cache) if policy_cache > 0 else rule_based_policy
+    if env_pool > 0:
+        result = _run_episode_range_pool(attack, defense, ep_start, ep_stop, max_steps, seeds, sink, policy, env_pool, size=size)
+        if isinstance(policy, CachedPolicy):
+            result["policy_cache"] = policy.stats()
+        return result
+    if stages is not None:
+        rec_inject, rec_sanitize, rec_policy, rec_confirm, rec_step = (stages[s].record for s in ("inject", "sanitize", "policy", "confirm", "env_step"))
+    env = GridWorld(size=size)
+    # rows are recorded as integer-coded records and only turned into strings per flushed block
+    steps = StepBuffer(min(max_steps, env.max_steps), sink, attack, defense, rle_rows=rle_rows, attacks=ATTACKS, defenses=DEFENSES)
+    record = steps.record
+    totals = EpisodeTotals()
+    add_latency = totals.add_latency  # time per policy-decision (including defense)
+    decide = _defended_decision
+    for ep in range(ep_start, ep_stop):
+        s_repr, m_original = env.reset(seed=seeds(ep))
+        steps.begin_episode()
         done = False
         step = 0
         succeeded = False
         ep_reward = 0.0
 
         # Inject at start (simple design) — policy always sees injected m
+        if stages is not None:
+            t0 = time.perf_counter_ns()
         m_injected = atk.inject(m_original, attack_type=attack, placement='append')
+        if stages is not None:
+            rec_inject(time.perf_counter_ns() - t0)
+        m_processed = m_injected
 
         while not done and step < max_steps:
-            # Initialize m_processed for all cases
-            m_processed = m_injected  # Default case
-            
-            # apply defense pre-processing and measure its latency
-            if defense == "sanitize":
-                # measure sanitize latency
-                (m_processed), lat = dfn.measure_time(dfn.sanitize, m_injected)
-                decision_start = time.perf_counter()
-                action = rule_based_policy(s_repr, m_processed)
-                decision_end = time.perf_counter()
-                # combine latencies
-                total_decision_latency = lat + (decision_end - decision_start)
-                # no confirmation step
-                confirmed = True
-            elif defense == "confirm":
-                # don't sanitize; policy acts on injected m, then confirm if needed
-                decision_start = time.perf_counter()
-                action = rule_based_policy(s_repr, m_injected)
-                decision_end = time.perf_counter()
-                (confirmed), lat_confirm = dfn.measure_time(dfn.confirm, action, s_repr, m_injected)
-                total_decision_latency = (decision_end - decision_start) + lat_confirm
-                if not confirmed:
-                    # fallback: replace with NOOP (or alternative safe action)
-                    action = "NOOP"
-            else:  # defense == "none"
-                decision_start = time.perf_counter()
-                action = rule_based_policy(s_repr, m_injected)
-                decision_end = time.perf_counter()
-                total_decision_latency = (decision_end - decision_start)
-                confirmed = True  # No confirmation needed for "none" defense
+            # defense pre-processing, policy and confirmation, each timed
+            m_processed, action, confirmed, lat_sanitize, lat_policy, lat_confirm = decide(defense, policy, s_repr, m_injected)
+            total_decision_latency = lat_sanitize + lat_policy + lat_confirm
+            if stages is not None:
+                if defense == "sanitize":
+                    rec_sanitize(int(lat_sanitize * 1e9))
+                rec_policy(int(lat_policy * 1e9))
+                if defense == "confirm":
+                    rec_confirm(int(lat_confirm * 1e9))
 
-            (s_repr_next, m_next), reward, done, info = env.step(action)
-            timestamp = time.time()
-            rows.append({
-                "episode": ep,
-                "step": step,
-                "attack_type": attack,
-                "defense": defense,
-                "agent_pos": str(s_repr[0]),
-                "objects": str(s_repr[1]),
-                "m_original": m_original,
-                "m_injected": m_injected,
-                "m_processed": m_processed,
-                "action": action,
-                "confirmed": confirmed,
-                "reward": float(reward),
-                "done": bool(done),
-                "info": str(info),
-                "decision_latency": float(total_decision_latency),
-                "timestamp": timestamp
-            })
+            carrying = env.state.carrying
+            if stages is not None:
+                t0 = time.perf_counter_ns()
+                (s_repr_next, m_next), reward, done, info = env.step(action)
+                rec_step(time.perf_counter_ns() - t0)
+            else:
+                (s_repr_next, m_next), reward, done, info = env.step(action)
+            record(step, s_repr, m_original, action, confirmed, reward, done, info, total_decision_latency)
+            add_latency(total_decision_latency)
 
             if action == TARGET_ACTION:
                 succeeded = True
             ep_reward += float(reward)
+            settled = fast_forward and not done and s_repr_next == s_repr and env.state.carrying == carrying
             # advance
             s_repr, m_original = s_repr_next, m_next
             step += 1
 
-        episode_success.append(1 if succeeded else 0)
-        episode_rewards.append(ep_reward)
+            if settled:
+                remaining = min(max_steps, env.max_steps) - step
+                for first, count, run_done in _fast_forward_runs(step, remaining, env.max_steps, rle_rows):
+                    steps.repeat_last(first, run_done, count)
+                for _ in range(remaining):
+                    ep_reward += float(reward)
+                if remaining > 0:
+                    add_latency(total_decision_latency, remaining)
+                step += remaining
+                break
+
+        steps.end_episode(ep, m_injected, m_processed)
+        totals.add_episode(succeeded, ep_reward)
+    steps.close()
 
-    df = pd.DataFrame(rows)
-    out_csv = os.path.join(out_dir, f"raw_{attack}_{defense}.csv")
-    df.to_csv(out_csv, index=False)
+    result = {"totals": totals}
+    if isinstance(policy, CachedPolicy):
+        result["policy_cache"] = policy.stats()
+    if stages is not None:
+        result["instrument"] = stages
+    return result
 
-    asr = sum(episode_success) / len(episode_success) if len(episode_success) > 0 else 0.0
-    mean_reward = float(np.mean(episode_rewards)) if episode_rewards else 0.0
-    median_latency = float(np.median(df['decision_latency'])) if not df.empty else 0.0
+def _summarize_configuration(attack: str, defense: str, episodes: int, parts: List[Dict[str, Any]], out_csv: str) -> Dict[str, Any]:
+    """
+    Merge partial results into the summary dict; out_csv is the raw log path.
+    median_latency is read from the merged latency histogram (within about 3% of the exact median).
+    """
+    totals = EpisodeTotals()
+    for p in parts:
+        totals.merge(p["totals"])
+    asr = totals.successes / totals.episodes if totals.episodes > 0 else 0.0
+    mean_reward = totals.reward_sum / totals.episodes if totals.episodes > 0 else 0.0
+    median_latency = totals.latency.quantile(0.5) / 1e9 if totals.latency.count > 0 else 0.0
 
     summary = {
         "attack": attack,
@@ -132,67 +683,209 @@ def run_one_configuration(attack: str, defense: str, episodes: int, max_steps: i
         "median_latency": float(median_latency),
         "out_csv": out_csv
     }
+    cache_parts = [p["policy_cache"] for p in parts if "policy_cache" in p]
+    if cache_parts:
+        # counters of every shard's cache, summed (each worker unit starts with a cold cache)
+        for k in ("hits", "misses", "evictions"):
+            summary[f"policy_cache_{k}"] = sum(c[k] for c in cache_parts)
+        calls = summary["policy_cache_hits"] + summary["policy_cache_misses"]
+        summary["policy_cache_hit_rate"] = summary["policy_cache_hits"] / calls if calls > 0 else 0.0
+    llm_parts = [p["llm"] for p in parts if "llm" in p]
+    if llm_parts:
+        # model-server traffic of every shard, summed
+        for k in ("requests", "prompts_sent", "cache_hits", "shared", "retries"):
+            summary[f"llm_{k}"] = sum(c[k] for c in llm_parts)
+        summary["llm_mean_batch"] = summary["llm_prompts_sent"] / summary["llm_requests"] if summary["llm_requests"] else 0.0
+    instrumented = [p["instrument"] for p in parts if "instrument" in p]
+    if instrumented:
+        merged = Instrumentation()
+        for stages in instrumented:
+            merged.merge(stages)
+        summary.update(merged.summary())
     return summary
 
-def compute_fpr_for_defense(defense: str, episodes: int, max_steps: int, out_dir: str, seed_base: int = 1000) -> Dict[str, Any]:
+def run_one_configuration(attack: str, defense: str, episodes: int, max_steps: int, out_dir: str, seed_base: int = 0, vectorized: bool = False,
+                          raw_format: str = "csv", chunk_rows: int = DEFAULT_CHUNK_ROWS, policy_cache: int = 0, instrument: bool = False,
+                          fast_forward: bool = False, rle_rows: bool = False, seeding: str = "legacy", env_pool: int = 0,
+                          size: int = 4, llm: Dict[str, Any] | None = None) -> Dict[str, Any]:
     """
-    Computes defense False Positive Rate (FPR) on benign runs:
-    - Run benign (attack='none') with no defense -> baseline actions per episode
-    - Run benign with the defense -> compare whether defense altered action behavior
-    FPR = fraction of episodes where defense changed at least one action compared to baseline
+    Runs episodes for a single (attack, defense) configuration.
+    Returns a summary dict with ASR, mean_reward, avg_decision_latency, out_csv
+    With vectorized=True all episodes are stepped together on a VecGridWorld; results match
+    the per-episode loop exactly (decision_latency is then the batch time amortized per episode).
+    Per-step rows are streamed to raw_<attack>_<defense>.<raw_format> in chunks of chunk_rows.
+    policy_cache > 0 memoizes policy decisions (scalar path) and adds policy_cache_* counters.
+    instrument=True adds latency_<stage>_{p50,p90,p99,p99_9,max} columns (seconds).
+    fast_forward / rle_rows / seeding / env_pool / size / llm: see _run_episode_range.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    out_csv = sink_path(out_dir, f"raw_{attack}_{defense}", raw_format)
+    with open_sink(out_csv, raw_format, chunk_rows) as sink:
+        part = _run_episode_range(attack, defense, 0, episodes, max_steps, seed_base, sink, vectorized=vectorized,
+                                  policy_cache=policy_cache, instrument=instrument, fast_forward=fast_forward, rle_rows=rle_rows,
+                                  seeding=seeding, env_pool=env_pool, size=size, llm=llm)
+    return _summarize_configuration(attack, defense, episodes, [part], out_csv)
+
+def _fpr_divergence_vectorized(defenses: List[str], seeds: List[int] | None, max_steps: int,
+                               layouts: List[tuple] | None = None, size: int = 4) -> Dict[str, np.ndarray]:
+    """
+    VecGridWorld implementation of _fpr_divergence_range for the given seeds (or start layouts).
+    Returns defense -> (episodes,) int array of first divergent step (-1 = never diverged).
+    """
+    if layouts is not None:
+        n = len(layouts)
+        venv = VecGridWorld(n, size=size)
+        agent, red_box, red_button = venv.reset_layouts(np.array([l[0] for l in layouts], dtype=np.int64).reshape(n, 2),
+                                                        np.array([l[1] for l in layouts], dtype=np.int64).reshape(n, 2))
+    else:
+        n = len(seeds)
+        venv = VecGridWorld(n, size=size)
+        agent, red_box, red_button = venv.reset(seeds=seeds)
+    policy = table_policy(venv.size)
+    episodes_idx = np.arange(n)
+    m_original = venv.perceptions()
+    press = np.array([has_press_instruction(m) for m in m_original], dtype=bool)
+    # per defense: (processed messages, press mask, confirm table or None)
+    inputs = {d: _process_messages(d, m_original) for d in defenses}
+    first = {d: np.full(n, -1, dtype=np.int64) for d in defenses}
+    done = np.zeros(n, dtype=bool)
+    step = 0
+    while n and not done.any() and step < max_steps:
+        action = policy.batch(agent, red_box, red_button, press)
+        undecided = False
+        for d in defenses:
+            _, press_d, allowed_d = inputs[d]
+            action_d = policy.batch(agent, red_box, red_button, press_d)
+            if allowed_d is not None:
+                at_button = (agent == red_button).all(axis=1)
+                action_d = np.where(allowed_d[episodes_idx, action_d, at_button.astype(np.int64)], action_d, ACTION_INDEX["NOOP"])
+            first[d][(first[d] < 0) & (action_d != action)] = step
+            undecided |= bool((first[d] < 0).any())
+        if not undecided:
+            break
+        (agent, red_box, red_button), _, done, info = venv.step(action)
+        # a DROP moves the box, which changes the perception of that episode
+        dropped = np.flatnonzero(info["dropped"])
+        if dropped.size:
+            refreshed = venv.perceptions(dropped)
+            press[dropped] = [has_press_instruction(m) for m in refreshed]
+            for d in defenses:
+                _, prs, allw = _process_messages(d, refreshed)
+                inputs[d][1][dropped] = prs
+                if allw is not None:
+                    inputs[d][2][dropped] = allw
+        step += 1
+    return first
+
+def _fpr_divergence_range(defenses: List[str], ep_start: int, ep_stop: int, max_steps: int, seed_base: int = 1000,
+                          vectorized: bool = False, seeding: str = "legacy", size: int = 4) -> Dict[str, List[int]]:
     """
-    # baseline
-    base_rows = []
-    env = GridWorld(size=4)
-    baseline_actions_per_episode = []
-    for ep in range(episodes):
-        s_repr, m_original = env.reset(seed=seed_base + ep)
+    Benign baseline vs. defended runs for episodes ep_start..ep_stop-1 (seeded with seed_base + ep,
+    or with seeding='spawn' the ('fpr', env_config(size), ep) stream of root seed_base) on a size x size grid,
+    every defense compared against one shared baseline.
+    Returns defense -> per-episode index of the first step whose action differs from the baseline
+    (-1 if the defense never changed an action).
+    Until its first divergent action a defended run is in exactly the baseline's state, so a single
+    environment stepped with the baseline actions serves all defenses in lockstep; each defense
+    stops being evaluated at its divergence and the episode ends once every defense has diverged.
+    """
+    seeds = EpisodeSeeds(seed_base, seeding, "fpr", env_config(size))
+    if vectorized:
+        return {d: first.tolist() for d, first in _fpr_divergence_vectorized(defenses, seeds.range(ep_start, ep_stop), max_steps, size=size).items()}
+    env = GridWorld(size=size)
+    divergence = {d: [] for d in defenses}
+    for ep in range(ep_start, ep_stop):
+        s_repr, m_original = env.reset(seed=seeds(ep))
+        first = {d: -1 for d in defenses}
+        active = list(defenses)
         done = False
         step = 0
-        actions = []
-        while not done and step < max_steps:
+        while active and not done and step < max_steps:
             action = rule_based_policy(s_repr, m_original)
-            (s_repr_next, m_next), reward, done, info = env.step(action)
-            actions.append(action)
-            s_repr, m_original = s_repr_next, m_next
-            step += 1
-        baseline_actions_per_episode.append(actions)
-
-    # defense-run
-    def_rows = []
-    env = GridWorld(size=4)
-    defense_changed = []
-    for ep in range(episodes):
-        s_repr, m_original = env.reset(seed=seed_base + ep)
-        done = False
-        step = 0
-        actions_def = []
-        while not done and step < max_steps:
-            if defense == "sanitize":
-                m_proc = dfn.sanitize(m_original)
-                action = rule_based_policy(s_repr, m_proc)
-            elif defense == "confirm":
-                action = rule_based_policy(s_repr, m_original)
-                ok = dfn.confirm(action, s_repr, m_original)
-                if not ok:
-                    action = "NOOP"
-            else:
-                action = rule_based_policy(s_repr, m_original)
-            (s_repr_next, m_next), reward, done, info = env.step(action)
-            actions_def.append(action)
-            s_repr, m_original = s_repr_next, m_next
+            for defense in list(active):
+                if _defended_decision(defense, rule_based_policy, s_repr, m_original)[1] != action:
+                    first[defense] = step
+                    active.remove(defense)
+            (s_repr, m_original), reward, done, info = env.step(action)
             step += 1
-        # compare
-        changed = (actions_def != baseline_actions_per_episode[ep])
-        defense_changed.append(1 if changed else 0)
+        for d in defenses:
+            divergence[d].append(first[d])
+    return divergence
+
+def _fpr_result(defense: str, divergence_steps: List[int]) -> Dict[str, Any]:
+    changed = [1 if s >= 0 else 0 for s in divergence_steps]
+    fpr = sum(changed) / len(changed) if changed else 0.0
+    return {"defense": defense, "fpr": float(fpr), "divergence_steps": list(divergence_steps)}
+
+def compute_fpr_for_defenses(defenses: List[str], episodes: int, max_steps: int, out_dir: str, seed_base: int = 1000, vectorized: bool = False,
+                             seeding: str = "legacy", size: int = 4) -> List[Dict[str, Any]]:
+    """
+    Computes defense False Positive Rate (FPR) on benign runs:
+    - Run benign (attack='none') with no defense -> baseline actions per episode (once, shared by all defenses)
+    - Run benign with each defense in lockstep -> first step where the defense altered the action
+    FPR = fraction of episodes where defense changed at least one action compared to baseline
+    Returns one {"defense", "fpr", "divergence_steps"} dict per defense (divergence step -1 = unchanged).
+    """
+    divergence = _fpr_divergence_range(defenses, 0, episodes, max_steps, seed_base=seed_base, vectorized=vectorized, seeding=seeding,
+                                       size=size)
+    return [_fpr_result(d, divergence[d]) for d in defenses]
+
+def compute_fpr_for_defense(defense: str, episodes: int, max_steps: int, out_dir: str, seed_base: int = 1000, vectorized: bool = False,
+                            seeding: str = "legacy", size: int = 4) -> Dict[str, Any]:
+    """FPR of a single defense (see compute_fpr_for_defenses)."""
+    return compute_fpr_for_defenses([defense], episodes, max_steps, out_dir, seed_base=seed_base, vectorized=vectorized, seeding=seeding,
+                                    size=size)[0]
 
-    fpr = sum(defense_changed) / len(defense_changed) if defense_changed else 0.0
-    return {"defense": defense, "fpr": float(fpr)}
+def run_exact(max_steps: int, size: int = 4) -> tuple:
+    """
+    Exhaustive evaluation: instead of sampling seeds, step every start layout reset() can
+    produce (see env.layout_distribution) through every (attack, defense) pair at once and
+    weight each layout by its probability. Episodes are deterministic given their layout,
+    so ASR, mean_reward and FPR are the exact expectations over reset(), free of sampling noise.
+    Returns (summaries, fpr_results) in the same shape as the sampled sweep; 'episodes' is the
+    number of layouts and median_latency the batch decision time amortized per decision.
+    """
+    layouts, weights = layout_distribution(size)
+    total = weights.sum()
+    summaries = []
+    for attack in ATTACKS:
+        for defense in DEFENSES:
+            start = time.perf_counter()
+            sim = _simulate_vectorized(attack, defense, None, max_steps, record=False, layouts=layouts, size=size)
+            elapsed = time.perf_counter() - start
+            success = (sim["action"] == ACTION_INDEX[TARGET_ACTION]).any(axis=0)
+            summary = {
+                "attack": attack,
+                "defense": defense,
+                "episodes": len(layouts),
+                "asr": float(np.dot(weights, success) / total),
+                "mean_reward": float(np.dot(weights, _episode_rewards(sim)) / total),
+                "median_latency": elapsed / max(1, sim["steps"] * sim["episodes"]),
+                "out_csv": "",
+            }
+            print(f"   -> attack={attack} defense={defense} ASR={summary['asr']:.3f} mean_reward={summary['mean_reward']:.3f} (exact over {len(layouts)} layouts)")
+            summaries.append(summary)
+    fpr_results = []
+    fpr_defenses = [d for d in DEFENSES if d != "none"]
+    divergence = _fpr_divergence_vectorized(fpr_defenses, None, max_steps, layouts=layouts, size=size)
+    for defense in DEFENSES:
+        if defense == "none":
+            fpr_results.append({"defense": "none", "fpr": 0.0})
+        else:
+            changed = divergence[defense] >= 0
+            fpr_results.append({"defense": defense, "fpr": float(np.dot(weights, changed) / total),
+                                "divergence_steps": divergence[defense].tolist()})
+    return summaries, fpr_results
 
-def plot_grouped_asr(summary_df: pd.DataFrame, out_path: str):
+def plot_grouped_asr(summaries, out_path: str):
     """
     Create grouped bar chart: x-axis attack types; for each attack, grouped bars for defenses.
+    summaries: summary dicts or a DataFrame of them.
     """
+    # pandas and matplotlib take ~1s to import; load them only when a plot is drawn
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    summary_df = pd.DataFrame(summaries)
     attacks = sorted(summary_df['attack'].unique(), key=lambda x: ATTACKS.index(x) if x in ATTACKS else x)
     defenses = sorted(summary_df['defense'].unique(), key=lambda x: DEFENSES.index(x) if x in DEFENSES else x)
     # pivot table
@@ -208,47 +901,415 @@ def plot_grouped_asr(summary_df: pd.DataFrame, out_path: str):
     plt.savefig(out_path, dpi=150)
     plt.close()
 
+def _write_csv(path: str, rows: List[Dict[str, Any]], columns: List[str] | None = None):
+    """
+    Write dict rows as CSV, byte-compatible with pd.DataFrame(rows).to_csv(path, index=False)
+    for the scalar columns used here (missing values and NaN are written as empty fields).
+    """
+    if columns is None:
+        columns = list(dict.fromkeys(k for r in rows for k in r))
+    with open(path, "w", newline="") as fh:
+        writer = csv.writer(fh, lineterminator=os.linesep)
+        writer.writerow(columns)
+        for r in rows:
+            writer.writerow(["" if v is None or (isinstance(v, float) and math.isnan(v)) else v
+                             for v in (r.get(c) for c in columns)])
+
+def _episode_chunks(episodes: int, chunk_episodes: int) -> List[tuple]:
+    """Split range(episodes) into consecutive (ep_start, ep_stop) chunks."""
+    return [(s, min(s + chunk_episodes, episodes)) for s in range(0, episodes, chunk_episodes)]
+
+def _part_path(out_dir: str, attack: str, defense: str, ep_start: int, raw_format: str) -> str:
+    """Shard file a work unit streams its raw rows into (merged by run_sweep_parallel)."""
+    return sink_path(os.path.join(out_dir, ".parts"), f"raw_{attack}_{defense}.{ep_start:010d}", raw_format)
+
+def _run_work_unit(unit: tuple):
+    """
+    Process-pool entry point.
+    unit = (kind, key, ep_start, ep_stop, max_steps, seed_base, vectorized, out_dir, raw_format, chunk_rows, options)
+    where kind is 'config' (key = (attack, defense)) or 'fpr' (key = tuple of defenses sharing one baseline)
+    and options holds the remaining _run_episode_range keyword arguments (policy_cache, instrument, ...).
+    Returns (unit, partial result, throughput stats of this worker for the unit).
+    """
+    kind, key, ep_start, ep_stop, max_steps, seed_base, vectorized, out_dir, raw_format, chunk_rows, options = unit
+    start = time.perf_counter()
+    if kind == "config":
+        attack, defense = key
+        with open_sink(_part_path(out_dir, attack, defense, ep_start, raw_format), raw_format, chunk_rows) as sink:
+            result = _run_episode_range(attack, defense, ep_start, ep_stop, max_steps, seed_base, sink, vectorized=vectorized, **options)
+    else:
+        result = _fpr_divergence_range(list(key), ep_start, ep_stop, max_steps, seed_base=seed_base, vectorized=vectorized,
+                                       seeding=options["seeding"], size=options["size"])
+    stats = {"worker": os.getpid(), "episodes": ep_stop - ep_start, "seconds": time.perf_counter() - start}
+    return unit, result, stats
+
+def _run_options(args) -> Dict[str, Any]:
+    """_run_episode_range keyword options selected on the command line."""
+    options = {"policy_cache": args.policy_cache, "instrument": args.instrument,
+               "fast_forward": args.fast_forward or args.rle_rows, "rle_rows": args.rle_rows, "seeding": args.seeding,
+               "env_pool": args.env_pool, "size": args.size}
+    if args.llm_url:
+        options["llm"] = {"url": args.llm_url, "model": args.llm_model, "in_flight": args.llm_in_flight,
+                          "max_batch": args.llm_max_batch, "connections": args.llm_connections, "cache": args.llm_cache}
+    return options
+
+def _fpr_seed_base(args) -> int:
+    """Root seed of the FPR pass: legacy seeding offsets it by 1000, spawned streams are keyed apart instead."""
+    return args.seed + 1000 if args.seeding == "legacy" else args.seed
+
+def sweep_units(args, out_dir: str, configs: List[tuple], fpr_defenses: List[str]) -> tuple:
+    """
+    Work units (see _run_work_unit) of a sharded sweep, their raw shards going to out_dir/.parts.
+    args.chunk_episodes episodes per unit, or with 0 about 4 units per args.workers.
+    Returns (units, chunk).
+    """
+    chunk = args.chunk_episodes
+    if chunk <= 0:
+        # aim for ~4 units per worker so stragglers don't leave cores idle
+        total_units = 4 * args.workers
+        chunk = max(1, -(-args.episodes * max(1, len(configs) + bool(fpr_defenses)) // total_units))
+    units = []
+    for attack, defense in configs:
+        for ep_start, ep_stop in _episode_chunks(args.episodes, chunk):
+            units.append(("config", (attack, defense), ep_start, ep_stop, args.max_steps, args.seed, args.vectorized,
+                          out_dir, args.raw_format, args.chunk_rows, _run_options(args)))
+    if fpr_defenses:
+        for ep_start, ep_stop in _episode_chunks(args.episodes, chunk):
+            units.append(("fpr", tuple(fpr_defenses), ep_start, ep_stop, args.max_steps, _fpr_seed_base(args), args.vectorized,
+                          out_dir, args.raw_format, args.chunk_rows, _run_options(args)))
+    return units, chunk
+
+def merge_sweep(args, out_dir: str, configs: List[tuple], fpr_defenses: List[str], chunk: int, parts: Dict[Any, List[Any]],
+                parts_root: str | None = None) -> tuple:
+    """
+    Concatenate the raw shards (under parts_root/.parts, default out_dir) into out_dir and merge
+    the partial results, parts[(kind, key)] = results of that cell's units in episode order.
+    Returns (summaries in configs order, fpr_results in fpr_defenses order).
+    """
+    parts_root = parts_root or out_dir
+    summaries = []
+    for attack, defense in configs:
+        out_csv = sink_path(out_dir, f"raw_{attack}_{defense}", args.raw_format)
+        shards = [_part_path(parts_root, attack, defense, ep_start, args.raw_format) for ep_start, _ in _episode_chunks(args.episodes, chunk)]
+        concat_files(shards, out_csv, args.raw_format)
+        summary = _summarize_configuration(attack, defense, args.episodes, parts.get(("config", (attack, defense)), []), out_csv)
+        print(f"   -> attack={attack} defense={defense} ASR={summary['asr']:.3f} mean_reward={summary['mean_reward']:.3f} median_latency={summary['median_latency']:.4f}s")
+        summaries.append(summary)
+    if os.path.isdir(os.path.join(parts_root, ".parts")) and not os.listdir(os.path.join(parts_root, ".parts")):
+        os.rmdir(os.path.join(parts_root, ".parts"))
+    fpr_results = []
+    for defense in fpr_defenses:
+        steps = [s for part in parts.get(("fpr", tuple(fpr_defenses)), []) for s in part[defense]]
+        fpr_results.append(_fpr_result(defense, steps))
+    return summaries, fpr_results
+
+def run_sweep_parallel(args, out_dir: str, configs: List[tuple] | None = None, fpr_defenses: List[str] | None = None):
+    """
+    Shard the (attack, defense) configurations and FPR passes (default: all of them) into episode
+    ranges and run them on a process pool of args.workers processes. Episodes keep their serial
+    seeds (see --seeding) and partial results are merged in episode order, so summary.csv and
+    defense_fpr.csv match a serial run (median_latency is a wall-clock measurement and varies
+    between any two runs).
+    Returns (summaries in configs order, fpr_results in fpr_defenses order, worker_stats rows).
+    """
+    if configs is None:
+        configs = [(a, d) for a in ATTACKS for d in DEFENSES]
+    if fpr_defenses is None:
+        fpr_defenses = [d for d in DEFENSES if d != "none"]
+    units, chunk = sweep_units(args, out_dir, configs, fpr_defenses)
+    print(f"[+] Running {len(units)} work units ({chunk} episodes each) on {args.workers} workers")
+
+    from concurrent.futures import ProcessPoolExecutor  # ~25ms; serial runs never need it
+    parts: Dict[Any, List[Any]] = {}
+    per_worker: Dict[int, Dict[str, Any]] = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # map() yields in submission order, so parts are appended in episode order
+        for unit, result, stats in pool.map(_run_work_unit, units):
+            parts.setdefault((unit[0], unit[1]), []).append(result)
+            w = per_worker.setdefault(stats["worker"], {"worker": stats["worker"], "units": 0, "episodes": 0, "busy_seconds": 0.0})
+            w["units"] += 1
+            w["episodes"] += stats["episodes"]
+            w["busy_seconds"] += stats["seconds"]
+
+    summaries, fpr_results = merge_sweep(args, out_dir, configs, fpr_defenses, chunk, parts)
+    worker_stats = []
+    for w in sorted(per_worker.values(), key=lambda w: w["worker"]):
+        w["episodes_per_s"] = w["episodes"] / w["busy_seconds"] if w["busy_seconds"] > 0 else 0.0
+        worker_stats.append(w)
+    return summaries, fpr_results, worker_stats
+
+def run_sweep_adaptive(args, out_dir: str, configs: List[tuple], fpr_defenses: List[str]):
+    """
+    Adaptive-budget sweep (see adaptive.py): batches of args.batch_episodes episodes go to the
+    cell (an (attack, defense) configuration, or the FPR pass) whose ASR/FPR Wilson interval is
+    widest, until every cell's interval is narrower than args.ci_width or the total budget of
+    args.episodes per cell is spent. Batches extend each cell's episode range, so episodes keep
+    their fixed-budget seeds and rows append to the cell's raw log in episode order.
+    Summaries gain episodes_used and asr_ci_low/asr_ci_high, FPR results episodes_used and
+    fpr_ci_low/fpr_ci_high ('episodes' stays the nominal per-cell budget).
+    Returns (summaries in configs order, fpr_results in fpr_defenses order).
+    """
+    from adaptive import AdaptiveBudget
+    cells = [("config", c) for c in configs] + ([("fpr", tuple(fpr_defenses))] if fpr_defenses else [])
+    budget = AdaptiveBudget(cells, args.episodes * len(cells), args.batch_episodes, args.ci_width, args.ci_level,
+                            min_episodes=args.min_episodes)
+    print(f"[+] Adaptive budget: {args.episodes * len(cells)} episodes over {len(cells)} cells, "
+          f"batches of {args.batch_episodes}, target {args.ci_level:.0%} interval width {args.ci_width}")
+    parts: Dict[Any, List[Any]] = {cell: [] for cell in cells}
+    out_paths = {c: sink_path(out_dir, f"raw_{c[0]}_{c[1]}", args.raw_format) for c in configs}
+    sinks = {}
+    try:
+        while (batch := budget.next_batch()) is not None:
+            cell, ep_start, ep_stop = batch
+            kind, key = cell
+            if kind == "config":
+                if key not in sinks:
+                    sinks[key] = open_sink(out_paths[key], args.raw_format, args.chunk_rows)
+                part = _run_episode_range(key[0], key[1], ep_start, ep_stop, args.max_steps, args.seed, sinks[key],
+                                          vectorized=args.vectorized, **_run_options(args))
+                successes = [part["totals"].successes]
+            else:
+                part = _fpr_divergence_range(list(key), ep_start, ep_stop, args.max_steps, seed_base=_fpr_seed_base(args),
+                                             vectorized=args.vectorized, seeding=args.seeding, size=args.size)
+                successes = [sum(1 for s in part[d] if s >= 0) for d in key]
+            parts[cell].append(part)
+            budget.update(cell, ep_stop - ep_start, successes)
+            if budget.done(cell):
+                lo, hi = budget.interval(cell)
+                print(f"   -> {kind} {'/'.join(key)} settled after {budget.episodes(cell)} episodes (first interval [{lo:.3f}, {hi:.3f}])")
+    finally:
+        for sink in sinks.values():
+            sink.close()
+    used = sum(budget.episodes(c) for c in cells)
+    print(f"[+] Adaptive budget used {used} of {args.episodes * len(cells)} episodes")
+
+    summaries = []
+    for attack, defense in configs:
+        cell = ("config", (attack, defense))
+        if (attack, defense) not in sinks:
+            # a cell that never ran (zero budget) still gets an empty log
+            open_sink(out_paths[(attack, defense)], args.raw_format, args.chunk_rows).close()
+        summary = _summarize_configuration(attack, defense, args.episodes, parts[cell], out_paths[(attack, defense)])
+        lo, hi = budget.interval(cell)
+        summary.update(episodes_used=budget.episodes(cell), asr_ci_low=lo, asr_ci_high=hi)
+        print(f"   -> attack={attack} defense={defense} episodes={budget.episodes(cell)} ASR={summary['asr']:.3f} "
+              f"[{lo:.3f}, {hi:.3f}] mean_reward={summary['mean_reward']:.3f}")
+        summaries.append(summary)
+    fpr_results = []
+    if fpr_defenses:
+        cell = ("fpr", tuple(fpr_defenses))
+        for i, defense in enumerate(fpr_defenses):
+            r = _fpr_result(defense, [s for part in parts[cell] for s in part[defense]])
+            lo, hi = budget.interval(cell, i)
+            r.update(episodes_used=budget.episodes(cell), fpr_ci_low=lo, fpr_ci_high=hi)
+            fpr_results.append(r)
+    return summaries, fpr_results
+
+_CODE_HASHES: Dict[str, str] = {}
+
+def _code_hashes() -> Dict[str, str]:
+    """Source hashes that key the result cache (computed once per process)."""
+    if not _CODE_HASHES:
+        import envpool
+        # per defense, only the definitions it reaches: editing one defense keeps the others' cells
+        for defense, entry_points in dfn.DEFENSE_ENTRY_POINTS.items():
+            _CODE_HASHES[f"defense:{defense}"] = definition_hash(dfn, *entry_points)
+        _CODE_HASHES["inject"] = hashlib.sha256(inspect.getsource(atk.inject).encode()).hexdigest()
+        _CODE_HASHES["code"] = source_hash(gridenv, policies, perception, policy_table, trajectory, instrumentation, seeding, envpool, step_buffer, sys.modules[__name__])
+    return _CODE_HASHES
+
+def _cell_key(args, kind: str, attack: str, defense: str) -> str:
+    """
+    Result-cache key of one sweep cell: kind 'config' (summary + raw log of (attack, defense))
+    or 'fpr' (benign FPR of defense). Changing the attack payload, the code of this cell's
+    defense (see dfn.DEFENSE_ENTRY_POINTS), the policy/env/runner code or any run parameter
+    gives a new key; edits to another defense do not.
+    """
+    hashes = _code_hashes()
+    fields = {
+        "kind": kind,
+        "attack": attack,
+        "attack_payload": atk.ATTACK_TEMPLATES[attack],
+        "inject": hashes["inject"],
+        "defense": defense,
+        "defense_source": hashes[f"defense:{defense}"] if defense != "none" else "",
+        "code": hashes["code"],
+        "episodes": args.episodes,
+        "max_steps": args.max_steps,
+    }
+    if kind == "config":
+        fields.update(seed=args.seed, raw_format=args.raw_format, vectorized=args.vectorized, **_run_options(args))
+    else:
+        fields.update(seed=_fpr_seed_base(args), seeding=args.seeding, size=args.size)
+    return ResultCache.key(**fields)
+
 def main(args):
+    if args.llm_mock_latency_ms is not None and not args.llm_url:
+        from llm_policy import MockLLMServer
+        with MockLLMServer(latency_ms=args.llm_mock_latency_ms) as server:
+            print(f"[+] Local mock model server on {server.url} (latency {args.llm_mock_latency_ms} ms)")
+            args.llm_url = server.url
+            try:
+                return main(args)
+            finally:
+                args.llm_url = ""
     out_dir = args.out_dir
     os.makedirs(out_dir, exist_ok=True)
-    all_summaries = []
-    # iterate attack x defense
-    for attack in ATTACKS:
-        for defense in DEFENSES:
-            print(f"[+] Running attack={attack} defense={defense} episodes={args.episodes}")
-            summary = run_one_configuration(attack, defense, episodes=args.episodes, max_steps=args.max_steps, out_dir=out_dir, seed_base=args.seed)
-            print(f"   -> ASR={summary['asr']:.3f} mean_reward={summary['mean_reward']:.3f} median_latency={summary['median_latency']:.4f}s")
-            all_summaries.append(summary)
+    configs = [(a, d) for a in ATTACKS for d in DEFENSES]
+    fpr_defenses = [d for d in DEFENSES if d != "none"]
+    cache = ResultCache(args.cache_dir) if args.cache_dir and not args.exact else None
+    summaries: Dict[tuple, Dict[str, Any]] = {}
+    fprs: Dict[str, Dict[str, Any]] = {}
+    if cache is not None:
+        for attack, defense in configs:
+            out_csv = sink_path(out_dir, f"raw_{attack}_{defense}", args.raw_format)
+            record = cache.get(_cell_key(args, "config", attack, defense), restore_to=out_csv)
+            if record is not None:
+                record["out_csv"] = out_csv
+                summaries[(attack, defense)] = record
+        for defense in fpr_defenses:
+            record = cache.get(_cell_key(args, "fpr", "none", defense))
+            if record is not None:
+                fprs[defense] = record
+        configs = [c for c in configs if c not in summaries]
+        fpr_defenses = [d for d in fpr_defenses if d not in fprs]
+        print(f"[+] Result cache {args.cache_dir}: {cache.hits} cells reused, {len(configs) + len(fpr_defenses)} to run")
+        for attack, defense in configs:
+            # cached raw logs are hard-linked into out_dir; never truncate one in place
+            out_csv = sink_path(out_dir, f"raw_{attack}_{defense}", args.raw_format)
+            if os.path.exists(out_csv):
+                os.remove(out_csv)
 
-    summary_df = pd.DataFrame(all_summaries)
+    if args.exact:
+        print(f"[+] Exact evaluation over every start layout (max_steps={args.max_steps})")
+        all_summaries, fpr_results = run_exact(args.max_steps, size=args.size)
+    else:
+        if args.adaptive:
+            new_summaries, new_fprs = run_sweep_adaptive(args, out_dir, configs, fpr_defenses)
+        elif args.workers > 1 and (configs or fpr_defenses):
+            new_summaries, new_fprs, worker_stats = run_sweep_parallel(args, out_dir, configs, fpr_defenses)
+            stats_csv = os.path.join(out_dir, "worker_stats.csv")
+            _write_csv(stats_csv, worker_stats)
+            print(f"[+] Saved worker throughput to {stats_csv}")
+        else:
+            new_summaries = []
+            # iterate attack x defense
+            for attack, defense in configs:
+                print(f"[+] Running attack={attack} defense={defense} episodes={args.episodes}")
+                summary = run_one_configuration(attack, defense, episodes=args.episodes, max_steps=args.max_steps, out_dir=out_dir, seed_base=args.seed,
+                                                vectorized=args.vectorized, raw_format=args.raw_format, chunk_rows=args.chunk_rows,
+                                                **_run_options(args))
+                print(f"   -> ASR={summary['asr']:.3f} mean_reward={summary['mean_reward']:.3f} median_latency={summary['median_latency']:.4f}s")
+                new_summaries.append(summary)
+            # Compute FPR for defenses on benign runs (one shared baseline)
+            new_fprs = []
+            if fpr_defenses:
+                print(f"[+] Computing FPR for defenses={','.join(fpr_defenses)} (benign runs)")
+                new_fprs = compute_fpr_for_defenses(fpr_defenses, episodes=args.episodes, max_steps=args.max_steps, out_dir=out_dir,
+                                                    seed_base=_fpr_seed_base(args), vectorized=args.vectorized, seeding=args.seeding,
+                                                    size=args.size)
+        for (attack, defense), summary in zip(configs, new_summaries):
+            summaries[(attack, defense)] = summary
+            if cache is not None:
+                cache.put(_cell_key(args, "config", attack, defense), summary, artifact=summary["out_csv"])
+        for defense, r in zip(fpr_defenses, new_fprs):
+            fprs[defense] = r
+            if cache is not None:
+                cache.put(_cell_key(args, "fpr", "none", defense), r)
+        # canonical order, whichever cells came from the cache
+        all_summaries = [summaries[(a, d)] for a in ATTACKS for d in DEFENSES]
+        fpr_results = [{"defense": "none", "fpr": 0.0} if d == "none" else fprs[d] for d in DEFENSES]
+    write_outputs(args, out_dir, all_summaries, fpr_results)
+
+def write_outputs(args, out_dir: str, all_summaries: List[Dict[str, Any]], fpr_results: List[Dict[str, Any]]):
+    """summary.csv, the ASR plot, defense_fpr.csv, fpr_divergence.csv and the optional results-database record."""
     summary_csv = os.path.join(out_dir, "summary.csv")
-    summary_df.to_csv(summary_csv, index=False)
+    _write_csv(summary_csv, all_summaries)
     print(f"[+] Saved summary to {summary_csv}")
 
     # Plot grouped ASR
-    asr_plot = os.path.join(out_dir, "asr_by_attack_defense.png")
-    plot_grouped_asr(summary_df, asr_plot)
-    print(f"[+] Saved ASR plot to {asr_plot}")
+    if not args.no_plot:
+        asr_plot = os.path.join(out_dir, "asr_by_attack_defense.png")
+        plot_grouped_asr(all_summaries, asr_plot)
+        print(f"[+] Saved ASR plot to {asr_plot}")
 
-    # Compute FPR for defenses on benign runs
-    fpr_results = []
-    for defense in DEFENSES:
-        if defense == "none":
-            fpr_results.append({"defense": "none", "fpr": 0.0})
-        else:
-            print(f"[+] Computing FPR for defense={defense} (benign runs)")
-            r = compute_fpr_for_defense(defense, episodes=args.episodes, max_steps=args.max_steps, out_dir=out_dir, seed_base=args.seed + 1000)
-            fpr_results.append(r)
-    fpr_df = pd.DataFrame(fpr_results)
     fpr_csv = os.path.join(out_dir, "defense_fpr.csv")
-    fpr_df.to_csv(fpr_csv, index=False)
+    # defense, fpr (+ episodes_used and the interval in adaptive runs)
+    _write_csv(fpr_csv, [{k: v for k, v in r.items() if k != "divergence_steps"} for r in fpr_results])
     print(f"[+] Saved FPR (benign) to {fpr_csv}")
+    # per-episode step of the first action each defense changed (-1 = none)
+    divergence_csv = os.path.join(out_dir, "fpr_divergence.csv")
+    _write_csv(divergence_csv, [{"defense": r["defense"], "episode": ep, "divergence_step": s}
+                                for r in fpr_results for ep, s in enumerate(r.get("divergence_steps", []))],
+               columns=["defense", "episode", "divergence_step"])
+    print(f"[+] Saved FPR divergence steps to {divergence_csv}")
 
-if __name__ == "__main__":
+    if args.results_db:
+        from results_db import ResultsDB
+        with ResultsDB(args.results_db) as db:
+            run_id = db.add_run(out_dir, vars(args), all_summaries, [{"defense": r["defense"], "fpr": r["fpr"]} for r in fpr_results])
+            rows = 0
+            if args.db_steps and not args.exact:
+                for summary in all_summaries:
+                    rows += db.ingest_steps(run_id, summary["out_csv"], args.chunk_rows)
+        print(f"[+] Recorded run {run_id} in {args.results_db}" + (f" ({rows} step rows)" if rows else ""))
+
+def build_parser() -> argparse.ArgumentParser:
+    """Command-line options of a sweep (also parsed by sweep_queue.py)."""
     parser = argparse.ArgumentParser()
     parser.add_argument("--episodes", type=int, default=30)
     parser.add_argument("--max_steps", type=int, default=50)
+    parser.add_argument("--size", type=int, default=4, help="side of the square grid")
     parser.add_argument("--out_dir", type=str, default="results/day3")
     parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--seeding", type=str, default="legacy", choices=SEEDING_SCHEMES,
+                        help="episode seeds: legacy = seed + episode (FPR: seed + 1000 + episode); spawn = independent SeedSequence streams keyed by (experiment, config, episode)")
+    parser.add_argument("--vectorized", action="store_true", help="step all episodes of a configuration together on VecGridWorld")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (1 = serial)")
+    parser.add_argument("--chunk_episodes", type=int, default=0, help="episodes per work unit with --workers (0 = auto)")
+    parser.add_argument("--raw_format", type=str, default="csv", choices=SINK_FORMATS, help="format of the raw per-step logs")
+    parser.add_argument("--chunk_rows", type=int, default=DEFAULT_CHUNK_ROWS, help="steps buffered before each raw-log flush")
+    parser.add_argument("--exact", action="store_true", help="evaluate every start layout exactly instead of sampling --episodes seeds (no raw logs)")
+    parser.add_argument("--instrument", action="store_true", help="record per-stage latency histograms and report percentiles in summary.csv")
+    parser.add_argument("--cache_dir", type=str, default="", help="reuse unchanged sweep cells from this content-addressed result cache (empty = off)")
+    parser.add_argument("--fast_forward", action="store_true", help="replay the remaining steps of episodes stuck at a fixed point instead of simulating them")
+    parser.add_argument("--rle_rows", action="store_true", help="log fast-forwarded steps as run-length rows with a 'repeat' column (implies --fast_forward)")
+    parser.add_argument("--no_plot", "--no-plot", action="store_true", help="skip the ASR plot (pandas/matplotlib are then never imported)")
+    parser.add_argument("--results_db", type=str, default="", help="also record this run's summaries and FPR in a SQLite results database")
+    parser.add_argument("--db_steps", action="store_true", help="with --results_db, bulk-insert the per-step raw logs too")
+    parser.add_argument("--env_pool", type=int, default=0, help="step environments in an EnvPool of this many processes (0 = in-process)")
+    parser.add_argument("--policy_cache", type=int, default=0, help="memoize policy decisions in an LRU of this many entries (0 = off)")
+    parser.add_argument("--llm_url", type=str, default="", help="take attack-run decisions from the model server at this URL (see llm_policy.py; the FPR pass stays rule-based)")
+    parser.add_argument("--llm_mock_latency_ms", type=float, default=None, help="without --llm_url, serve decisions from a local mock model server with this latency")
+    parser.add_argument("--llm_model", type=str, default="mock-rule-based", help="model name sent to the server (part of the response-cache key)")
+    parser.add_argument("--llm_in_flight", type=int, default=64, help="episodes stepping concurrently against the model server")
+    parser.add_argument("--llm_max_batch", type=int, default=32, help="decision prompts per model-server request")
+    parser.add_argument("--llm_connections", type=int, default=8, help="concurrent requests (pooled keep-alive connections) to the model server")
+    parser.add_argument("--llm_cache", type=str, default="", help="persistent SQLite response cache for model decisions (empty = off)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="adaptive budgets: run cells in batches until their ASR/FPR interval is narrower than --ci_width (total budget: --episodes per cell)")
+    parser.add_argument("--ci_width", type=float, default=0.1, help="target width of the Wilson interval with --adaptive")
+    parser.add_argument("--ci_level", type=float, default=0.95, help="confidence level of the interval with --adaptive")
+    parser.add_argument("--batch_episodes", type=int, default=50, help="episodes per batch with --adaptive")
+    parser.add_argument("--min_episodes", type=int, default=50, help="episodes a cell runs at least before it may stop with --adaptive")
+    return parser
+
+def check_args(parser: argparse.ArgumentParser, args):
+    """Reject option combinations the runners do not support."""
+    if args.policy_cache > 0 and args.vectorized:
+        parser.error("--policy_cache wraps the per-episode policy and cannot be combined with --vectorized")
+    if args.env_pool > 0 and (args.vectorized or args.instrument or args.fast_forward or args.rle_rows):
+        parser.error("--env_pool cannot be combined with --vectorized, --instrument, --fast_forward or --rle_rows")
+    if (args.llm_url or args.llm_mock_latency_ms is not None) and (args.vectorized or args.env_pool > 0 or args.instrument or args.fast_forward
+                                                                   or args.rle_rows or args.policy_cache > 0 or args.cache_dir
+                                                                   or args.exact):
+        parser.error("--llm_url / --llm_mock_latency_ms cannot be combined with --vectorized, --env_pool, --instrument, --fast_forward, "
+                     "--rle_rows, --policy_cache, --cache_dir or --exact")
+    if args.adaptive and (args.workers > 1 or args.exact or args.cache_dir):
+        parser.error("--adaptive runs serially and cannot be combined with --workers, --exact or --cache_dir")
+
+if __name__ == "__main__":
+    parser = build_parser()
     args = parser.parse_args()
+    check_args(parser, args)
     main(args)
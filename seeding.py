@@ -0,0 +1,59 @@
+# seeding.py
+"""
+Per-episode seeds from a root seed and a (experiment, config, episode) key.
+
+The historical scheme seeds episode ep with seed_base + ep and separates experiments by
+offsetting seed_base (the FPR pass uses seed + 1000), so the seed ranges of different
+experiments overlap as soon as a run has more episodes than the offset. The 'spawn'
+scheme derives each episode's seed from numpy.random.SeedSequence(root) with spawn_key
+(experiment, config, episode): every key gets its own well-mixed stream, nothing depends
+on episode counts or on which episodes ran before, and any subset of episodes can be
+computed on any worker, in any order, with bit-identical results.
+
+Provides:
+- SEEDING_SCHEMES: 'legacy' (seed_base + ep, the default) and 'spawn'
+- spawn_seed(root, experiment, config, episode): 63-bit seed of one episode
+- EpisodeSeeds(root, scheme, experiment, config): seed of each episode of one stream
+"""
+import hashlib
+from typing import List
+
+import numpy as np
+
+SEEDING_SCHEMES = ["legacy", "spawn"]
+
+def _key_word(key: str | int) -> int:
+    """spawn_key entries must be non-negative ints; names map to a stable 32-bit word."""
+    if isinstance(key, int):
+        if key < 0:
+            raise ValueError(f"spawn keys must be non-negative, got {key}")
+        return key
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:4], "little")
+
+def spawn_seed(root: int, experiment: str | int, config: str | int, episode: int) -> int:
+    """Seed of one episode: the first 63 bits of SeedSequence(root, spawn_key=(experiment, config, episode))."""
+    ss = np.random.SeedSequence(root, spawn_key=(_key_word(experiment), _key_word(config), _key_word(episode)))
+    return int(ss.generate_state(1, np.uint64)[0] >> np.uint64(1))
+
+class EpisodeSeeds:
+    """
+    Seeds of the episodes of one (experiment, config) stream: seeds(ep) -> int.
+    scheme='legacy' returns root + ep (experiment and config are ignored);
+    scheme='spawn' returns spawn_seed(root, experiment, config, ep).
+    """
+    def __init__(self, root: int, scheme: str = "legacy", experiment: str = "sweep", config: str = "default"):
+        if scheme not in SEEDING_SCHEMES:
+            raise ValueError(f"Unknown seeding scheme: {scheme}")
+        self.root = root
+        self.scheme = scheme
+        self.experiment = experiment
+        self.config = config
+
+    def __call__(self, episode: int) -> int:
+        if self.scheme == "legacy":
+            return self.root + episode
+        return spawn_seed(self.root, self.experiment, self.config, episode)
+
+    def range(self, start: int, stop: int) -> List[int]:
+        """Seeds of episodes start..stop-1."""
+        return [self(ep) for ep in range(start, stop)]
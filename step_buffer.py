@@ -0,0 +1,181 @@
+# step_buffer.py
+"""
+Preallocated, integer-coded step buffer for the per-episode runners.
+
+Building a 16-key row dict per step and str()-ing the agent position, the objects tuple and
+the info dict cost more than the rest of a step once the policy is cheap, and every row
+kept ~0.5 KB of Python objects alive until the sink flushed. StepBuffer instead records
+each step into one record of a preallocated NumPy structured array (STEP_DTYPE, a block of
+episodes x max_steps records): positions packed as x << 8 | y, actions and info as small
+integer codes, messages as ids into a StringTable. The per-step fields lead the record
+and are written by a single struct.pack_into; episode-constant fields (episode, attack,
+defense, injected and processed message, and the timestamp, now taken once per episode
+when it ends rather than once per step) are filled for the whole episode at its end.
+Strings are materialized only by columns(), once per distinct value, when the block is
+handed to a TrajectorySink, so the raw logs are byte-identical to the row-dict runner.
+
+Provides:
+- STEP_DTYPE: record layout; pack_pos(pos) / unpack_pos(code)
+- INFO_STRINGS: str(info) of each info code (0 = {})
+- StringTable: string -> int32 id, strings(ids) -> object array
+- StepBuffer(max_steps, sink, attack, defense, ...): begin_episode(), record(...) / record_coded(...), repeat_last(),
+  end_episode(), close()
+"""
+import struct
+import time
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from env import ACTIONS, ACTION_INDEX
+from trajectory import TrajectorySink
+
+# per-step fields first: one struct.pack_into writes them (no padding on either side)
+_STEP_FIELDS = [("step", "<i4"), ("agent", "<u2"), ("red_box", "<u2"), ("red_button", "<u2"), ("m_original", "<i4"),
+                ("action", "i1"), ("confirmed", "?"), ("done", "?"), ("info", "i1"), ("repeat", "<i4"),
+                ("reward", "<f8"), ("decision_latency", "<f8")]
+_EPISODE_FIELDS = [("episode", "<i8"), ("timestamp", "<f8"), ("attack", "i1"), ("defense", "i1"), ("m_injected", "<i4"),
+                   ("m_processed", "<i4")]
+STEP_DTYPE = np.dtype(_STEP_FIELDS + _EPISODE_FIELDS)
+_PACK = struct.Struct("<iHHHib??bi" + "dd")
+assert _PACK.size == STEP_DTYPE.fields["episode"][1]
+
+INFO_KEYS = ("picked", "dropped", "pressed")
+INFO_STRINGS = ["{}"] + [str({k: True}) for k in INFO_KEYS]
+_INFO_CODE = {k: i + 1 for i, k in enumerate(INFO_KEYS)}
+_ACTION_NAMES = np.array(ACTIONS, dtype=object)
+_INFO_STRING_ARRAY = np.array(INFO_STRINGS, dtype=object)
+
+# raw-log columns in the order the row-dict runner wrote them ('repeat' only for run-length logs)
+RAW_COLUMNS = ("episode", "step", "attack_type", "defense", "agent_pos", "objects", "m_original", "m_injected", "m_processed",
+               "action", "confirmed", "reward", "done", "info", "decision_latency", "timestamp")
+
+def pack_pos(pos) -> int:
+    return pos[0] << 8 | pos[1]
+
+def unpack_pos(code: int) -> tuple:
+    return (code >> 8, code & 0xFF)
+
+class StringTable:
+    """Interns strings as int32 ids (id = insertion order)."""
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def id(self, s: str) -> int:
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.values)
+            self.values.append(s)
+        return i
+
+    def strings(self, ids: np.ndarray) -> np.ndarray:
+        return np.array(self.values, dtype=object)[ids]
+
+def _decode(codes: np.ndarray, fmt) -> np.ndarray:
+    """fmt(code) for every entry, calling fmt once per distinct code."""
+    uniq, inverse = np.unique(codes, return_inverse=True)
+    return np.array([fmt(int(c)) for c in uniq], dtype=object)[inverse]
+
+def _objects_text(code: int) -> str:
+    return str((("red_box", unpack_pos(code >> 16)), ("red_button", unpack_pos(code & 0xFFFF))))
+
+class StepBuffer:
+    """
+    Step records of consecutive episodes of one (attack, defense) configuration, flushed to
+    sink in blocks of whole episodes (about sink.chunk_rows records, at least one episode).
+    Positions must fit in 8 bits per coordinate (grids up to 256 x 256).
+    """
+    def __init__(self, max_steps: int, sink: TrajectorySink, attack: str, defense: str, rle_rows: bool = False,
+                 attacks: Sequence[str] = (), defenses: Sequence[str] = ()):
+        self.sink = sink
+        self.max_steps = max(1, max_steps)
+        self.capacity = max(sink.chunk_rows // self.max_steps, 1) * self.max_steps
+        self.buf = np.zeros(self.capacity, dtype=STEP_DTYPE)
+        # the structured array and the bytes pack_into writes to are the same memory
+        self._raw = self.buf.view(np.uint8).data.cast("B")
+        self.messages = StringTable()
+        self.attack, self.defense = attack, defense
+        self.attack_code = list(attacks).index(attack) if attack in attacks else 0
+        self.defense_code = list(defenses).index(defense) if defense in defenses else 0
+        self.rle_rows = rle_rows
+        self.n = 0
+        self._episode_start = 0
+        self.record = self._recorder()
+        # same with info already an info code (EnvPool observations)
+        self.record_coded = self._recorder(coded_info=True)
+
+    def _recorder(self, coded_info: bool = False):
+        """record(step, s_repr, m_original, action, confirmed, reward, done, info, decision_latency) bound to this buffer."""
+        pack, raw, itemsize = _PACK.pack_into, self._raw, STEP_DTYPE.itemsize
+        message_ids, intern, action_index, info_code = self.messages.ids, self.messages.id, ACTION_INDEX, _INFO_CODE
+
+        def record(step: int, s_repr, m_original: str, action: str, confirmed: bool, reward: float, done: bool,
+                   info: Dict[str, Any], decision_latency: float):
+            # s_repr = (agent_pos, (('red_box', pos), ('red_button', pos)))
+            agent, ((_, box), (_, button)) = s_repr
+            m_id = message_ids.get(m_original)
+            if m_id is None:
+                m_id = intern(m_original)
+            n = self.n
+            pack(raw, n * itemsize, step, agent[0] << 8 | agent[1], box[0] << 8 | box[1], button[0] << 8 | button[1], m_id,
+                 action_index[action], confirmed, done, info if coded_info else (info_code[next(iter(info))] if info else 0), 1,
+                 reward, decision_latency)
+            self.n = n + 1
+        return record
+
+    def begin_episode(self):
+        if self.n + self.max_steps > self.capacity:
+            self.flush()
+        self._episode_start = self.n
+
+    def repeat_last(self, step: int, done: bool, repeat: int = 1):
+        """Copy of the previous record with another step index, done flag and repeat count (fast-forwarded steps)."""
+        rec = self.buf[self.n - 1].copy()
+        rec["step"], rec["done"], rec["repeat"] = step, done, repeat
+        self.buf[self.n] = rec
+        self.n += 1
+
+    def end_episode(self, episode: int, m_injected: str, m_processed: str, timestamp: float | None = None):
+        """Fill the episode-constant fields of the records since begin_episode() (timestamp default: now)."""
+        rows = self.buf[self._episode_start:self.n]
+        rows["episode"] = episode
+        rows["timestamp"] = time.time() if timestamp is None else timestamp
+        rows["attack"] = self.attack_code
+        rows["defense"] = self.defense_code
+        rows["m_injected"] = self.messages.id(m_injected)
+        rows["m_processed"] = self.messages.id(m_processed)
+
+    def columns(self, start: int = 0, stop: int | None = None) -> Dict[str, Any]:
+        """Raw-log columns (strings materialized) of records start..stop-1."""
+        rows = self.buf[start:self.n if stop is None else stop]
+        cols: Dict[str, Any] = {
+            "episode": rows["episode"],
+            "step": rows["step"],
+            "attack_type": self.attack,
+            "defense": self.defense,
+            "agent_pos": _decode(rows["agent"], lambda c: str(unpack_pos(c))),
+            "objects": _decode(rows["red_box"].astype(np.int64) << 16 | rows["red_button"], _objects_text),
+            "m_original": self.messages.strings(rows["m_original"]),
+            "m_injected": self.messages.strings(rows["m_injected"]),
+            "m_processed": self.messages.strings(rows["m_processed"]),
+            "action": _ACTION_NAMES[rows["action"]],
+            "confirmed": rows["confirmed"],
+            "reward": rows["reward"],
+            "done": rows["done"],
+            "info": _INFO_STRING_ARRAY[rows["info"]],
+            "decision_latency": rows["decision_latency"],
+            "timestamp": rows["timestamp"],
+        }
+        if self.rle_rows:
+            cols["repeat"] = rows["repeat"]
+        return cols
+
+    def flush(self):
+        if self.n:
+            self.sink.write_columns(self.columns())
+        self.n = 0
+        self._episode_start = 0
+
+    def close(self):
+        self.flush()
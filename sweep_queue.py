@@ -0,0 +1,454 @@
+# sweep_queue.py
+"""
+Distributed sweeps over a shared-filesystem work queue.
+
+A coordinator splits a sweep (every attack x defense cell and the FPR pass, for one or more
+grid sizes) into episode-range work units, the same units run_experiments --workers runs on
+a local process pool, and publishes them as files in a queue directory that every node
+mounts. Workers on any node claim units, run them and publish their partial results; a
+merge step then builds the usual raw logs, summary.csv and defense_fpr.csv.
+
+Queue layout:
+
+    QUEUE/sweep.json            sweep options, grid sizes, unit ids (written last by publish)
+    QUEUE/units/<id>.json       one work unit
+    QUEUE/claims/<id>           lease of the worker running <id> (mtime = last heartbeat)
+    QUEUE/done/<id>.pkl         partial result of <id>
+    QUEUE/failed/<id>.json      error of a unit whose run raised (delete it to retry the unit)
+    QUEUE/size_<n>/.parts/      raw-log shards of grid size n
+    QUEUE/tmp/                  per-worker staging area
+
+A claim is created with O_CREAT | O_EXCL, so exactly one worker wins it, and holds a random
+owner token. The owner touches its claim every lease/3 seconds, only while the file still
+holds its token; a claim whose mtime has not moved for a full lease (as timed by the
+observing worker's own clock, so clock skew between nodes does not matter) is expired and
+can be taken over: it is renamed away (atomic, one winner) and claimed anew.
+An owner that lost its claim this way notices the foreign token and stops touching it, and
+when it finishes it leaves the new owner's claim in place.
+Results and shards are staged privately and moved into place with os.replace, done file
+last, so a unit is either absent or complete. Units therefore run at least once; if a slow
+owner finishes after losing its lease both copies are bit-identical and either one wins.
+A unit whose run raises gets a failure record and its claim is released at once. The worker
+re-raises the error. Every other worker stops with an error the next time it scans the queue,
+so nobody waits out the failed unit's lease or runs it again.
+
+Usage:
+    python sweep_queue.py publish /shared/q --sizes 4 6 8 -- --episodes 1000000 --chunk_episodes 20000
+    python sweep_queue.py work /shared/q               # on every node, as many times as it has cores
+    python sweep_queue.py status /shared/q
+    python sweep_queue.py merge /shared/q --out_dir results/big
+    python sweep_queue.py local /tmp/q --workers 4 -- --episodes 300 --out_dir results/q   # all of it on this host
+
+Provides:
+- publish(queue_dir, args, sizes): write the work units of a sweep
+- work(queue_dir, worker_id, lease_s, poll_s, max_units): claim and run units until none are left
+- merge(queue_dir, out_dir): summaries, FPR and raw logs of a finished queue
+- status(queue_dir): unit counts (total, done, running, expired, failed, waiting)
+- run_local(queue_dir, args, sizes, workers, out_dir): publish, run local worker processes, merge
+"""
+import argparse
+import json
+import os
+import pickle
+import socket
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Dict, List, Sequence
+
+import run_experiments as rex
+
+SWEEP_FILE = "sweep.json"
+DEFAULT_LEASE_S = 60.0
+DEFAULT_POLL_S = 1.0
+# sweep options a queue cannot honour
+_UNSUPPORTED = ("exact", "cache_dir")
+
+def _atomic_write(path: str, data: bytes, tmp_dir: str):
+    tmp = os.path.join(tmp_dir, f"{os.path.basename(path)}.{uuid.uuid4().hex}")
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+def _size_root(queue_dir: str, size: int) -> str:
+    return os.path.join(queue_dir, f"size_{size}")
+
+def _unit_id(size: int, unit: tuple) -> str:
+    kind, key, ep_start = unit[0], unit[1], unit[2]
+    name = "-".join(key) if kind == "config" else "fpr"
+    return f"{size}.{name}.{ep_start:010d}"
+
+def _load_unit(unit: List[Any]) -> tuple:
+    """JSON turns the unit tuple and its key into lists; restore them."""
+    unit = list(unit)
+    unit[1] = tuple(unit[1])
+    return tuple(unit)
+
+def _sweep_args(spec: Dict[str, Any], size: int) -> argparse.Namespace:
+    return argparse.Namespace(**dict(spec["args"], size=size))
+
+def _configs():
+    configs = [(a, d) for a in rex.ATTACKS for d in rex.DEFENSES]
+    fpr_defenses = [d for d in rex.DEFENSES if d != "none"]
+    return configs, fpr_defenses
+
+def publish(queue_dir: str, args: argparse.Namespace, sizes: Sequence[int] | None = None) -> List[str]:
+    """
+    Write the work units of the sweep described by args (run_experiments options; --workers
+    only sizes the units when --chunk_episodes is 0) for each grid size in sizes (default
+    args.size). Refuses a directory that already holds a sweep. Returns the unit ids.
+    """
+    for name in _UNSUPPORTED:
+        if getattr(args, name):
+            raise ValueError(f"--{name} is not supported by the work queue")
+    if os.path.exists(os.path.join(queue_dir, SWEEP_FILE)):
+        raise FileExistsError(f"{queue_dir} already holds a sweep")
+    sizes = list(sizes or [args.size])
+    for sub in ("units", "claims", "done", "failed", "tmp"):
+        os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+    configs, fpr_defenses = _configs()
+    ids, chunks = [], {}
+    for size in sizes:
+        size_args = argparse.Namespace(**dict(vars(args), size=size))
+        units, chunks[size] = rex.sweep_units(size_args, _size_root(queue_dir, size), configs, fpr_defenses)
+        for unit in units:
+            uid = _unit_id(size, unit)
+            _atomic_write(os.path.join(queue_dir, "units", f"{uid}.json"), json.dumps(unit).encode(), os.path.join(queue_dir, "tmp"))
+            ids.append(uid)
+    spec = {"args": vars(args), "sizes": sizes, "chunks": {str(s): c for s, c in chunks.items()}, "units": ids, "created": time.time()}
+    # workers wait for this file, so they never see a half-published sweep
+    _atomic_write(os.path.join(queue_dir, SWEEP_FILE), json.dumps(spec, indent=1).encode(), os.path.join(queue_dir, "tmp"))
+    print(f"[+] Published {len(ids)} work units for sizes {sizes} to {queue_dir}")
+    return ids
+
+def _load_spec(queue_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(queue_dir, SWEEP_FILE)) as fh:
+        return json.load(fh)
+
+def _claim_token(fh) -> str | None:
+    """Owner token of an open claim file (None while the claim is still being written)."""
+    try:
+        return json.load(fh).get("token")
+    except ValueError:
+        return None
+
+class _Lease:
+    """Claim file of one unit, kept alive by a heartbeat thread while the unit runs."""
+    def __init__(self, path: str, lease_s: float, token: str):
+        self.path = path
+        self.lease_s = lease_s
+        self.token = token
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def _beat(self):
+        while not self._stop.wait(self.lease_s / 3):
+            try:
+                with open(self.path) as fh:
+                    # touch the file whose token was checked, even if the path is replaced meanwhile
+                    if _claim_token(fh) == self.token:
+                        os.utime(fh.fileno())
+                        continue
+            except FileNotFoundError:
+                pass
+            # taken over after a missed heartbeat; finishing is still correct (same result)
+            self.lost = True
+            return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+class _Worker:
+    def __init__(self, queue_dir: str, worker_id: str, lease_s: float):
+        self.queue_dir = queue_dir
+        self.worker_id = worker_id
+        self.lease_s = lease_s
+        # claim id -> (mtime last seen, local time it was first seen with that mtime)
+        self._seen: Dict[str, tuple] = {}
+        # claim id -> owner token of the claims this worker made
+        self._tokens: Dict[str, str] = {}
+        self.staging = os.path.join(queue_dir, "tmp", worker_id)
+
+    def _path(self, sub: str, uid: str, ext: str = "") -> str:
+        return os.path.join(self.queue_dir, sub, uid + ext)
+
+    def pending(self, ids: Sequence[str]) -> List[str]:
+        done = {name[:-4] for name in os.listdir(os.path.join(self.queue_dir, "done"))}
+        return [uid for uid in ids if uid not in done]
+
+    def failed(self, ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """Failure records of the given units, uid -> {"worker", "host", "error", "traceback"}."""
+        return _failures(self.queue_dir, ids)
+
+    def _expired(self, uid: str) -> bool:
+        try:
+            mtime = os.stat(self._path("claims", uid)).st_mtime
+        except FileNotFoundError:
+            return False
+        now = time.monotonic()
+        seen = self._seen.get(uid)
+        if seen is None or seen[0] != mtime:
+            self._seen[uid] = (mtime, now)
+            return False
+        return now - seen[1] > self.lease_s
+
+    def try_claim(self, uid: str) -> bool:
+        path = self._path("claims", uid)
+        if os.path.exists(path):
+            if not self._expired(uid):
+                return False
+            try:
+                # one worker wins the rename; the others see FileNotFoundError
+                os.rename(path, f"{path}.expired.{self.worker_id}")
+                os.remove(f"{path}.expired.{self.worker_id}")
+            except FileNotFoundError:
+                return False
+            print(f"[!] {self.worker_id}: lease of {uid} expired, taking it over")
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        token = uuid.uuid4().hex
+        with os.fdopen(fd, "w") as fh:
+            json.dump({"worker": self.worker_id, "host": socket.gethostname(), "pid": os.getpid(), "claimed": time.time(),
+                       "token": token}, fh)
+        self._tokens[uid] = token
+        return True
+
+    def release(self, uid: str):
+        """Remove the claim of uid if it is still this worker's (not a newer owner's after a takeover)."""
+        token = self._tokens.pop(uid, None)
+        path = self._path("claims", uid)
+        # move it out of the way first, so a takeover cannot slip in between the check and the removal
+        mine = f"{path}.release.{self.worker_id}"
+        try:
+            os.rename(path, mine)
+        except FileNotFoundError:
+            return
+        with open(mine) as fh:
+            owned = _claim_token(fh) == token
+        if not owned:
+            # a newer owner's claim: put it back unless yet another claim appeared meanwhile
+            try:
+                os.link(mine, path)
+            except FileExistsError:
+                pass
+        os.remove(mine)
+
+    def run(self, uid: str):
+        with open(self._path("units", uid, ".json")) as fh:
+            unit = _load_unit(json.load(fh))
+        out_dir = unit[7]
+        os.makedirs(self.staging, exist_ok=True)
+        lease = _Lease(self._path("claims", uid), self.lease_s, self._tokens[uid])
+        try:
+            with lease:
+                staged = unit[:7] + (self.staging,) + unit[8:]
+                _, result, stats = rex._run_work_unit(staged)
+                if unit[0] == "config":
+                    attack, defense = unit[1]
+                    final = rex._part_path(out_dir, attack, defense, unit[2], unit[8])
+                    os.makedirs(os.path.dirname(final), exist_ok=True)
+                    os.replace(rex._part_path(self.staging, attack, defense, unit[2], unit[8]), final)
+                stats.update(worker=self.worker_id, host=socket.gethostname())
+                _atomic_write(self._path("done", uid, ".pkl"), pickle.dumps((result, stats)), self.staging)
+        except Exception as exc:
+            # record it before the claim goes, so no other worker picks the unit up in between
+            record = {"worker": self.worker_id, "host": socket.gethostname(), "error": repr(exc), "traceback": traceback.format_exc()}
+            os.makedirs(os.path.join(self.queue_dir, "failed"), exist_ok=True)
+            _atomic_write(self._path("failed", uid, ".json"), json.dumps(record, indent=1).encode(), self.staging)
+            print(f"[!] {self.worker_id}: {uid} failed: {exc!r}")
+            raise
+        finally:
+            # released on success and on failure (including interrupts) so nobody waits out the lease
+            self.release(uid)
+        if lease.lost:
+            print(f"[!] {self.worker_id}: finished {uid} after its lease had been taken over")
+
+def _failures(queue_dir: str, ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    failed_dir = os.path.join(queue_dir, "failed")
+    # queues published before failure records existed have no failed/ directory
+    names = set(os.listdir(failed_dir)) if os.path.isdir(failed_dir) else set()
+    failures = {}
+    for uid in ids:
+        if f"{uid}.json" in names:
+            try:
+                with open(os.path.join(failed_dir, f"{uid}.json")) as fh:
+                    failures[uid] = json.load(fh)
+            except FileNotFoundError:
+                # deleted for a retry since the listing
+                pass
+    return failures
+
+def work(queue_dir: str, worker_id: str | None = None, lease_s: float = DEFAULT_LEASE_S, poll_s: float = DEFAULT_POLL_S,
+         max_units: int | None = None) -> int:
+    """
+    Claim and run units of the queue until every unit is done (waiting on units other workers
+    hold, and taking over expired ones), or until max_units were run. Returns units run.
+    Raises when a unit this worker runs raises, or RuntimeError once any unit has failed.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    while not os.path.exists(os.path.join(queue_dir, SWEEP_FILE)):
+        time.sleep(poll_s)
+    ids = _load_spec(queue_dir)["units"]
+    worker = _Worker(queue_dir, worker_id, lease_s)
+    # start scanning at a worker-dependent offset so workers rarely race for the same claim
+    offset = int.from_bytes(worker_id.encode()[-4:], "little") % max(1, len(ids))
+    done = 0
+    while max_units is None or done < max_units:
+        pending = worker.pending(ids[offset:] + ids[:offset])
+        if not pending:
+            break
+        failed = worker.failed(pending)
+        if failed:
+            uid, record = next(iter(failed.items()))
+            raise RuntimeError(f"{len(failed)} units failed (first: {uid} on {record['worker']}: {record['error']}); "
+                               f"see {os.path.join(queue_dir, 'failed')}")
+        for uid in pending:
+            if worker.try_claim(uid):
+                start = time.perf_counter()
+                worker.run(uid)
+                done += 1
+                print(f"[+] {worker_id}: {uid} done in {time.perf_counter() - start:.2f}s")
+                break
+        else:
+            time.sleep(poll_s)
+    return done
+
+def status(queue_dir: str, lease_s: float = DEFAULT_LEASE_S) -> Dict[str, int]:
+    """
+    Unit counts: total, done, running (claimed), expired (claim older than lease_s by mtime),
+    failed (run raised, see QUEUE/failed), waiting.
+    """
+    ids = _load_spec(queue_dir)["units"]
+    done = {name[:-4] for name in os.listdir(os.path.join(queue_dir, "done"))}
+    failed = set(_failures(queue_dir, [uid for uid in ids if uid not in done]))
+    now = time.time()
+    running = expired = 0
+    for uid in ids:
+        if uid in done or uid in failed:
+            continue
+        try:
+            age = now - os.stat(os.path.join(queue_dir, "claims", uid)).st_mtime
+        except FileNotFoundError:
+            continue
+        if age > lease_s:
+            expired += 1
+        else:
+            running += 1
+    n_done = sum(uid in done for uid in ids)
+    return {"total": len(ids), "done": n_done, "running": running, "expired": expired, "failed": len(failed),
+            "waiting": len(ids) - n_done - running - expired - len(failed)}
+
+def merge(queue_dir: str, out_dir: str | None = None) -> Dict[int, tuple]:
+    """
+    Build the outputs of a finished queue: raw logs, summary.csv, defense_fpr.csv,
+    fpr_divergence.csv and worker_stats.csv in out_dir (default: the sweep's --out_dir), or in
+    out_dir/size_<n> for each grid size when the sweep has several. Consumes the raw shards.
+    Returns size -> (summaries, fpr_results).
+    """
+    spec = _load_spec(queue_dir)
+    missing = [uid for uid in spec["units"] if not os.path.exists(os.path.join(queue_dir, "done", f"{uid}.pkl"))]
+    if missing:
+        failed = _failures(queue_dir, missing)
+        detail = f", {len(failed)} failed (see {os.path.join(queue_dir, 'failed')})" if failed else ""
+        raise RuntimeError(f"{len(missing)} of {len(spec['units'])} units are not done yet (first: {missing[0]}){detail}")
+    out_dir = out_dir or spec["args"]["out_dir"]
+    configs, fpr_defenses = _configs()
+    outputs = {}
+    per_worker: Dict[str, Dict[str, Any]] = {}
+    for size in spec["sizes"]:
+        args = _sweep_args(spec, size)
+        size_out = out_dir if len(spec["sizes"]) == 1 else os.path.join(out_dir, f"size_{size}")
+        os.makedirs(size_out, exist_ok=True)
+        parts: Dict[Any, List[Any]] = {}
+        # unit ids are listed in episode order within each cell
+        for uid in spec["units"]:
+            if not uid.startswith(f"{size}."):
+                continue
+            with open(os.path.join(queue_dir, "units", f"{uid}.json")) as fh:
+                unit = _load_unit(json.load(fh))
+            with open(os.path.join(queue_dir, "done", f"{uid}.pkl"), "rb") as fh:
+                result, stats = pickle.load(fh)
+            parts.setdefault((unit[0], unit[1]), []).append(result)
+            w = per_worker.setdefault(stats["worker"], {"worker": stats["worker"], "host": stats["host"], "units": 0, "episodes": 0, "busy_seconds": 0.0})
+            w["units"] += 1
+            w["episodes"] += stats["episodes"]
+            w["busy_seconds"] += stats["seconds"]
+        print(f"[+] Merging size {size} into {size_out}")
+        summaries, fprs = rex.merge_sweep(args, size_out, configs, fpr_defenses, spec["chunks"][str(size)], parts,
+                                          parts_root=_size_root(queue_dir, size))
+        fpr_results = [{"defense": "none", "fpr": 0.0}] + fprs
+        rex.write_outputs(args, size_out, summaries, fpr_results)
+        outputs[size] = (summaries, fpr_results)
+    worker_stats = []
+    for w in sorted(per_worker.values(), key=lambda w: w["worker"]):
+        w["episodes_per_s"] = w["episodes"] / w["busy_seconds"] if w["busy_seconds"] > 0 else 0.0
+        worker_stats.append(w)
+    stats_csv = os.path.join(out_dir, "worker_stats.csv")
+    rex._write_csv(stats_csv, worker_stats)
+    print(f"[+] Saved worker throughput to {stats_csv}")
+    return outputs
+
+def run_local(queue_dir: str, args: argparse.Namespace, sizes: Sequence[int] | None, workers: int, out_dir: str | None = None,
+              lease_s: float = DEFAULT_LEASE_S, poll_s: float = 0.1) -> Dict[int, tuple]:
+    """Publish the sweep, run it with `workers` local worker processes standing in for nodes, and merge."""
+    import multiprocessing as mp
+    publish(queue_dir, args, sizes)
+    procs = [mp.Process(target=work, args=(queue_dir, f"local-{i}", lease_s, poll_s)) for i in range(workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    return merge(queue_dir, out_dir)
+
+def _sweep_options(argv: List[str]) -> argparse.Namespace:
+    if argv and argv[0] == "--":
+        argv = argv[1:]
+    parser = rex.build_parser()
+    args = parser.parse_args(argv)
+    rex.check_args(parser, args)
+    return args
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a sweep over a shared-filesystem work queue")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_publish = sub.add_parser("publish", help="write the work units of a sweep")
+    p_work = sub.add_parser("work", help="claim and run units until none are left")
+    p_status = sub.add_parser("status", help="print unit counts")
+    p_merge = sub.add_parser("merge", help="write summary.csv / defense_fpr.csv / raw logs of a finished queue")
+    p_local = sub.add_parser("local", help="publish, run --workers local worker processes, merge")
+    for p in (p_publish, p_work, p_status, p_merge, p_local):
+        p.add_argument("queue_dir", type=str)
+    for p in (p_publish, p_local):
+        p.add_argument("--sizes", type=int, nargs="+", default=None, help="grid sizes to sweep (default: the sweep's --size)")
+    for p in (p_work, p_status, p_local):
+        p.add_argument("--lease", type=float, default=DEFAULT_LEASE_S, help="seconds without a heartbeat before a claim expires")
+    p_work.add_argument("--poll", type=float, default=DEFAULT_POLL_S, help="seconds between scans when every pending unit is claimed")
+    p_work.add_argument("--worker_id", type=str, default=None)
+    p_work.add_argument("--max_units", type=int, default=None, help="exit after this many units")
+    for p in (p_merge, p_local):
+        p.add_argument("--out_dir", type=str, default=None, help="output directory (default: the sweep's --out_dir)")
+    p_local.add_argument("--workers", type=int, default=2, help="local worker processes")
+    # everything after "--" (or not recognised here) is a run_experiments option of the sweep
+    args, sweep_argv = parser.parse_known_args()
+    if sweep_argv and args.command not in ("publish", "local"):
+        parser.error(f"unrecognized arguments: {' '.join(sweep_argv)}")
+    if args.command == "publish":
+        publish(args.queue_dir, _sweep_options(sweep_argv), args.sizes)
+    elif args.command == "work":
+        n = work(args.queue_dir, args.worker_id, args.lease, args.poll, args.max_units)
+        print(f"[+] Ran {n} units")
+    elif args.command == "status":
+        print("  ".join(f"{k}={v}" for k, v in status(args.queue_dir, args.lease).items()))
+    elif args.command == "merge":
+        merge(args.queue_dir, args.out_dir)
+    else:
+        run_local(args.queue_dir, _sweep_options(sweep_argv), args.sizes, args.workers, args.out_dir, args.lease)
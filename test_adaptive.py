@@ -0,0 +1,113 @@
+# test_adaptive.py
+"""
+Tests for adaptive budgets: Wilson interval bounds and coverage, AdaptiveBudget's allocation
+(widest interval first, retiring settled cells, never exceeding the budget), and an adaptive
+sweep whose cells are prefixes of a fixed-budget run.
+Run with: python -m pytest -q
+"""
+import csv
+import math
+import os
+
+import pytest
+
+from adaptive import AdaptiveBudget, wilson_interval
+from test_run_experiments import read_outputs, run_sweep
+
+def test_wilson_interval_bounds():
+    assert wilson_interval(0, 0) == (0.0, 1.0)
+    assert wilson_interval(0, 10) == pytest.approx((0.0, 0.2775), abs=1e-4)
+    assert wilson_interval(5, 10) == pytest.approx((0.2366, 0.7634), abs=1e-4)
+    assert wilson_interval(10, 10) == pytest.approx((0.7225, 1.0), abs=1e-4)
+    for n in (1, 7, 50, 400):
+        for s in range(n + 1):
+            lo, hi = wilson_interval(s, n)
+            assert 0.0 <= lo <= s / n <= hi <= 1.0
+            # symmetric in successes and failures
+            assert wilson_interval(n - s, n) == pytest.approx((1 - hi, 1 - lo), abs=1e-12)
+            wide_lo, wide_hi = wilson_interval(s, n, confidence=0.99)
+            assert wide_lo <= lo and hi <= wide_hi
+    # width shrinks like 1 / sqrt(n)
+    widths = [hi - lo for lo, hi in (wilson_interval(n // 2, n) for n in (100, 400, 1600, 6400))]
+    assert widths == sorted(widths, reverse=True)
+    assert widths[-1] == pytest.approx(widths[0] / 8, rel=0.02)
+
+@pytest.mark.parametrize("p", [0.05, 0.3, 0.5])
+def test_wilson_interval_coverage(p):
+    n = 200
+    covered = 0.0
+    for s in range(n + 1):
+        lo, hi = wilson_interval(s, n)
+        if lo <= p <= hi:
+            covered += math.comb(n, s) * p ** s * (1 - p) ** (n - s)
+    assert 0.93 <= covered <= 0.97
+
+def _simulate(budget: AdaptiveBudget, rates):
+    """Run a budget to the end with deterministic outcomes (success rate rates[cell]); returns its batches."""
+    batches, successes = [], {c: 0 for c in rates}
+    while (batch := budget.next_batch()) is not None:
+        cell, start, stop = batch
+        total = round(rates[cell] * stop)
+        budget.update(cell, stop - start, [total - successes[cell]])
+        successes[cell] = total
+        batches.append(batch)
+    return batches
+
+def test_budget_goes_to_the_widest_interval():
+    rates = {"never": 0.0, "always": 1.0, "coin": 0.5, "rare": 0.1}
+    budget = AdaptiveBudget(list(rates), total_episodes=4 * 300, batch_episodes=25, target_width=0.08, min_episodes=50)
+    batches = _simulate(budget, rates)
+    # unsampled cells go first, in cell order
+    assert [b[0] for b in batches[:4]] == list(rates)
+    # every cell covers consecutive episode ranges from 0
+    for cell in rates:
+        ranges = [(a, b) for c, a, b in batches if c == cell]
+        assert ranges[0][0] == 0 and all(b == a2 for (_, b), (a2, _) in zip(ranges, ranges[1:]))
+        assert ranges[-1][1] == budget.episodes(cell)
+        assert budget.done(cell) and budget.width(cell) <= 0.08
+        lo, hi = budget.interval(cell)
+        assert lo <= rates[cell] <= hi
+    # pinned cells stop at min_episodes; the uncertain ones get several times a fixed share
+    assert budget.episodes("never") == budget.episodes("always") == 50
+    assert 300 < budget.episodes("coin") and budget.episodes("rare") < budget.episodes("coin")
+    assert sum(budget.episodes(c) for c in rates) == 4 * 300 - budget.remaining < 4 * 300
+
+def test_budget_is_never_exceeded():
+    rates = {"never": 0.0, "coin": 0.5, "rare": 0.1}
+    budget = AdaptiveBudget(list(rates), total_episodes=3 * 100, batch_episodes=40, target_width=0.05, min_episodes=50)
+    batches = _simulate(budget, rates)
+    assert sum(b - a for _, a, b in batches) == 300 and budget.remaining == 0
+    assert not any(budget.done(c) for c in rates)
+    assert budget.episodes("coin") > budget.episodes("rare") > budget.episodes("never") == 40
+    assert budget.next_batch() is None
+
+def test_budget_limits_and_multiple_proportions():
+    budget = AdaptiveBudget(["fpr"], total_episodes=70, batch_episodes=30, target_width=0.2)
+    assert budget.next_batch() == ("fpr", 0, 30)
+    budget.update("fpr", 30, [0, 15])
+    # the widest of the tracked proportions decides
+    assert budget.width("fpr") == pytest.approx(max(hi - lo for lo, hi in (budget.interval("fpr", 0), budget.interval("fpr", 1))))
+    assert budget.width("fpr") > 0.2 and not budget.done("fpr")
+    assert budget.next_batch() == ("fpr", 30, 60)
+    budget.update("fpr", 30, [0, 15])
+    # the last batch is cut to the remaining budget, then nothing is left
+    assert budget.next_batch() == ("fpr", 60, 70)
+    budget.update("fpr", 10, [0, 5])
+    assert budget.next_batch() is None and budget.episodes("fpr") == 70
+
+def test_adaptive_cells_are_prefixes_of_fixed_runs(tmp_path):
+    common = ["--max_steps", "20", "--seed", "1"]
+    adaptive = run_sweep(tmp_path / "adaptive", "--episodes", "60", "--adaptive", "--batch_episodes", "10", "--min_episodes", "10",
+                         "--ci_width", "0.3", *common)
+    fixed = read_outputs(run_sweep(tmp_path / "fixed", "--episodes", "60", *common))
+    with open(os.path.join(adaptive, "summary.csv"), newline="") as fh:
+        summaries = list(csv.DictReader(fh))
+    used = {(r["attack"], r["defense"]): int(r["episodes_used"]) for r in summaries}
+    # the rule-based cells are pinned at ASR 0 or 1, so they settle well before the fixed budget
+    assert max(used.values()) < 60
+    outputs = read_outputs(adaptive)
+    for r in summaries:
+        n = used[(r["attack"], r["defense"])]
+        name = f"raw_{r['attack']}_{r['defense']}.csv"
+        assert outputs[name] == [row for row in fixed[name] if int(row["episode"]) < n]
+        assert float(r["asr_ci_low"]) <= float(r["asr"]) <= float(r["asr_ci_high"])
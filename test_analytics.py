@@ -0,0 +1,49 @@
+# test_analytics.py
+"""
+Tests for the raw-log aggregates: run_attacks logs (no defense or decision_latency column)
+aggregate under any grouping, and partial aggregates merge to the whole.
+Run with: python -m pytest -q
+"""
+import json
+import math
+
+import pytest
+
+import run_attacks
+import run_experiments as rex
+from analytics import MISSING_GROUP, RawLogAggregate, aggregate_files
+
+def _attack_logs(tmp_path, attacks=("none", "direct", "camouflaged")):
+    return [run_attacks.run_for_attack(a, 25, 30, str(tmp_path), seed_base=7) for a in attacks]
+
+@pytest.mark.parametrize("group_by", [("attack_type", "defense"), ("attack_type",)])
+def test_run_attacks_logs_aggregate(tmp_path, group_by):
+    summaries = _attack_logs(tmp_path)
+    agg = aggregate_files([s["out_csv"] for s in summaries], group_by, chunk_rows=64)
+    results = agg.results().set_index("attack_type")
+    for s in summaries:
+        row = results.loc[s["attack_type"]]
+        assert row["episodes"] == 25
+        assert row["asr"] == pytest.approx(s["asr"])
+        if "defense" in group_by:
+            assert row["defense"] == MISSING_GROUP
+        # no decision_latency column: latency percentiles are left empty
+        assert math.isnan(row["latency_p50"])
+
+def test_partial_aggregates_merge_to_the_whole(tmp_path):
+    paths = [s["out_csv"] for s in _attack_logs(tmp_path / "attacks")]
+    paths += [rex.run_one_configuration("direct", d, 20, 30, str(tmp_path / "sweep"), seed_base=3)["out_csv"]
+              for d in ("none", "confirm")]
+    whole = aggregate_files(paths, chunk_rows=50)
+    merged = RawLogAggregate()
+    for cut in (paths[:2], paths[2:4], paths[4:]):
+        part = aggregate_files(cut, chunk_rows=37)
+        merged.merge(RawLogAggregate.from_dict(json.loads(json.dumps(part.to_dict()))))
+    assert merged.results().equals(whole.results())
+    assert merged.asr_by_step().equals(whole.asr_by_step())
+    # undefended run_attacks episodes join the sweep's defense=none group; latencies come from the sweep rows
+    results = whole.results().set_index(["attack_type", "defense"])
+    assert results.loc[("direct", MISSING_GROUP), "episodes"] == 25 + 20
+    assert results.loc[("camouflaged", MISSING_GROUP), "episodes"] == 25
+    assert math.isnan(results.loc[("camouflaged", MISSING_GROUP), "latency_p50"])
+    assert results.loc[("direct", "confirm"), "latency_p50"] > 0
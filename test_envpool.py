@@ -0,0 +1,30 @@
+# test_envpool.py
+"""
+Equivalence tests for the EnvPool runner: raw logs and results against the per-episode
+runner for fixed seeds, independent of the worker count, and the empty episode range.
+Run with: python -m pytest -q
+"""
+import numpy as np
+import pytest
+
+import run_experiments as rex
+from envpool import EnvPool
+from test_env import read_log
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_pool_runner_matches_scalar_logs(tmp_path, workers):
+    for attack, defense in [("direct", "none"), ("metadata", "sanitize"), ("camouflaged", "confirm")]:
+        scalar = rex.run_one_configuration(attack, defense, 9, 50, str(tmp_path / "scalar"), seed_base=7)
+        pooled = rex.run_one_configuration(attack, defense, 9, 50, str(tmp_path / f"pool{workers}"), seed_base=7, env_pool=workers)
+        assert read_log(pooled["out_csv"]) == read_log(scalar["out_csv"])
+        assert pooled["asr"] == scalar["asr"]
+        assert np.isclose(pooled["mean_reward"], scalar["mean_reward"])
+
+def test_pool_runner_empty_range(tmp_path):
+    summary = rex.run_one_configuration("direct", "confirm", 0, 50, str(tmp_path), env_pool=2)
+    assert read_log(summary["out_csv"]) == []
+    assert summary["asr"] == 0.0
+
+def test_pool_rejects_zero_envs():
+    with pytest.raises(ValueError):
+        EnvPool(0, 1, [])
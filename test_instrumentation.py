@@ -0,0 +1,53 @@
+# test_instrumentation.py
+"""
+Tests for the per-stage latency instrumentation: off by default, no timing calls on the
+disabled path, identical logs either way, and histograms that merge exactly.
+Run with: python -m pytest -q
+"""
+import time
+
+import numpy as np
+import pytest
+
+import run_experiments as rex
+from instrumentation import Instrumentation, LatencyHistogram, STAGES
+from test_env import read_log
+
+def _no_stage_timers(monkeypatch):
+    """Make the stage timer (perf_counter_ns) fail, so any call on the disabled path shows up."""
+    def fail():
+        raise AssertionError("stage timer called with instrumentation off")
+    monkeypatch.setattr(time, "perf_counter_ns", fail)
+
+def test_instrumentation_is_off_by_default():
+    args = rex.build_parser().parse_args([])
+    assert args.instrument is False
+    assert rex._run_options(args)["instrument"] is False
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_disabled_path_makes_no_stage_timing_calls(tmp_path, monkeypatch, vectorized):
+    on = rex.run_one_configuration("direct", "sanitize", 6, 30, str(tmp_path / "on"), vectorized=vectorized, instrument=True)
+    assert {f"latency_{s}_p50" for s in STAGES} <= set(on)
+    _no_stage_timers(monkeypatch)
+    off = rex.run_one_configuration("direct", "sanitize", 6, 30, str(tmp_path / "off"), vectorized=vectorized)
+    assert not any(k.startswith("latency_") for k in off)
+    # instrumentation only observes: same rows and results with it on or off
+    assert read_log(off["out_csv"]) == read_log(on["out_csv"])
+    assert (off["asr"], off["mean_reward"]) == (on["asr"], on["mean_reward"])
+    with pytest.raises(AssertionError, match="stage timer"):
+        rex.run_one_configuration("direct", "sanitize", 1, 30, str(tmp_path / "on2"), vectorized=vectorized, instrument=True)
+
+def test_histograms_merge_exactly():
+    rng = np.random.default_rng(0)
+    samples = rng.integers(0, 10 ** 7, 5000)
+    whole = LatencyHistogram()
+    whole.record_array(samples)
+    a, b = Instrumentation(), Instrumentation()
+    for x in samples[:1234].tolist():
+        a["policy"].record(x)
+    b["policy"].record_array(samples[1234:])
+    merged = a.merge(b)["policy"]
+    assert merged.counts == whole.counts and merged.max_ns == whole.max_ns and merged.total_ns == whole.total_ns
+    # quantiles within the bucket resolution of the exact ones
+    for q in (0.5, 0.9, 0.99):
+        assert merged.quantile(q) == pytest.approx(np.quantile(samples, q), rel=2 ** -4)
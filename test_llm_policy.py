@@ -0,0 +1,93 @@
+# test_llm_policy.py
+"""
+Tests for the model-backed policy against MockLLMServer: failed requests are retried,
+concurrent identical prompts are sent once, the response cache answers a repeated run
+without requests, sweeps against the mock reproduce the rule-based sweep, and the
+incompatible command-line combinations are rejected.
+Run with: python -m pytest -q
+"""
+import asyncio
+
+import pytest
+
+import run_experiments as rex
+from env import GridWorld
+from llm_policy import AsyncLLMPolicy, MockLLMServer, ResponseCache
+from policies import rule_based_policy
+from test_run_experiments import read_outputs, run_sweep
+
+def _states(n: int):
+    """(s_repr, m_text) of the first step of n seeded episodes."""
+    env = GridWorld()
+    return [env.reset(seed=seed) for seed in range(n)]
+
+def _decide_all(url: str, states, **kwargs):
+    """Actions for all states decided concurrently, and the policy's counters."""
+    async def run():
+        policy = AsyncLLMPolicy(url, **kwargs)
+        try:
+            actions = await asyncio.gather(*(policy(s_repr, m_text) for s_repr, m_text in states))
+        finally:
+            await policy.aclose()
+        return actions, policy.counters
+    return asyncio.run(run())
+
+def test_failed_requests_are_retried():
+    states = _states(12)
+    with MockLLMServer(latency_ms=1.0, failure_rate=0.5, seed=1) as server:
+        actions, counters = _decide_all(server.url, states, max_batch=1, retries=20, backoff_s=0.001)
+        stats = server.stats
+    assert actions == [rule_based_policy(s_repr, m_text) for s_repr, m_text in states]
+    assert stats["failures"] > 0
+    assert counters["retries"] == stats["failures"]
+    assert counters["requests"] == stats["requests"]
+
+def test_failing_server_raises_after_retries():
+    with MockLLMServer(latency_ms=0.0, failure_rate=1.0) as server:
+        with pytest.raises(Exception):
+            _decide_all(server.url, _states(1), retries=2, backoff_s=0.001)
+        assert server.stats["requests"] == 3
+
+def test_concurrent_identical_prompts_are_sent_once():
+    states = _states(4) * 5
+    with MockLLMServer(latency_ms=5.0) as server:
+        actions, counters = _decide_all(server.url, states)
+        stats = server.stats
+    assert actions == [rule_based_policy(s_repr, m_text) for s_repr, m_text in states]
+    assert counters["decisions"] == len(states)
+    assert counters["shared"] == len(states) - 4
+    assert stats["prompts"] == counters["prompts_sent"] == 4
+
+def test_response_cache_answers_repeated_run(tmp_path):
+    states = _states(8)
+    path = str(tmp_path / "responses.sqlite")
+    with MockLLMServer(latency_ms=1.0) as server:
+        cache = ResponseCache(path)
+        first, _ = _decide_all(server.url, states, cache=cache)
+        cache.close()
+        sent = server.stats["requests"]
+        cache = ResponseCache(path)
+        second, counters = _decide_all(server.url, states, cache=cache)
+        cache.close()
+        assert server.stats["requests"] == sent
+    assert second == first
+    assert counters["cache_hits"] == len(states)
+    assert counters["requests"] == 0
+
+def test_mock_sweep_matches_rule_based(tmp_path):
+    common = ["--episodes", "6", "--max_steps", "20", "--seed", "2"]
+    mocked = run_sweep(tmp_path / "mock", *common, "--llm_mock_latency_ms", "1", "--llm_cache", str(tmp_path / "r.sqlite"))
+    plain = run_sweep(tmp_path / "plain", *common)
+    mocked_outputs, plain_outputs = read_outputs(mocked), read_outputs(plain)
+    # the summaries of the model-backed sweep carry the llm_* request counters
+    summaries = mocked_outputs["summary.csv"]
+    assert all(int(row["llm_prompts_sent"]) + int(row["llm_cache_hits"]) + int(row["llm_shared"]) > 0 for row in summaries)
+    mocked_outputs["summary.csv"] = [{k: v for k, v in row.items() if not k.startswith("llm_")} for row in summaries]
+    assert mocked_outputs == plain_outputs
+
+@pytest.mark.parametrize("llm", [["--llm_url", "http://127.0.0.1:1"], ["--llm_mock_latency_ms", "1"]])
+def test_llm_rejects_exact(llm):
+    parser = rex.build_parser()
+    args = parser.parse_args([*llm, "--exact"])
+    with pytest.raises(SystemExit):
+        rex.check_args(parser, args)
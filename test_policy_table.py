@@ -0,0 +1,30 @@
+# test_policy_table.py
+"""
+Equivalence tests for the compiled policy table: every entry against the scalar
+rule_based_policy, and the table and rule-based batch interfaces against each other
+on either side of MAX_TABLE_SIZE.
+Run with: python -m pytest -q
+"""
+import numpy as np
+import pytest
+
+import policy_table as pt
+from policies import rule_based_policy_batch
+
+@pytest.mark.parametrize("size", [2, 4, 5])
+def test_table_matches_scalar_policy(size):
+    table = pt.compile_policy_table(size)
+    assert table.dtype == np.int8
+    assert pt.verify_policy_table(table, size) == []
+
+@pytest.mark.parametrize("size", [4, pt.MAX_TABLE_SIZE, pt.MAX_TABLE_SIZE + 1, 32])
+def test_table_policy_batch_matches_rule_batch(size):
+    policy = pt.table_policy(size)
+    assert isinstance(policy, pt.TablePolicy) == (size <= pt.MAX_TABLE_SIZE)
+    rng = np.random.default_rng(size)
+    agent, red_box, red_button = (rng.integers(0, size, (500, 2)) for _ in range(3))
+    red_button[::7] = agent[::7]
+    red_box[::5] = agent[::5]
+    press = rng.random(500) < 0.5
+    expected = rule_based_policy_batch(agent, red_box, red_button, press)
+    assert policy.batch(agent, red_box, red_button, press).tolist() == expected.tolist()
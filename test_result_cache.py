@@ -0,0 +1,94 @@
+# test_result_cache.py
+"""
+Tests for the sweep result cache: definition_hash follows only the definitions a defense
+reaches, and a cached sweep reruns exactly the cells whose defense changed.
+Run with: python -m pytest -q
+"""
+import importlib.util
+import os
+import subprocess
+import sys
+
+import defenses as dfn
+import run_experiments as rex
+from result_cache import definition_hash
+from test_run_experiments import read_outputs, run_sweep
+
+MODULE = '''
+LIMIT = 3
+NAMES = {"b", "a", "c"}
+
+def _helper_a(x):
+    return x + LIMIT
+
+def _helper_b(x):
+    return x * 2
+
+class Box:
+    def get(self):
+        return _helper_b(1)
+
+_BOX = Box()
+
+def defense_a(x):
+    return _helper_a(x) in NAMES
+
+def defense_b(x):
+    return _BOX.get()
+'''
+
+def _load(tmp_path, monkeypatch, name: str, source: str):
+    path = tmp_path / f"{name}.py"
+    path.write_text(source)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # inspect finds class sources through sys.modules
+    monkeypatch.setitem(sys.modules, name, module)
+    spec.loader.exec_module(module)
+    return module
+
+def test_definition_hash_follows_only_reached_definitions(tmp_path, monkeypatch):
+    base = _load(tmp_path, monkeypatch, "defs_base", MODULE)
+    edit_b = _load(tmp_path, monkeypatch, "defs_edit_b", MODULE.replace("return x * 2", "return x * 3"))
+    edit_limit = _load(tmp_path, monkeypatch, "defs_edit_limit", MODULE.replace("LIMIT = 3", "LIMIT = 4"))
+    edit_unused = _load(tmp_path, monkeypatch, "defs_edit_unused", MODULE + "\ndef unused():\n    return 1\n")
+    a, b = definition_hash(base, "defense_a"), definition_hash(base, "defense_b")
+    assert a != b
+    # defense_b reaches _helper_b through the Box instance
+    assert (definition_hash(edit_b, "defense_a"), definition_hash(edit_b, "defense_b") != b) == (a, True)
+    assert (definition_hash(edit_limit, "defense_a") != a, definition_hash(edit_limit, "defense_b")) == (True, b)
+    assert (definition_hash(edit_unused, "defense_a"), definition_hash(edit_unused, "defense_b")) == (a, b)
+
+def test_defense_hashes_are_stable_across_processes():
+    # set ordering depends on the string hash seed; the key must not
+    code = "import defenses as dfn, result_cache as rc; print(rc.definition_hash(dfn, *dfn.DEFENSE_ENTRY_POINTS['confirm']))"
+    here = os.path.dirname(os.path.abspath(__file__))
+    outs = {subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True,
+                           env=dict(os.environ, PYTHONHASHSEED=seed)).stdout for seed in ("1", "2")}
+    assert outs == {definition_hash(dfn, *dfn.DEFENSE_ENTRY_POINTS["confirm"]) + "\n"}
+
+def test_cached_sweep_reruns_only_the_changed_defense(tmp_path, monkeypatch):
+    ran = []
+    run_range, compute_fpr = rex._run_episode_range, rex.compute_fpr_for_defenses
+
+    def recording_range(attack, defense, *args, **kwargs):
+        ran.append((attack, defense))
+        return run_range(attack, defense, *args, **kwargs)
+
+    def recording_fpr(defenses, *args, **kwargs):
+        ran.extend(("fpr", d) for d in defenses)
+        return compute_fpr(defenses, *args, **kwargs)
+    monkeypatch.setattr(rex, "_run_episode_range", recording_range)
+    monkeypatch.setattr(rex, "compute_fpr_for_defenses", recording_fpr)
+    flags = ["--episodes", "5", "--max_steps", "20", "--cache_dir", str(tmp_path / "cache")]
+
+    first = read_outputs(run_sweep(tmp_path / "first", *flags))
+    assert len(ran) == len(rex.ATTACKS) * len(rex.DEFENSES) + 2
+    ran.clear()
+    assert read_outputs(run_sweep(tmp_path / "second", *flags)) == first
+    assert ran == []
+
+    hashes = rex._code_hashes()
+    monkeypatch.setitem(hashes, "defense:confirm", "edited")
+    assert read_outputs(run_sweep(tmp_path / "third", *flags)) == first
+    assert sorted(ran) == sorted([(a, "confirm") for a in rex.ATTACKS] + [("fpr", "confirm")])
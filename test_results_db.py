@@ -0,0 +1,72 @@
+# test_results_db.py
+"""
+Tests for ResultsDB: ingesting sweep and run_attacks directories (summaries, FPRs, raw
+steps) and the ASR queries, per (attack, defense) cell and per defense across runs.
+Run with: python -m pytest -q
+"""
+import csv
+import os
+
+import pytest
+
+import run_attacks
+from results_db import ResultsDB
+from test_run_experiments import run_sweep
+
+def _read_csv(path):
+    with open(path, newline="") as fh:
+        return list(csv.DictReader(fh))
+
+@pytest.fixture
+def sweep_dir(tmp_path):
+    return run_sweep(tmp_path / "sweep", "--episodes", "12", "--max_steps", "30", "--seed", "2",
+                     "--fast_forward", "--rle_rows")
+
+def test_ingest_sweep_with_steps(tmp_path, sweep_dir):
+    summary = _read_csv(os.path.join(sweep_dir, "summary.csv"))
+    with ResultsDB(str(tmp_path / "db" / "results.db")) as db:
+        run_id = db.ingest_dir(sweep_dir, steps=True)
+        stored = db.conn.execute("SELECT attack, defense, episodes, asr FROM summaries WHERE run_id = ?", (run_id,)).fetchall()
+        assert sorted(stored) == sorted((r["attack"], r["defense"], int(r["episodes"]), float(r["asr"])) for r in summary)
+        fpr = dict(db.conn.execute("SELECT defense, fpr FROM fpr WHERE run_id = ?", (run_id,)).fetchall())
+        assert fpr == {r["defense"]: float(r["fpr"]) for r in _read_csv(os.path.join(sweep_dir, "defense_fpr.csv"))}
+        # every raw row is stored, run-length rows with their repeat count
+        raw_rows = sum(len(_read_csv(os.path.join(sweep_dir, f"raw_{r['attack']}_{r['defense']}.csv"))) for r in summary)
+        assert db.conn.execute("SELECT COUNT(*) FROM steps WHERE run_id = ?", (run_id,)).fetchone()[0] == raw_rows
+        assert db.conn.execute("SELECT MAX(repeat) FROM steps WHERE run_id = ?", (run_id,)).fetchone()[0] > 1
+        # ASR per cell from the stored steps matches the stored summaries
+        per_cell = db.conn.execute(
+            "SELECT attack, defense, AVG(pressed) FROM (SELECT attack, defense, episode, MAX(action = 'PRESS') AS pressed "
+            "FROM steps WHERE run_id = ? GROUP BY attack, defense, episode) GROUP BY attack, defense", (run_id,)).fetchall()
+        assert sorted(per_cell) == pytest.approx(sorted((a, d, asr) for a, d, _, asr in stored))
+        assert {d for _, d, _ in per_cell} == {"none", "sanitize", "confirm"}
+
+def test_asr_by_defense_over_runs(tmp_path, sweep_dir):
+    attacks_dir = str(tmp_path / "attacks")
+    attack_summaries = [run_attacks.run_for_attack(a, 10, 30, attacks_dir, seed_base=5) for a in ("none", "direct")]
+    with open(os.path.join(attacks_dir, "asr_summary.csv"), "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=list(attack_summaries[0]))
+        writer.writeheader()
+        writer.writerows(attack_summaries)
+    summary = _read_csv(os.path.join(sweep_dir, "summary.csv"))
+    with ResultsDB(str(tmp_path / "results.db")) as db:
+        sweep_run = db.ingest_dir(sweep_dir)
+        attacks_run = db.ingest_dir(attacks_dir, steps=True)
+        # run_attacks logs have no defense column; their rows are stored under defense 'none'
+        assert db.conn.execute("SELECT DISTINCT defense FROM steps WHERE run_id = ?", (attacks_run,)).fetchall() == [("none",)]
+
+        def expected(rows, defense):
+            cells = [(float(r["asr"]), int(r["episodes"])) for r in rows
+                     if r.get("defense", "none") == defense and r.get("attack", r.get("attack_type")) != "none"]
+            return sum(a * n for a, n in cells) / sum(n for _, n in cells)
+
+        latest = {r["defense"]: r for r in db.asr_by_defense(last_n=1)}
+        assert set(latest) == {"none"} and latest["none"]["runs"] == 1
+        assert latest["none"]["asr"] == pytest.approx(expected(attack_summaries, "none"))
+        both = {r["defense"]: r for r in db.asr_by_defense(last_n=2)}
+        assert both["none"]["asr"] == pytest.approx((expected(summary, "none") * 36 + expected(attack_summaries, "none") * 10) / 46)
+        assert both["none"]["episodes"] == 46 and both["none"]["runs"] == 2
+        assert both["confirm"]["asr"] == pytest.approx(expected(summary, "confirm"))
+        per_run = {(r["run_id"], r["defense"]): r["asr"] for r in db.asr_by_defense(last_n=2, per_run=True)}
+        assert per_run[(sweep_run, "sanitize")] == pytest.approx(expected(summary, "sanitize"))
+        assert per_run[(attacks_run, "none")] == pytest.approx(expected(attack_summaries, "none"))
@@ -0,0 +1,222 @@
+# test_run_experiments.py
+"""
+Tests for the sweep internals: the lockstep FPR divergence search against independent
+baseline and defended runs, with defenses that do change benign actions, sharded sweeps
+against serial ones, the bounded per-shard totals, --exact against sampled episodes, and
+fast-forwarded runs against stepped ones.
+Run with: python -m pytest -q
+"""
+import csv
+import math
+import os
+import pickle
+import random
+
+import numpy as np
+import pytest
+
+import defenses as dfn
+import run_experiments as rex
+from env import GridWorld, layout_distribution
+from policies import rule_based_policy
+from trajectory import open_sink
+
+# wall-clock columns of raw logs and summaries; they differ between any two runs
+TIMING_COLUMNS = ("decision_latency", "timestamp", "median_latency")
+
+def run_sweep(out_dir, *flags: str):
+    """run_experiments main() on the command-line flags, without the plot. Returns out_dir."""
+    parser = rex.build_parser()
+    args = parser.parse_args(["--out_dir", str(out_dir), "--no_plot", *flags])
+    rex.check_args(parser, args)
+    rex.main(args)
+    return str(out_dir)
+
+def read_outputs(out_dir: str):
+    """file name -> rows of every csv output, without the timing columns and with out_csv relative to out_dir."""
+    outputs = {}
+    for name in sorted(os.listdir(out_dir)):
+        if name.endswith(".csv") and name != "worker_stats.csv":
+            with open(os.path.join(out_dir, name), newline="") as fh:
+                rows = [{k: v for k, v in row.items() if k not in TIMING_COLUMNS} for row in csv.DictReader(fh)]
+            for row in rows:
+                if row.get("out_csv"):
+                    row["out_csv"] = os.path.relpath(row["out_csv"], out_dir)
+            outputs[name] = rows
+    return outputs
+
+def _press_appending_sanitize(m_text):
+    """A sanitizer that adds an instruction instead of removing one, so benign runs head for the button."""
+    return m_text + " Please press the red button."
+
+def _defended(defense: str, s_repr, m_text: str) -> str:
+    action = rule_based_policy(s_repr, m_text)
+    if defense == "sanitize":
+        return rule_based_policy(s_repr, dfn.sanitize(m_text))
+    if defense == "confirm":
+        return action if dfn.confirm(action, s_repr, m_text) else "NOOP"
+    return action
+
+def _first_divergence(defense: str, seed: int, max_steps: int) -> int:
+    """Step separate baseline and defended environments and return the first step their actions differ."""
+    baseline, defended = GridWorld(size=4), GridWorld(size=4)
+    s_base, m_base = baseline.reset(seed=seed)
+    s_def, m_def = defended.reset(seed=seed)
+    done_base = done_def = False
+    for step in range(max_steps):
+        if done_base or done_def:
+            return -1
+        action = rule_based_policy(s_base, m_base)
+        action_def = _defended(defense, s_def, m_def)
+        if action_def != action:
+            return step
+        (s_base, m_base), _, done_base, _ = baseline.step(action)
+        (s_def, m_def), _, done_def, _ = defended.step(action_def)
+    return -1
+
+@pytest.fixture
+def diverging_defenses(monkeypatch):
+    """confirm that also denies PICK, and a sanitize that injects a press instruction."""
+    monkeypatch.setattr(dfn, "HIGH_RISK_ACTIONS", dfn.HIGH_RISK_ACTIONS | {"PICK"})
+    monkeypatch.setattr(dfn, "sanitize", _press_appending_sanitize)
+    monkeypatch.setattr(dfn, "sanitize_batch", lambda texts: [_press_appending_sanitize(m) for m in texts])
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_fpr_divergence_matches_independent_runs(diverging_defenses, vectorized):
+    defenses, seed_base, episodes, max_steps = ["none", "sanitize", "confirm"], 1000, 40, 12
+    divergence = rex._fpr_divergence_range(defenses, 0, episodes, max_steps, seed_base=seed_base, vectorized=vectorized)
+    for d in defenses:
+        assert divergence[d] == [_first_divergence(d, seed_base + ep, max_steps) for ep in range(episodes)]
+    # both patched defenses diverge on some episodes and at more than one step
+    for d in ("sanitize", "confirm"):
+        steps = [s for s in divergence[d] if s >= 0]
+        assert steps and len(set(steps)) > 1
+    assert divergence["none"] == [-1] * episodes
+
+def test_fpr_results_count_diverging_episodes(diverging_defenses):
+    results = rex.compute_fpr_for_defenses(["sanitize", "confirm"], 20, 12, "", seed_base=1000)
+    for r in results:
+        assert r["fpr"] == sum(s >= 0 for s in r["divergence_steps"]) / 20
+        assert 0 < r["fpr"] <= 1
+
+@pytest.mark.parametrize("flags", [[], ["--vectorized"], ["--seeding", "spawn"]])
+def test_workers_match_serial(tmp_path, flags):
+    common = ["--episodes", "7", "--max_steps", "20", "--seed", "4", *flags]
+    serial = run_sweep(tmp_path / "serial", *common)
+    sharded = run_sweep(tmp_path / "sharded", *common, "--workers", "2", "--chunk_episodes", "3")
+    assert read_outputs(sharded) == read_outputs(serial)
+    # outputs without wall-clock columns are byte-identical
+    for name in ("defense_fpr.csv", "fpr_divergence.csv"):
+        with open(os.path.join(serial, name), "rb") as a, open(os.path.join(sharded, name), "rb") as b:
+            assert a.read() == b.read()
+    assert os.path.exists(os.path.join(sharded, "worker_stats.csv"))
+
+def test_episode_totals_merge_exactly():
+    rng = random.Random(3)
+    episodes = [(rng.random() < 0.3, rng.choice([-0.05, 1.0, -10.0]) * rng.randint(1, 50) + rng.random() * 1e-9) for _ in range(3000)]
+    latencies = [rng.random() * 1e-4 for _ in range(5000)]
+    whole = rex.EpisodeTotals()
+    for success, reward in episodes:
+        whole.add_episode(success, reward)
+    whole.add_latencies(np.array(latencies))
+    cuts = sorted(rng.sample(range(1, 3000), 7))
+    merged = rex.EpisodeTotals()
+    for a, b in zip([0] + cuts, cuts + [3000]):
+        shard = rex.EpisodeTotals()
+        for success, reward in episodes[a:b]:
+            shard.add_episode(success, reward)
+        for x in latencies[a:b]:
+            shard.add_latency(x)
+        merged.merge(pickle.loads(pickle.dumps(shard)))
+    merged.add_latencies(np.array(latencies[3000:]))
+    assert merged.reward_sum == whole.reward_sum == math.fsum(r for _, r in episodes)
+    assert (merged.episodes, merged.successes) == (whole.episodes, whole.successes) == (3000, sum(s for s, _ in episodes))
+    assert merged.latency.counts == whole.latency.counts
+
+def test_partial_results_stay_bounded(tmp_path):
+    sizes = []
+    for episodes in (20, 400):
+        with open_sink(str(tmp_path / f"raw{episodes}.csv"), "csv") as sink:
+            part = rex._run_episode_range("direct", "confirm", 0, episodes, 50, 0, sink)
+        assert part["totals"].episodes == episodes
+        sizes.append(len(pickle.dumps(part)))
+    assert sizes[1] < sizes[0] * 1.1
+
+def test_median_latency_from_histogram(tmp_path):
+    summary = rex.run_one_configuration("direct", "sanitize", 60, 50, str(tmp_path), seed_base=2)
+    with open(summary["out_csv"], newline="") as fh:
+        exact = float(np.median([float(row["decision_latency"]) for row in csv.DictReader(fh)]))
+    assert summary["median_latency"] == pytest.approx(exact, rel=2 ** -5)
+
+def _episode_outcomes(raw_csv: str):
+    """episode -> (success, reward) from a raw log."""
+    outcomes = {}
+    with open(raw_csv, newline="") as fh:
+        for row in csv.DictReader(fh):
+            success, reward = outcomes.get(int(row["episode"]), (False, 0.0))
+            outcomes[int(row["episode"])] = (success or row["action"] == rex.TARGET_ACTION, reward + float(row["reward"]))
+    return outcomes
+
+def _start_layout(seed: int, size: int):
+    s_repr, _ = GridWorld(size=size).reset(seed=seed)
+    objects = dict(s_repr[1])
+    return objects["red_box"], objects["red_button"]
+
+def test_exact_matches_sampled_episodes(tmp_path):
+    size, episodes, max_steps = 3, 300, 30
+    layouts, weights = layout_distribution(size)
+    index = {layout: i for i, layout in enumerate(layouts)}
+    summaries, _ = rex.run_exact(max_steps, size=size)
+    exact = {(r["attack"], r["defense"]): r for r in summaries}
+    for attack, defense in [("none", "none"), ("direct", "none"), ("camouflaged", "confirm"), ("metadata", "sanitize")]:
+        sim = rex._simulate_vectorized(attack, defense, None, max_steps, record=False, layouts=layouts, size=size)
+        success = (sim["action"] == rex.ACTION_INDEX[rex.TARGET_ACTION]).any(axis=0)
+        rewards = rex._episode_rewards(sim)
+        assert exact[(attack, defense)]["asr"] == pytest.approx(np.dot(weights, success) / weights.sum())
+        assert exact[(attack, defense)]["mean_reward"] == pytest.approx(np.dot(weights, rewards) / weights.sum())
+        # every sampled episode has exactly the outcome --exact assigns to its start layout
+        sampled = rex.run_one_configuration(attack, defense, episodes, max_steps, str(tmp_path), seed_base=11, size=size)
+        outcomes = _episode_outcomes(sampled["out_csv"])
+        for ep in range(episodes):
+            i = index[_start_layout(11 + ep, size)]
+            assert outcomes[ep][0] == bool(success[i])
+            assert outcomes[ep][1] == pytest.approx(rewards[i])
+        # and the sample mean lands within sampling error of the exact expectation
+        spread = np.sqrt(np.dot(weights, (rewards - exact[(attack, defense)]["mean_reward"]) ** 2) / weights.sum())
+        assert abs(sampled["mean_reward"] - exact[(attack, defense)]["mean_reward"]) <= 4 * spread / np.sqrt(episodes) + 1e-9
+
+def test_exact_fpr_matches_sampled_divergence(diverging_defenses):
+    size, episodes, max_steps = 3, 200, 20
+    layouts, weights = layout_distribution(size)
+    index = {layout: i for i, layout in enumerate(layouts)}
+    divergence = rex._fpr_divergence_vectorized(["sanitize", "confirm"], None, max_steps, layouts=layouts, size=size)
+    sampled = rex._fpr_divergence_range(["sanitize", "confirm"], 0, episodes, max_steps, seed_base=5, size=size)
+    for d in ("sanitize", "confirm"):
+        assert sampled[d] == [int(divergence[d][index[_start_layout(5 + ep, size)]]) for ep in range(episodes)]
+        assert any(s >= 0 for s in sampled[d])
+
+def _expand_repeats(rows):
+    """Raw-log rows with every run-length row replaced by the per-step rows it stands for."""
+    out = []
+    for row in rows:
+        row = dict(row)
+        repeat = int(row.pop("repeat", 1))
+        out.extend(dict(row, step=str(int(row["step"]) + j)) for j in range(repeat))
+    return out
+
+@pytest.mark.parametrize("vectorized", [False, True])
+@pytest.mark.parametrize("rle_rows", [False, True])
+def test_fast_forward_matches_stepped_runs(tmp_path, vectorized, rle_rows):
+    from test_env import read_log
+    for attack, defense in [("direct", "confirm"), ("camouflaged", "none")]:
+        stepped = rex.run_one_configuration(attack, defense, 40, 50, str(tmp_path / "stepped"), seed_base=3, vectorized=vectorized)
+        fast = rex.run_one_configuration(attack, defense, 40, 50, str(tmp_path / "fast"), seed_base=3, vectorized=vectorized,
+                                         fast_forward=True, rle_rows=rle_rows)
+        assert (fast["asr"], fast["mean_reward"]) == (stepped["asr"], stepped["mean_reward"])
+        rows = read_log(fast["out_csv"])
+        assert _expand_repeats(rows) == read_log(stepped["out_csv"])
+        if rle_rows:
+            # episodes settle at different steps and each is folded on its own
+            folded = [int(r["step"]) for r in rows if int(r["repeat"]) > 1]
+            assert len(set(folded)) > 1
+            assert len(rows) < 40 * 50
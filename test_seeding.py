@@ -0,0 +1,62 @@
+# test_seeding.py
+"""
+Tests for spawn seeding: every episode's seed depends only on its (experiment, config,
+episode) key, so runs give the same per-episode results however the episodes are sharded.
+Run with: python -m pytest -q
+"""
+import random
+
+import pytest
+
+import run_experiments as rex
+from seeding import EpisodeSeeds, spawn_seed
+from test_env import read_log
+from trajectory import open_sink
+
+def _cuts(n: int, shards: int, seed: int):
+    rng = random.Random(seed)
+    cuts = sorted(rng.sample(range(1, n), shards - 1))
+    return list(zip([0] + cuts, cuts + [n]))
+
+def test_spawn_seeds_depend_only_on_the_key():
+    seeds = EpisodeSeeds(7, "spawn", "sweep", "grid4")
+    whole = seeds.range(0, 200)
+    shards = _cuts(200, 6, 0)
+    random.Random(1).shuffle(shards)
+    # fresh streams, shards taken in any order
+    pieces = {a: EpisodeSeeds(7, "spawn", "sweep", "grid4").range(a, b) for a, b in shards}
+    assert [s for a in sorted(pieces) for s in pieces[a]] == whole
+    assert whole[42] == spawn_seed(7, "sweep", "grid4", 42)
+    assert len(set(whole)) == 200 and all(0 <= s < 2 ** 63 for s in whole)
+    # other experiments, configs and roots get unrelated streams
+    for other in (EpisodeSeeds(7, "spawn", "fpr", "grid4"), EpisodeSeeds(7, "spawn", "sweep", "grid5"), EpisodeSeeds(8, "spawn", "sweep", "grid4")):
+        assert not set(other.range(0, 200)) & set(whole)
+    # unlike legacy seeding, where offset roots overlap
+    assert set(EpisodeSeeds(0).range(0, 200)) & set(EpisodeSeeds(100).range(0, 200))
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_sharded_spawn_runs_match_one_run(tmp_path, monkeypatch, vectorized):
+    episodes = 40
+    with open_sink(str(tmp_path / "whole.csv"), "csv") as sink:
+        whole = rex._run_episode_range("direct", "confirm", 0, episodes, 30, 3, sink, vectorized=vectorized, seeding="spawn")
+    # small vectorized batches, so batch boundaries fall elsewhere too
+    monkeypatch.setattr(rex, "VECTOR_BATCH_EPISODES", 7)
+    rows, totals = {}, rex.EpisodeTotals()
+    for i, (a, b) in enumerate(reversed(_cuts(episodes, 5, 2))):
+        path = str(tmp_path / f"shard{i}.csv")
+        with open_sink(path, "csv") as sink:
+            part = rex._run_episode_range("direct", "confirm", a, b, 30, 3, sink, vectorized=vectorized, seeding="spawn")
+        totals.merge(part["totals"])
+        rows[a] = read_log(path)
+    assert [r for a in sorted(rows) for r in rows[a]] == read_log(str(tmp_path / "whole.csv"))
+    assert (totals.episodes, totals.successes, totals.reward_sum) == (whole["totals"].episodes, whole["totals"].successes, whole["totals"].reward_sum)
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_sharded_spawn_fpr_matches_one_run(vectorized):
+    whole = rex._fpr_divergence_range(["sanitize", "confirm"], 0, 60, 30, seed_base=5, vectorized=vectorized, seeding="spawn")
+    merged = {"sanitize": [], "confirm": []}
+    for a, b in _cuts(60, 4, 3):
+        part = rex._fpr_divergence_range(["sanitize", "confirm"], a, b, 30, seed_base=5, vectorized=vectorized, seeding="spawn")
+        for d in merged:
+            merged[d] += part[d]
+    assert merged == whole
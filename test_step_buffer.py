@@ -0,0 +1,87 @@
+# test_step_buffer.py
+"""
+Tests for StepBuffer: recorded steps come back from every sink format (csv, parquet, .traj)
+with the same fields and values as the row dicts they replace, across block flushes, for
+run-length rows and for info given as an info code.
+Run with: python -m pytest -q
+"""
+import numpy as np
+import pytest
+
+import attacks as atk
+from analytics import iter_raw_chunks
+from env import GridWorld
+from policies import rule_based_policy
+from step_buffer import INFO_KEYS, RAW_COLUMNS, STEP_DTYPE, StepBuffer, pack_pos, unpack_pos
+from trajectory import open_sink
+
+ATTACKS, DEFENSES = ("none", "direct"), ("none", "confirm")
+
+def _record_episodes(steps: StepBuffer, episodes: int, max_steps: int):
+    """Step GridWorld episodes into steps; returns the equivalent row dicts ('repeat' included)."""
+    rows = []
+    env = GridWorld(size=4)
+    for ep in range(episodes):
+        s_repr, m_original = env.reset(seed=ep)
+        m_injected = atk.inject(m_original, attack_type="direct", placement="append")
+        coded = ep % 2 == 1
+        steps.begin_episode()
+        ep_rows = []
+        done, step = False, 0
+        # every third episode stops stepping early, like a fast-forwarded one
+        stepped = max_steps - 3 if ep % 3 == 0 else max_steps
+        while not done and step < stepped:
+            action = rule_based_policy(s_repr, m_original if ep % 3 else m_injected)
+            (s_next, m_next), reward, done, info = env.step(action)
+            latency = (ep + 1) * 0.5 + step * 0.0625  # exact in binary, so csv parsing reads it back exactly
+            info_arg = (INFO_KEYS.index(next(iter(info))) + 1 if info else 0) if coded else info
+            (steps.record_coded if coded else steps.record)(step, s_repr, m_original, action, ep % 4 != 2, reward, done, info_arg, latency)
+            ep_rows.append({"episode": ep, "step": step, "attack_type": "direct", "defense": "confirm", "agent_pos": str(s_repr[0]),
+                            "objects": str(s_repr[1]), "m_original": m_original, "m_injected": m_injected, "m_processed": m_original,
+                            "action": action, "confirmed": ep % 4 != 2, "reward": float(reward), "done": bool(done), "info": str(info),
+                            "decision_latency": latency, "timestamp": 1000.0 + ep, "repeat": 1})
+            s_repr, m_original = s_next, m_next
+            step += 1
+        if not done and step < max_steps:
+            # a fast-forwarded tail: one run-length row for the remaining steps
+            steps.repeat_last(step, False, max_steps - step)
+            ep_rows.append(dict(ep_rows[-1], step=step, done=False, repeat=max_steps - step))
+        steps.end_episode(ep, m_injected, m_original, 1000.0 + ep)
+        rows.extend(ep_rows)
+    return rows
+
+def test_records_keep_the_step_layout(tmp_path):
+    with open_sink(str(tmp_path / "raw.csv"), "csv") as sink:
+        steps = StepBuffer(12, sink, "direct", "confirm", rle_rows=True, attacks=ATTACKS, defenses=DEFENSES)
+        rows = _record_episodes(steps, 6, 12)
+        assert steps.buf.dtype == STEP_DTYPE and steps.n == len(rows)
+        assert (steps.attack_code, steps.defense_code) == (1, 1)
+        cols = steps.columns()
+        assert list(cols) == list(RAW_COLUMNS) + ["repeat"]
+        for name, dtype in [("episode", np.int64), ("step", np.int32), ("reward", np.float64), ("confirmed", np.bool_),
+                            ("done", np.bool_), ("decision_latency", np.float64), ("timestamp", np.float64), ("repeat", np.int32)]:
+            assert cols[name].dtype == dtype, name
+        for name in ("agent_pos", "objects", "m_original", "action", "info"):
+            assert cols[name].dtype == object
+            assert cols[name].tolist() == [r[name] for r in rows]
+        steps.close()
+    assert all(unpack_pos(pack_pos((x, y))) == (x, y) for x in (0, 3, 255) for y in (0, 7, 255))
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet", "traj"])
+@pytest.mark.parametrize("rle_rows", [False, True])
+def test_flushed_blocks_round_trip(tmp_path, fmt, rle_rows):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"raw.{fmt}")
+    # chunk_rows below one block of episodes: every episode is flushed on its own
+    with open_sink(path, fmt, chunk_rows=7) as sink:
+        steps = StepBuffer(10, sink, "direct", "confirm", rle_rows=rle_rows, attacks=ATTACKS, defenses=DEFENSES)
+        rows = _record_episodes(steps, 9, 10)
+        steps.close()
+    if not rle_rows:
+        for r in rows:
+            del r["repeat"]
+    read = [r for chunk in iter_raw_chunks(path, chunk_rows=5) for r in chunk.to_dict("records")]
+    assert read == rows
+    assert any(r.get("repeat", 1) > 1 for r in rows) == rle_rows
+    assert {r["info"] for r in rows} >= {"{}", "{'picked': True}"}
@@ -0,0 +1,128 @@
+# test_sweep_queue.py
+"""
+Tests for the work queue: an expired claim is taken over and the sweep completes, the owner
+that lost it leaves the new owner's claim alone (run_local, several processes), and a unit
+that raises releases its claim at once and stops the other workers instead of stalling them.
+Run with: python -m pytest -q
+"""
+import json
+import multiprocessing as mp
+import os
+import time
+
+import pytest
+
+import run_experiments as rex
+import sweep_queue as sq
+from test_run_experiments import read_outputs, run_sweep
+
+def _publish(tmp_path):
+    parser = rex.build_parser()
+    args = parser.parse_args(["--episodes", "3", "--max_steps", "10", "--chunk_episodes", "2", "--out_dir", str(tmp_path / "out")])
+    return str(tmp_path / "q"), sq.publish(str(tmp_path / "q"), args)
+
+def test_expired_claim_is_taken_over(tmp_path):
+    queue, ids = _publish(tmp_path)
+    # a worker that claimed a unit and died without a heartbeat
+    assert sq._Worker(queue, "dead", 60.0).try_claim(ids[0])
+    live = sq._Worker(queue, "live", 0.05)
+    assert not live.try_claim(ids[0])  # first sighting of the claim starts its lease clock
+    time.sleep(0.1)
+    assert live.try_claim(ids[0])
+    # the fresh claim is held by live now; a worker with a full lease does not take it
+    assert not sq._Worker(queue, "late", 60.0).try_claim(ids[0])
+    live.run(ids[0])
+    assert not os.path.exists(os.path.join(queue, "claims", ids[0]))
+    assert sq.work(queue, "rest", lease_s=0.05, poll_s=0.01) == len(ids) - 1
+    assert sq.status(queue)["done"] == len(ids)
+    summaries, _ = sq.merge(queue)[4]
+    assert len(summaries) == len(rex.ATTACKS) * len(rex.DEFENSES)
+
+def _wait_for(path: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise TimeoutError(path)
+        time.sleep(0.01)
+
+@pytest.mark.skipif(mp.get_start_method() != "fork", reason="worker processes must inherit the patched hooks")
+def test_taken_over_owner_leaves_new_claim(tmp_path, monkeypatch, capfd):
+    """
+    The first owner of the first claimed unit misses its heartbeats until another worker has
+    taken the unit over, then finishes while the new owner still runs it.
+    """
+    sync, lease_s = tmp_path / "sync", 1.0
+    sync.mkdir()
+    role = {}  # per worker process: "stalled" or "taker", with the unit id
+    try_claim, beat, run_unit, run = sq._Worker.try_claim, sq._Lease._beat, rex._run_work_unit, sq._Worker.run
+
+    def claim_hook(self, uid):
+        if not try_claim(self, uid):
+            return False
+        try:
+            fd = os.open(sync / "first", os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, uid.encode())
+            os.close(fd)
+            role.update(kind="stalled", uid=uid)
+        except FileExistsError:
+            if (sync / "first").read_text() == uid:
+                role.update(kind="taker", uid=uid)
+                (sync / "taken").touch()
+        return True
+
+    def beat_hook(self):
+        if role.get("kind") == "stalled":
+            _wait_for(sync / "taken")
+        beat(self)
+
+    def unit_hook(unit):
+        if role.get("kind") == "stalled":
+            _wait_for(sync / "taken")
+            time.sleep(lease_s)  # a heartbeat comes due and finds the new owner's token
+        elif role.get("kind") == "taker":
+            _wait_for(sync / "released")
+            claim = os.path.join(str(tmp_path / "q"), "claims", role["uid"])
+            with open(claim) as fh:
+                kept = json.load(fh)["pid"] == os.getpid()
+            (sync / ("kept" if kept else "lost")).touch()
+        return run_unit(unit)
+
+    def run_hook(self, uid):
+        try:
+            run(self, uid)
+        finally:
+            if role.get("kind") == "stalled" and role["uid"] == uid:
+                (sync / "released").touch()
+            role.clear()
+
+    monkeypatch.setattr(sq._Worker, "try_claim", claim_hook)
+    monkeypatch.setattr(sq._Lease, "_beat", beat_hook)
+    monkeypatch.setattr(rex, "_run_work_unit", unit_hook)
+    monkeypatch.setattr(sq._Worker, "run", run_hook)
+    common = ["--episodes", "5", "--max_steps", "12", "--seed", "3"]
+    parser = rex.build_parser()
+    args = parser.parse_args([*common, "--chunk_episodes", "2", "--out_dir", str(tmp_path / "queued")])
+    sq.run_local(str(tmp_path / "q"), args, None, 3, lease_s=lease_s, poll_s=0.05)
+    assert os.path.exists(sync / "kept") and not os.path.exists(sync / "lost")
+    assert "after its lease had been taken over" in capfd.readouterr().out
+    assert os.listdir(tmp_path / "q" / "claims") == []
+    serial = run_sweep(tmp_path / "serial", *common)
+    assert read_outputs(str(tmp_path / "queued")) == read_outputs(serial)
+
+def test_failing_unit_releases_claim_and_stops_workers(tmp_path, monkeypatch):
+    queue, ids = _publish(tmp_path)
+
+    def failing_unit(unit):
+        raise RuntimeError("unit failed")
+    monkeypatch.setattr(rex, "_run_work_unit", failing_unit)
+    with pytest.raises(RuntimeError, match="unit failed"):
+        sq.work(queue, "a", lease_s=60.0, poll_s=0.01)
+    assert os.listdir(os.path.join(queue, "claims")) == []
+    assert sq.status(queue)["failed"] == 1
+    # the other workers stop on their next scan instead of waiting out a 60 s lease
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match="units failed"):
+        sq.work(queue, "b", lease_s=60.0, poll_s=0.01)
+    assert time.monotonic() - start < 5
+    with pytest.raises(RuntimeError, match="1 failed"):
+        sq.merge(queue)
@@ -0,0 +1,81 @@
+# test_trajectory.py
+"""
+Tests for the chunked trajectory sinks: files stay complete when a run raises, and shard
+concatenation matches a single sink (including the all-empty case).
+Run with: python -m pytest -q
+"""
+import csv
+
+import pytest
+
+import run
+import run_attacks
+from trajectory import open_sink, concat_files, TrajReader
+
+ROWS = [{"episode": i // 5, "step": i % 5, "action": "UP", "reward": -0.05} for i in range(23)]
+
+def _failing_policy(calls: int):
+    """rule_based_policy stand-in that raises on call number `calls`."""
+    count = [0]
+
+    def policy(s_repr, m_text):
+        count[0] += 1
+        if count[0] >= calls:
+            raise RuntimeError("policy failed")
+        return "RIGHT"
+    return policy
+
+def _read_rows(path: str, fmt: str):
+    if fmt == "csv":
+        with open(path, newline="") as fh:
+            return list(csv.DictReader(fh))
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_table(path).to_pylist()
+    with TrajReader(path) as reader:
+        columns = reader.read()
+        return [dict(zip(columns, values)) for values in zip(*(v.tolist() for v in columns.values()))]
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet", "traj"])
+def test_sink_is_closed_when_run_raises(tmp_path, monkeypatch, fmt):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(run, "rule_based_policy", _failing_policy(31))
+    out = str(tmp_path / f"day1.{fmt}")
+    with pytest.raises(RuntimeError):
+        run.run_episodes(n_episodes=5, max_steps=10, out_csv=out, raw_format=fmt, chunk_rows=7)
+    # the 30 steps taken before the failure were flushed into a readable file
+    assert [int(r["step"]) for r in _read_rows(out, fmt)] == [s for _ in range(3) for s in range(10)]
+
+    monkeypatch.setattr(run_attacks, "rule_based_policy", _failing_policy(12))
+    with pytest.raises(RuntimeError):
+        run_attacks.run_for_attack("direct", 3, 10, str(tmp_path / "attacks"), raw_format=fmt, chunk_rows=4)
+    assert len(_read_rows(str(tmp_path / "attacks" / f"raw_direct.{fmt}"), fmt)) == 11
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet", "traj"])
+def test_concat_matches_single_sink(tmp_path, fmt):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    single = str(tmp_path / f"single.{fmt}")
+    with open_sink(single, fmt, chunk_rows=4) as sink:
+        for row in ROWS:
+            sink.write(row)
+    parts = []
+    for k, (start, stop) in enumerate([(0, 10), (10, 10), (10, 23)]):
+        parts.append(str(tmp_path / f"part{k}.{fmt}"))
+        with open_sink(parts[-1], fmt, chunk_rows=4) as sink:
+            for row in ROWS[start:stop]:
+                sink.write(row)
+    merged = str(tmp_path / f"merged.{fmt}")
+    concat_files(parts, merged, fmt)
+    assert _read_rows(merged, fmt) == _read_rows(single, fmt)
+
+def test_concat_all_empty_parquet_writes_empty_table(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    parts = []
+    for k in range(2):
+        parts.append(str(tmp_path / f"part{k}.parquet"))
+        open_sink(parts[-1], "parquet").close()
+    merged = str(tmp_path / "merged.parquet")
+    concat_files(parts + [str(tmp_path / "missing.parquet")], merged, "parquet")
+    assert pq.read_table(merged).num_rows == 0
@@ -0,0 +1,510 @@
+# trajectory.py
+"""
+Streaming sinks for per-step trajectory logs.
+
+The runners used to append one dict per step to a list and build a DataFrame at the end.
+A sink instead buffers at most chunk_rows steps in columnar form (one list per column)
+and flushes every full chunk to disk, so memory stays flat however many episodes run and
+everything flushed before a crash is already on disk.
+
+Provides:
+- TrajectorySink: base class (write(row), write_columns(columns), flush(), close())
+- CsvSink: appends chunks to a CSV file, header written once
+- ParquetSink: writes each chunk as a Parquet row group (requires pyarrow)
+- TrajSink / TrajReader: compact binary columnar format (.traj) and its memory-mapped reader
+- open_sink(path, fmt): build a sink by format name
+- concat_files(parts, out_path, fmt): merge shard files written by parallel workers
+- traj_to_csv(path, out_csv): export a .traj file as the CSV CsvSink would have written
+
+The .traj layout: an 8-byte magic, the length of a JSON header (uint64 LE), the header,
+then 64-byte aligned data blocks. The header indexes every block by offset from the
+start of the data area: one fixed-width little-endian array per numeric column, int32
+codes per string column plus its table of distinct values (UTF-8 blob and int64 end
+offsets, code = position in the table), and an (episode, first row) index when the
+'episode' column holds contiguous runs. Messages and actions repeat on every step, so
+string columns shrink to four bytes per row.
+"""
+import csv
+import json
+import os
+import shutil
+import struct
+import tempfile
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+SINK_FORMATS = ["csv", "parquet", "traj"]
+DEFAULT_CHUNK_ROWS = 65536
+
+TRAJ_MAGIC = b"TRAJv1\x00\x00"
+_TRAJ_ALIGN = 64
+
+class TrajectorySink:
+    """
+    Columnar step buffer flushed to disk every chunk_rows rows.
+    The column set is fixed by the first row (or first column batch) written.
+    Subclasses implement _write_chunk(columns, n_rows) and _close().
+    """
+    def __init__(self, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        self.path = path
+        self.chunk_rows = max(1, chunk_rows)
+        self.columns: List[str] | None = None
+        self.rows_written = 0
+        self._buffer: Dict[str, List[Any]] = {}
+        self._buffered = 0
+        out_dir = os.path.dirname(path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+    def _init_columns(self, names: Sequence[str]):
+        self.columns = list(names)
+        self._buffer = {c: [] for c in self.columns}
+
+    def write(self, row: Dict[str, Any]):
+        """Buffer one step row (dict column -> value)."""
+        if self.columns is None:
+            self._init_columns(row.keys())
+        for c in self.columns:
+            self._buffer[c].append(row[c])
+        self._buffered += 1
+        if self._buffered >= self.chunk_rows:
+            self.flush()
+
+    def write_columns(self, columns: Dict[str, Any]):
+        """
+        Buffer many rows given column-wise (dict column -> sequence or scalar).
+        Scalars are broadcast to the length of the sequence columns.
+        """
+        if self.columns is None:
+            self._init_columns(columns.keys())
+        n = max((len(v) for v in columns.values() if not isinstance(v, (str, bytes, int, float, bool))), default=0)
+        start = 0
+        while start < n:
+            take = min(n - start, self.chunk_rows - self._buffered)
+            for c in self.columns:
+                v = columns[c]
+                if isinstance(v, (str, bytes, int, float, bool)):
+                    self._buffer[c].extend([v] * take)
+                elif hasattr(v, "tolist"):
+                    # NumPy arrays: convert to Python scalars (same text as DataFrame.to_csv)
+                    self._buffer[c].extend(v[start:start + take].tolist())
+                else:
+                    self._buffer[c].extend(v[start:start + take])
+            self._buffered += take
+            start += take
+            if self._buffered >= self.chunk_rows:
+                self.flush()
+
+    def flush(self):
+        """Write buffered rows to disk and clear the buffer."""
+        if self._buffered == 0:
+            return
+        self._write_chunk(self._buffer, self._buffered)
+        self.rows_written += self._buffered
+        self._buffer = {c: [] for c in self.columns}
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def _write_chunk(self, columns: Dict[str, List[Any]], n_rows: int):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class CsvSink(TrajectorySink):
+    """Append-only CSV sink; the output matches DataFrame.to_csv(index=False) for the same rows."""
+    def __init__(self, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        super().__init__(path, chunk_rows)
+        self._fh = open(path, "w", newline="")
+        # pandas writes os.linesep between rows; keep files byte-compatible with to_csv
+        self._writer = csv.writer(self._fh, lineterminator=os.linesep)
+        self._header_written = False
+
+    def _write_chunk(self, columns, n_rows):
+        if not self._header_written:
+            self._writer.writerow(self.columns)
+            self._header_written = True
+        self._writer.writerows(zip(*(columns[c] for c in self.columns)))
+        self._fh.flush()
+
+    def _close(self):
+        if not self._fh.closed:
+            self._fh.close()
+
+class ParquetSink(TrajectorySink):
+    """Parquet sink writing one row group per flushed chunk. Requires pyarrow."""
+    def __init__(self, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("ParquetSink requires pyarrow (pip install pyarrow)") from e
+        super().__init__(path, chunk_rows)
+        self._pa = pa
+        self._pq = pq
+        self._writer = None
+
+    def _write_chunk(self, columns, n_rows):
+        pa = self._pa
+        if self._writer is None:
+            table = pa.Table.from_pydict({c: columns[c] for c in self.columns})
+            self._writer = self._pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = pa.Table.from_pydict({c: columns[c] for c in self.columns}, schema=self._writer.schema)
+        self._writer.write_table(table)
+
+    def _close(self):
+        if self._writer is None:
+            # no rows: still leave a readable file (empty table; column types unknown -> null)
+            pa = self._pa
+            schema = pa.schema([(c, pa.null()) for c in self.columns or []])
+            self._pq.write_table(schema.empty_table(), self.path)
+            return
+        self._writer.close()
+        self._writer = None
+
+def _traj_align(n: int) -> int:
+    return (n + _TRAJ_ALIGN - 1) // _TRAJ_ALIGN * _TRAJ_ALIGN
+
+def _traj_dtype(value: Any) -> np.dtype | None:
+    """Storage dtype for a column whose first value is value; None means dictionary-encoded string."""
+    if isinstance(value, str):
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return np.dtype("?")
+    if isinstance(value, (int, np.integer)):
+        return np.dtype("<i8")
+    if isinstance(value, (float, np.floating)):
+        return np.dtype("<f8")
+    raise TypeError(f"cannot store {type(value).__name__} values in a trajectory file")
+
+class TrajSink(TrajectorySink):
+    """
+    Binary columnar sink (.traj, see the module docstring for the layout).
+    Column types are fixed by the first chunk: str -> dictionary-encoded, bool -> bool,
+    int -> int64, float -> float64. Each flushed chunk is appended to one spill file per
+    column next to path; close() assembles the final file and removes the spill files,
+    so memory stays bounded by chunk_rows plus the string tables.
+    """
+    def __init__(self, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        super().__init__(path, chunk_rows)
+        self._spill_dir = tempfile.mkdtemp(prefix=".traj-", dir=os.path.dirname(path) or ".")
+        self._spill: Dict[str, Any] = {}
+        self._dtypes: Dict[str, np.dtype] = {}
+        self._tables: Dict[str, Dict[str, int]] = {}  # string column -> {value: code}
+
+    def _spill_path(self, column: str) -> str:
+        return os.path.join(self._spill_dir, f"{self.columns.index(column)}.bin")
+
+    def _append(self, column: str, values: np.ndarray):
+        fh = self._spill.get(column)
+        if fh is None:
+            fh = self._spill[column] = open(self._spill_path(column), "wb")
+        fh.write(np.ascontiguousarray(values).tobytes())
+
+    def _encode(self, column: str, values: Sequence[str]) -> np.ndarray:
+        lookup = self._tables[column]
+        return np.array([lookup.setdefault(v, len(lookup)) for v in values], dtype="<i4")
+
+    def _set_type(self, column: str, dtype: np.dtype | None):
+        if dtype is None:
+            self._dtypes[column] = np.dtype("<i4")
+            self._tables[column] = {}
+        else:
+            self._dtypes[column] = dtype
+
+    def _write_chunk(self, columns, n_rows):
+        for c in self.columns:
+            values = columns[c]
+            if c not in self._dtypes:
+                self._set_type(c, _traj_dtype(values[0]))
+            if c in self._tables:
+                self._append(c, self._encode(c, values))
+            else:
+                arr = np.asarray(values)
+                if not np.can_cast(arr.dtype, self._dtypes[c], "same_kind"):
+                    raise TypeError(f"column {c!r} is stored as {self._dtypes[c]}, got {arr.dtype} values")
+                self._append(c, arr.astype(self._dtypes[c], copy=False))
+
+    def write_traj(self, reader: "TrajReader"):
+        """Append every row of an open TrajReader; string columns are re-coded, never decoded per row."""
+        if len(reader) == 0:
+            return
+        self.flush()
+        if self.columns is None:
+            self._init_columns(reader.columns)
+        elif reader.columns != self.columns:
+            raise ValueError(f"{reader.path} has columns {reader.columns}, expected {self.columns}")
+        for c in self.columns:
+            if c not in self._dtypes:
+                self._set_type(c, None if reader.is_string(c) else reader.dtype(c))
+            if c in self._tables:
+                remap = self._encode(c, reader.table(c))
+                codes = reader.codes(c)
+                for start in range(0, len(codes), self.chunk_rows):
+                    self._append(c, remap[codes[start:start + self.chunk_rows]])
+            else:
+                self._append(c, reader.column(c).astype(self._dtypes[c], copy=False))
+        self.rows_written += len(reader)
+
+    def _close(self):
+        if self._spill_dir is None:
+            return
+        try:
+            for fh in self._spill.values():
+                fh.close()
+            self._assemble()
+        finally:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    def _assemble(self):
+        blocks: List[Tuple[int, Any]] = []  # (offset in the data area, bytes or spill file path)
+        end = 0
+
+        def add(src: Any, nbytes: int) -> int:
+            nonlocal end
+            offset = end
+            blocks.append((offset, src))
+            end = _traj_align(offset + nbytes)
+            return offset
+
+        header: Dict[str, Any] = {"version": 1, "rows": self.rows_written, "columns": [], "episode_index": None}
+        for c in (self.columns or []) if self.rows_written else []:
+            path = self._spill_path(c)
+            nbytes = os.path.getsize(path)
+            entry = {"name": c, "dtype": self._dtypes[c].str, "offset": add(path, nbytes), "nbytes": nbytes}
+            if c in self._tables:
+                encoded = [v.encode("utf-8") for v in self._tables[c]]  # dict order == code order
+                ends = np.cumsum([len(b) for b in encoded], dtype="<i8")
+                data = b"".join(encoded)
+                entry["table"] = {"size": len(encoded), "ends": add(ends.tobytes(), ends.nbytes),
+                                  "data": add(data, len(data)), "data_nbytes": len(data)}
+            header["columns"].append(entry)
+        if self.rows_written and self._dtypes.get("episode") == np.dtype("<i8"):
+            episodes = np.fromfile(self._spill_path("episode"), dtype="<i8")
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(episodes)) + 1])
+            ids = episodes[starts]
+            if len(np.unique(ids)) == len(ids):
+                index = np.stack([ids, starts], axis=1).astype("<i8")
+                header["episode_index"] = {"size": len(ids), "offset": add(index.tobytes(), index.nbytes)}
+
+        blob = json.dumps(header).encode()
+        data_start = _traj_align(len(TRAJ_MAGIC) + 8 + len(blob))
+        with open(self.path, "wb") as out:
+            out.write(TRAJ_MAGIC)
+            out.write(struct.pack("<Q", len(blob)))
+            out.write(blob)
+            for offset, src in blocks:
+                out.seek(data_start + offset)
+                if isinstance(src, bytes):
+                    out.write(src)
+                else:
+                    with open(src, "rb") as fh:
+                        shutil.copyfileobj(fh, out)
+
+class TrajReader:
+    """
+    Memory-mapped reader for .traj files. Nothing is loaded up front: numeric columns are
+    read-only views into the map, string columns are int32 code views plus a table of
+    distinct values decoded on first use, so slicing a few episodes touches only their pages.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as fh:
+            if fh.read(len(TRAJ_MAGIC)) != TRAJ_MAGIC:
+                raise ValueError(f"{path} is not a trajectory file")
+            (n,) = struct.unpack("<Q", fh.read(8))
+            self.header = json.loads(fh.read(n))
+        self._data_start = _traj_align(len(TRAJ_MAGIC) + 8 + n)
+        self._mm = np.memmap(path, dtype=np.uint8, mode="r")
+        self._meta = {c["name"]: c for c in self.header["columns"]}
+        self.columns: List[str] = [c["name"] for c in self.header["columns"]]
+        self._tables: Dict[str, np.ndarray] = {}
+        self._episode_rows: Dict[int, Tuple[int, int]] | None = None
+
+    def __len__(self) -> int:
+        return self.header["rows"]
+
+    def _block(self, offset: int, nbytes: int, dtype: str) -> np.ndarray:
+        start = self._data_start + offset
+        return self._mm[start:start + nbytes].view(dtype)
+
+    def is_string(self, name: str) -> bool:
+        return "table" in self._meta[name]
+
+    def dtype(self, name: str) -> np.dtype:
+        return np.dtype(self._meta[name]["dtype"])
+
+    def codes(self, name: str) -> np.ndarray:
+        """int32 codes of a string column (view into the map)."""
+        meta = self._meta[name]
+        if "table" not in meta:
+            raise TypeError(f"column {name!r} is not a string column")
+        return self._block(meta["offset"], meta["nbytes"], meta["dtype"])
+
+    def table(self, name: str) -> np.ndarray:
+        """Distinct values of a string column as an object array; table[code] is the string."""
+        if name not in self._tables:
+            t = self._meta[name]["table"]
+            ends = self._block(t["ends"], 8 * t["size"], "<i8")
+            data = bytes(self._block(t["data"], t["data_nbytes"], "u1"))
+            values = np.empty(t["size"], dtype=object)
+            start = 0
+            for i, stop in enumerate(ends.tolist()):
+                values[i] = data[start:stop].decode("utf-8")
+                start = stop
+            self._tables[name] = values
+        return self._tables[name]
+
+    def column(self, name: str, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """Rows start..stop-1 of a column: a view for numeric columns, decoded strings otherwise."""
+        meta = self._meta[name]
+        if "table" in meta:
+            return self.table(name)[self.codes(name)[start:stop]]
+        return self._block(meta["offset"], meta["nbytes"], meta["dtype"])[start:stop]
+
+    def read(self, start: int = 0, stop: int | None = None, columns: Sequence[str] | None = None) -> Dict[str, np.ndarray]:
+        """{column: values} for rows start..stop-1."""
+        return {c: self.column(c, start, stop) for c in (columns or self.columns)}
+
+    def episode_rows(self, episode: int) -> Tuple[int, int]:
+        """(first row, stop row) of an episode, from the header index when present."""
+        if self._episode_rows is None:
+            index = self.header["episode_index"]
+            if index is not None:
+                pairs = self._block(index["offset"], 16 * index["size"], "<i8").reshape(-1, 2)
+                stops = np.append(pairs[1:, 1], len(self))
+                self._episode_rows = dict(zip(pairs[:, 0].tolist(), zip(pairs[:, 1].tolist(), stops.tolist())))
+            else:
+                self._episode_rows = {}
+        if episode in self._episode_rows:
+            return self._episode_rows[episode]
+        rows = np.flatnonzero(self.column("episode") == episode)
+        if len(rows) == 0:
+            raise KeyError(f"episode {episode} not in {self.path}")
+        if rows[-1] - rows[0] + 1 != len(rows):
+            raise ValueError(f"episode {episode} is not stored contiguously in {self.path}")
+        return int(rows[0]), int(rows[-1]) + 1
+
+    def episode(self, episode: int, columns: Sequence[str] | None = None) -> Dict[str, np.ndarray]:
+        """All rows of one episode."""
+        return self.read(*self.episode_rows(episode), columns=columns)
+
+    def to_pandas(self, start: int = 0, stop: int | None = None, columns: Sequence[str] | None = None):
+        """DataFrame of rows start..stop-1; string columns become pandas Categoricals over their tables."""
+        import pandas as pd
+        data = {}
+        for c in (columns or self.columns):
+            if self.is_string(c):
+                data[c] = pd.Categorical.from_codes(self.codes(c)[start:stop], categories=pd.Index(self.table(c), dtype=object))
+            else:
+                data[c] = self.column(c, start, stop)
+        return pd.DataFrame(data)
+
+    def close(self):
+        self._mm = None
+        self._tables.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def traj_to_csv(path: str, out_csv: str, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    """Export a .traj file to CSV, streaming chunk_rows rows at a time (same bytes as CsvSink)."""
+    with TrajReader(path) as reader, CsvSink(out_csv, chunk_rows) as sink:
+        for start in range(0, len(reader), chunk_rows):
+            sink.write_columns(reader.read(start, start + chunk_rows))
+
+def open_sink(path: str, fmt: str = "csv", chunk_rows: int = DEFAULT_CHUNK_ROWS) -> TrajectorySink:
+    """Return a sink for fmt ('csv', 'parquet' or 'traj') writing to path."""
+    fmt = fmt.lower()
+    if fmt == "csv":
+        return CsvSink(path, chunk_rows)
+    if fmt == "parquet":
+        return ParquetSink(path, chunk_rows)
+    if fmt == "traj":
+        return TrajSink(path, chunk_rows)
+    raise ValueError(f"Unknown trajectory format: {fmt}")
+
+def sink_path(out_dir: str, stem: str, fmt: str = "csv") -> str:
+    """Output path for a raw log, e.g. sink_path('results', 'raw_direct_none', 'parquet')."""
+    return os.path.join(out_dir, f"{stem}.{fmt.lower()}")
+
+def concat_files(parts: List[str], out_path: str, fmt: str = "csv", remove_parts: bool = True):
+    """
+    Concatenate shard files (in the given order) into out_path without loading them fully.
+    Shards that contain no rows are skipped; out_path is written even when all of them are empty.
+    """
+    fmt = fmt.lower()
+    if fmt == "csv":
+        with open(out_path, "wb") as out:
+            header_written = False
+            for part in parts:
+                with open(part, "rb") as fh:
+                    header = fh.readline()
+                    if not header:
+                        continue
+                    if not header_written:
+                        out.write(header)
+                        header_written = True
+                    shutil.copyfileobj(fh, out)
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for part in parts:
+                if not os.path.exists(part):
+                    continue
+                pf = pq.ParquetFile(part)
+                for i in range(pf.num_row_groups):
+                    if pf.metadata.row_group(i).num_rows == 0:
+                        continue
+                    table = pf.read_row_group(i)
+                    if writer is None:
+                        writer = pq.ParquetWriter(out_path, table.schema)
+                    writer.write_table(table)
+            if writer is None:
+                # every shard is empty: write an empty table with the shards' schema (like CSV's empty file)
+                schemas = [pq.read_schema(p) for p in parts if os.path.exists(p)]
+                schema = max(schemas, key=len, default=None)
+                if schema is None:
+                    import pyarrow as pa
+                    schema = pa.schema([])
+                pq.write_table(schema.empty_table(), out_path)
+        finally:
+            if writer is not None:
+                writer.close()
+    elif fmt == "traj":
+        with TrajSink(out_path) as sink:
+            for part in parts:
+                if os.path.exists(part):
+                    with TrajReader(part) as reader:
+                        sink.write_traj(reader)
+    else:
+        raise ValueError(f"Unknown trajectory format: {fmt}")
+    if remove_parts:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export a .traj trajectory file to CSV")
+    parser.add_argument("traj", type=str)
+    parser.add_argument("out_csv", type=str)
+    args = parser.parse_args()
+    traj_to_csv(args.traj, args.out_csv)
+    print(f"[+] Wrote {args.out_csv}")